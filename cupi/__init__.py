@@ -5,7 +5,10 @@ from .application import *
 
 __version__ = '0.1.0'
 
-__all__ = ['DocumentObject',
+__all__ = ['DocumentCore',
+           'ListCore',
+           'MapCore',
+           'DocumentObject',
            'ListObject',
            'MapObject',
            'Property',
@@ -55,10 +55,11 @@ class App(qtw.QApplication):
         return cls.__subclasses__() + [desc for base in cls.__subclasses__() for desc in App._all_subclasses(base)]
 
     def register_subclasses(self, *args):
-        """Registers all subclasses of cls with the QML engine."""
-        for cls in args:
-            for sub in App._all_subclasses(cls):
-                self.register_class(sub)
+        """Registers all subclasses of cls with the QML engine. Classes reached through more than one base (such as
+        ObjectModel) are only registered once."""
+        subclasses = dict.fromkeys(sub for cls in args for sub in App._all_subclasses(cls))
+        for sub in subclasses:
+            self.register_class(sub)
 
     def register_class(self, cls):
         """Registers a class with the QML engine."""
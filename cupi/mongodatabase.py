@@ -2,8 +2,13 @@ import cachetools
 import collections
 import itertools
 import pymongo
+import re
+import struct
 import bson
+import bson.errors
 from bson import ObjectId
+from bson.int64 import Int64
+from bson.raw_bson import RawBSONDocument
 from bson.json_util import dumps as json_dumps
 from bson.codec_options import CodecOptions
 from tzlocal import get_localzone
@@ -13,6 +18,121 @@ import PyQt5.QtCore as qtc
 import PyQt5.QtQml as qtq
 
 
+_pack_int = struct.Struct('<i').pack
+_pack_double = struct.Struct('<d').pack
+_pack_long = struct.Struct('<q').pack
+_unpack_int = struct.Struct('<i').unpack_from
+
+# Sizes of the BSON element types with fixed-size values, by type byte
+_BSON_FIXED_SIZES = {0x01: 8, 0x06: 0, 0x07: 12, 0x08: 1, 0x09: 8, 0x0A: 0, 0x10: 4, 0x11: 8, 0x12: 8, 0x13: 16,
+                     0x7F: 0, 0xFF: 0}
+
+
+def _raw_elements(data):
+    """Yields (key, start, end) for each element of the BSON document in data (bytes), where data[start:end] is the
+    whole element: type byte, key and value. Only the element headers are read; no values are decoded."""
+    pos, last = 4, _unpack_int(data, 0)[0] - 1
+    while pos < last:
+        kind, key_end = data[pos], data.index(b'\x00', pos + 1)
+        value = key_end + 1
+
+        if kind in _BSON_FIXED_SIZES:
+            end = value + _BSON_FIXED_SIZES[kind]
+        elif kind in (0x02, 0x0D, 0x0E):
+            end = value + 4 + _unpack_int(data, value)[0]
+        elif kind in (0x03, 0x04, 0x0F):
+            end = value + _unpack_int(data, value)[0]
+        elif kind == 0x05:
+            end = value + 5 + _unpack_int(data, value)[0]
+        elif kind == 0x0B:
+            end = data.index(b'\x00', data.index(b'\x00', value) + 1) + 1
+        elif kind == 0x0C:
+            end = value + 16 + _unpack_int(data, value)[0]
+        else:
+            raise bson.errors.InvalidBSON('unknown element type 0x%02x' % kind)
+
+        yield data[pos + 1:key_end].decode(), pos, end
+        pos = end
+
+
+########################################################################################################################
+
+
+class RawDocument(collections.MutableMapping):
+    """A view of a RawBSONDocument with unescaped keys, used as the saved state of MapObjects loaded by a raw
+    MongoObjectCursor (see MapCore.from_mapping()). Values are converted the first time they are read: embedded
+    documents become RawDocuments themselves, so their contents stay undecoded until they are accessed.
+
+    Existing keys can be reassigned (MapCore stores converted values this way), but keys can't be added or removed.
+    """
+    __slots__ = ('_raw', '_keys', '_values')
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._keys = None
+        self._values = {}
+
+    @property
+    def raw(self):
+        """The undecoded BSON bytes."""
+        return self._raw.raw
+
+    def matching_keys(self, pattern):
+        """Returns the (unescaped) keys of the fields whose raw BSON, including the field's own name, matches the
+        compiled bytes pattern. Values are not decoded."""
+        raw = self.raw
+        data = raw if isinstance(raw, bytes) else bytes(raw)
+        if not pattern.search(data):
+            return []
+
+        unescape = MongoDatabase._unescape_map
+        return [key.translate(unescape) for key, start, end in _raw_elements(data)
+                if pattern.search(data, start, end)]
+
+    def _key_map(self):
+        """Returns a dict relating unescaped keys to the keys in the raw document."""
+        if self._keys is None:
+            unescape = MongoDatabase._unescape_map
+            self._keys = {key.translate(unescape): key for key in self._raw}
+
+        return self._keys
+
+    @staticmethod
+    def _convert(value):
+        """Wraps embedded documents, including those inside of arrays."""
+        if isinstance(value, RawBSONDocument):
+            return RawDocument(value)
+        elif isinstance(value, list):
+            return [RawDocument._convert(v) for v in value]
+        else:
+            return value
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            value = self._values[key] = self._convert(self._raw[self._key_map()[key]])
+            return value
+
+    def __setitem__(self, key, value):
+        if key not in self._key_map():
+            raise TypeError('Keys can\'t be added to a RawDocument.')
+
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        raise TypeError('Keys can\'t be removed from a RawDocument.')
+
+    def __contains__(self, key):
+        return key in self._key_map()
+
+    def __iter__(self):
+        return iter(self._key_map())
+
+    def __len__(self):
+        return len(self._key_map())
+
+
 ########################################################################################################################
 
 
@@ -134,16 +254,22 @@ class MongoObjectCursor(qtc.QObject):
     """Automatically converts documents from a pymongo cursor to the appropriate subclass of
     MapObject. Also provides a few convenience methods, and the ability for use from within QML.
     """
-    def __init__(self, cursor, database=None, default_type=None, **kwargs):
+    def __init__(self, cursor, database=None, default_type=None, lazy=True, **kwargs):
         """Initialize the cursor object. cursor is the (unused) pymongo cursor to wrap. New objects
         will be of type MapObject if their type can't be determined from their document's contents,
-        unless an alternative is provided with default_type."""
+        unless an alternative is provided with default_type. If lazy is True (the default), nested
+        documents are only converted to MapObjects and ListObjects when they are accessed.
+
+        If the pymongo cursor returns RawBSONDocuments (see MongoDatabase.getCursor()), each object
+        reads its fields straight from the raw document, and embedded documents are only decoded and
+        unescaped when they are accessed."""
         super().__init__(**kwargs)
         self._cursor = cursor
         self._database = database
         self._count = cursor.count()
         self._it = iter(cursor)
         self._default_type = default_type
+        self._lazy = lazy
         self._parent = kwargs.get('parent', None)
         self._done = False
 
@@ -158,8 +284,13 @@ class MongoObjectCursor(qtc.QObject):
     def __next__(self):
         try:
             doc = next(self._it)
+            if isinstance(doc, RawBSONDocument):
+                doc = MapCore.from_mapping(RawDocument(doc))
+
             if doc is not None:
-                obj = MapObject.from_document(MongoDatabase.unescaped(doc), default_type=self._default_type)
+                obj = MapObject.from_document(doc if isinstance(doc, MapCore) else MongoDatabase.unescaped(doc),
+                                              default_type=self._default_type,
+                                              lazy=self._lazy)
                 if self._database is not None:
                     self._database.getAllReferencedObjects(obj)
 
@@ -174,6 +305,26 @@ class MongoObjectCursor(qtc.QObject):
     def __len__(self):
         return self._count
 
+    def fetch(self, count):
+        """Returns a list with the next count objects (or fewer, if the cursor runs out). The objects are created
+        together, with MapObject.from_documents()."""
+        docs = []
+        for doc in itertools.islice(self._it, count):
+            if isinstance(doc, RawBSONDocument):
+                docs.append(MapCore.from_mapping(RawDocument(doc)))
+            elif doc is not None:
+                docs.append(MongoDatabase.unescaped(doc))
+
+        if len(docs) < count:
+            self._done = True
+
+        objects = MapObject.from_documents(docs, default_type=self._default_type, lazy=self._lazy)
+        if self._database is not None:
+            for obj in objects:
+                self._database.getAllReferencedObjects(obj)
+
+        return objects
+
     @qtc.pyqtSlot(result=qtc.QObject)
     def next(self):
         """Return the next object in the sequence, or None."""
@@ -222,20 +373,18 @@ class CursorObjectModel(ObjectModel):
     @qtc.pyqtSlot()
     def fetchMore(self, parent_idx=qtc.QModelIndex()):
         """Add another page of objects from the cursor to the model."""
-        new = []
-        for i in range(self._page_size):
-            obj = self._cursor.next()
-            if obj is None:
-                break
+        new = self._cursor.fetch(self._page_size)
+        if not new:
+            return
+
+        for obj in new:
             self._connect_to(obj)
             obj.setParent(self)
-            new.append(obj)
 
         length = len(self)
-        newlength = length + len(new)
-        self.beginInsertRows(qtc.QModelIndex(), length, newlength)
-        self._original.extend(new)
-        self._copy.extend(new)
+        self.beginInsertRows(qtc.QModelIndex(), length, length + len(new) - 1)
+        self._core._extend_saved(new)
+        self._rows_inserted(length, len(new))
         self.endInsertRows()
 
     @qtc.pyqtSlot(result=int)
@@ -252,6 +401,94 @@ class CursorObjectModel(ObjectModel):
 class MongoDatabase(qtc.QObject):
     """MongoDatabase provides integration between Mongo, Qt/QML, and qp."""
 
+    _encode_map = str.maketrans('$.', ''.join([chr(65284), chr(65294)]))
+    _unescape_map = str.maketrans(''.join([chr(65284), chr(65294)]), '$.')
+
+    @staticmethod
+    def encoded(doc, _id=None):
+        """Returns doc (a MapObject, ListObject or mapping) encoded as BSON, with reserved characters in keys escaped
+        like escaped() does. The document tree is walked once, and no intermediate dicts are built. If _id is
+        provided, it is written as the first field, replacing any _id in doc."""
+        buf = bytearray()
+        MongoDatabase._encode_document(buf, doc, _id=_id)
+        return bytes(buf)
+
+    @staticmethod
+    def _encode_document(buf, doc, is_array=False, _id=None):
+        """Appends doc to buf as a BSON document (or array, if is_array is True). The most common value types are
+        written inline; anything else goes through _encode_element()."""
+        doc = DocumentCore._as_core(doc)
+        start = len(buf)
+        buf += b'\x00\x00\x00\x00'
+
+        if is_array:
+            items = ((str(idx), value) for idx, value in enumerate(doc._copy if isinstance(doc, ListCore) else doc))
+        else:
+            items = doc._raw_items() if isinstance(doc, MapCore) else doc.items()
+
+            if _id is not None:
+                MongoDatabase._encode_element(buf, b'_id', _id)
+                items = ((key, value) for key, value in items if key != '_id')
+
+        escape, pack_int, pack_double = MongoDatabase._encode_map, _pack_int, _pack_double
+        encode_document, encode_element = MongoDatabase._encode_document, MongoDatabase._encode_element
+
+        for key, value in items:
+            if type(key) is not str:
+                raise bson.errors.InvalidDocument('documents must have only string keys, key was %r' % (key,))
+
+            name = key.translate(escape).encode('utf-8') if not is_array else key.encode('ascii')
+            value_type = type(value)
+
+            if value_type is str:
+                data = value.encode('utf-8')
+                buf += b'\x02' + name + b'\x00' + pack_int(len(data) + 1) + data + b'\x00'
+            elif value_type is int and -2 ** 31 <= value < 2 ** 31:
+                buf += b'\x10' + name + b'\x00' + pack_int(value)
+            elif value_type is float:
+                buf += b'\x01' + name + b'\x00' + pack_double(value)
+            elif value_type is MapCore or value_type is dict:
+                buf += b'\x03' + name + b'\x00'
+                encode_document(buf, value)
+            elif value_type is ListCore or value_type is list:
+                buf += b'\x04' + name + b'\x00'
+                encode_document(buf, value, is_array=True)
+            else:
+                encode_element(buf, name, value)
+
+        buf += b'\x00'
+        struct.pack_into('<i', buf, start, len(buf) - start)
+
+    @staticmethod
+    def _encode_element(buf, name, value):
+        """Appends a single BSON element to buf. Common types are written directly; anything else, including
+        subclasses of the common types (which bson may encode differently), is handed to the bson module."""
+        value_type = type(value)
+        if isinstance(value, (DocumentCore, DocumentObject)) or DocumentCore._needs_wrapping(value):
+            is_array = not isinstance(value, collections.Mapping)
+            buf += b'\x04' if is_array else b'\x03'
+            buf += name + b'\x00'
+            MongoDatabase._encode_document(buf, value, is_array=is_array)
+        elif value is None:
+            buf += b'\x0a' + name + b'\x00'
+        elif value_type is bool:
+            buf += b'\x08' + name + (b'\x00\x01' if value else b'\x00\x00')
+        elif value_type is int and -2 ** 31 <= value < 2 ** 31:
+            buf += b'\x10' + name + b'\x00' + _pack_int(value)
+        elif (value_type is int or value_type is Int64) and -2 ** 63 <= value < 2 ** 63:
+            buf += b'\x12' + name + b'\x00' + _pack_long(value)
+        elif value_type is float:
+            buf += b'\x01' + name + b'\x00' + _pack_double(value)
+        elif value_type is str:
+            data = value.encode('utf-8')
+            buf += b'\x02' + name + b'\x00' + _pack_int(len(data) + 1) + data + b'\x00'
+        elif value_type is ObjectId:
+            buf += b'\x07' + name + b'\x00' + value.binary
+        else:
+            # Encode a single-element document, and swap in the real name
+            element = bson.BSON.encode({'k': value})[4:-1]
+            buf += element[:1] + name + element[2:]
+
     @staticmethod
     def escaped(doc):
         """Return a new document, identical to doc except all reserved characters in dictionary keys are escaped
@@ -296,50 +533,100 @@ class MongoDatabase(qtc.QObject):
 
     @staticmethod
     def _updates(obj):
-        if isinstance(obj, ListObject):
+        obj = DocumentCore._as_core(obj)
+        if isinstance(obj, ListCore):
             return MongoDatabase._listobject_updates(obj)
-        elif isinstance(obj, MapObject):
+        elif isinstance(obj, MapCore):
             return MongoDatabase._mapobject_updates(obj)
         else:
             raise TypeError('%s is not a ListObject or MapObject.')
 
     @staticmethod
-    def _listobject_updates(obj):
-        """Build an update document from a ListObject."""
-        response = {'$set': {}, '$unset': {}}
-
-        original = obj.original
-
-        if len(obj) < len(original):
-            response['$set'].update({'': obj.document})
-        else:
-            for idx, item in enumerate(obj):
-                if isinstance(item, DocumentObject):
-                    if idx < len(original) and item is original[idx]:
-                        updates = MongoDatabase._updates(item)
-                        response['$set'].update({'%s.%s' % (idx, k): v for k, v in updates.get('$set', {}).items()})
-                        response['$unset'].update({'%s.%s' % (idx, k): v for k, v in updates.get('$unset', {}).items()})
-                    else:
-                        response['$set'].update({str(idx): item.document})
-                else:
-                    if idx >= len(original) or item != original[idx]:
-                        response['$set'].update({str(idx): item})
+    def _escaped_value(value):
+        """Returns value as a plain document with escaped keys. Strings and other scalars are returned unchanged."""
+        value = DocumentCore._plain(value)
+        if isinstance(value, (collections.Mapping, collections.Sequence)) and not isinstance(value, str):
+            return MongoDatabase.escaped(value)
 
-        if not response['$set']:
-            del response['$set']
+        return value
 
-        if not response['$unset']:
-            del response['$unset']
+    @staticmethod
+    def _merge_updates(response, prefix, updates):
+        """Adds the operators and fields in updates to response, prefixing each field path with prefix."""
+        for op, fields in updates.items():
+            response.setdefault(op, {}).update({('%s.%s' % (prefix, k)).rstrip('.'): v for k, v in fields.items()})
 
-        return response
+    @staticmethod
+    def _listobject_updates(obj):
+        """Build an update document from a ListObject. The list's operation log is used to express appends, inserts
+        and deletions with $push, $pop and $pull where possible. Because Mongo does not allow more than one operator
+        to touch the same array in an update, mixed changes fall back to a $set of the whole array."""
+        obj = DocumentCore._as_core(obj)
+        copy = obj._copy
+        summary = obj._summarize_ops()
+        kind = summary[0] if summary is not None else None
+        set_all = lambda: {'$set': {'': MongoDatabase._escaped_value(obj)}}
+
+        if kind == 'insert':
+            start, count, other = summary[1:]
+            block = copy[start:start + count]
+            block_ids = {id(item) for item in block}
+            other = other or any(id(child) not in block_ids for child in obj._dirty.values())
+
+            if not other:
+                push = {'$each': [MongoDatabase._escaped_value(item) for item in block]}
+                if start != obj._original_len():
+                    push['$position'] = start
+
+                return {'$push': {'': push}}
+            elif start != obj._original_len():
+                return set_all()
+
+        elif kind == 'delete':
+            removed = summary[1]
+            count, length = len(removed), len(copy)
+
+            if obj._dirty or not length:
+                return set_all()
+            elif removed == list(range(length, length + count)):
+                return {'$pop': {'': 1}} if count == 1 else {'$push': {'': {'$each': [], '$slice': length}}}
+            elif removed == list(range(count)):
+                return {'$pop': {'': -1}} if count == 1 else {'$push': {'': {'$each': [], '$slice': -length}}}
+
+            # $pull matches the stored elements, so it can't be used if a removed document has unsaved changes (its
+            # current contents are not what is stored). It also removes every matching element, so it can only be
+            # used if none of the remaining items match.
+            values = [obj._original_item(idx) for idx in removed]
+            if any(isinstance(value, DocumentCore) and value.modified for value in values) \
+                    or any(value in copy for value in values):
+                return set_all()
+
+            return {'$pull': {'': {'$in': [MongoDatabase._escaped_value(v) for v in values]}}}
+
+        elif kind is None:
+            return set_all()
+
+        # Only positions were assigned to, or items were appended along with other changes
+        response, length = {'$set': {}}, obj._original_len()
+        for idx, item in obj._raw_items():
+            original = obj._original_item(idx) if idx < length else None
+            if isinstance(item, DocumentCore) and idx < length and item is original:
+                if item.modified:
+                    MongoDatabase._merge_updates(response, str(idx), MongoDatabase._updates(item))
+            elif idx >= length or (item is not original and item != original):
+                response['$set'][str(idx)] = MongoDatabase._escaped_value(item)
+
+        return {op: fields for op, fields in response.items() if fields}
 
     @staticmethod
     def _mapobject_updates(obj):
         """Build an update document from a MapObject."""
         response = {'$set': {}, '$unset': {}}
+        obj = DocumentCore._as_core(obj)
         mods = obj.mods
 
-        for key, value in obj.items():
+        # Lazily stored values can't have been modified, so _raw_items() is used to avoid wrapping them
+        for key, value in obj._raw_items():
             if key in mods:
                 if isinstance(value, (collections.Mapping, collections.Sequence)) \
                         and not isinstance(value, str):
@@ -347,21 +634,13 @@ class MongoDatabase(qtc.QObject):
 
                 response['$set'].update({MongoDatabase.escaped(key): value})
             else:
-                if isinstance(value, DocumentObject) and value.modified:
-                    updates = MongoDatabase._updates(value)
-                    response['$set'].update({('%s.%s' % (MongoDatabase.escaped(key), k)).rstrip('.'): v for k, v in updates.get('$set', {}).items()})
-                    response['$unset'].update({'%s.%s' % (MongoDatabase.escaped(key), k): v for k, v in updates.get('$unset', {}).items()})
+                if isinstance(value, DocumentCore) and value.modified:
+                    MongoDatabase._merge_updates(response, MongoDatabase.escaped(key), MongoDatabase._updates(value))
 
         for key in obj.dels:
             response['$unset'].update({key: None})
 
-        if not response['$set']:
-            del response['$set']
-
-        if not response['$unset']:
-            del response['$unset']
-
-        return response
+        return {op: fields for op, fields in response.items() if fields}
 
     def __init__(self, *args, uri=None, db=None, maxsize=100, **kwargs):
         """Initialize the database object."""
@@ -450,7 +729,7 @@ class MongoDatabase(qtc.QObject):
         collection = self._db[_type.__collection__].with_options(codec_options=CodecOptions(tz_aware=True,
                                                                                             tzinfo=get_localzone()))
 
-        query, sort = (query.query.document, query.sort.document) if query is not None else ({}, {})
+        query, sort = (dict(query.query.document), query.sort.document) if query is not None else ({}, {})
         query['_type'] = {'$in': [_type.__name__] + _type.all_subclass_names()}
 
         doc = collection.find_one(query, modifiers={'$orderby': sort})
@@ -461,13 +740,16 @@ class MongoDatabase(qtc.QObject):
         return obj
 
     @qtc.pyqtSlot(str, MongoQuery, qtc.QObject, result=MongoObjectCursor)
-    def getCursor(self, _type, query=None, parent=None):
-        """Return a MongoObjectCursor resulting from the given query."""
+    def getCursor(self, _type, query=None, parent=None, raw=False):
+        """Return a MongoObjectCursor resulting from the given query. If raw is True, documents are fetched as
+        RawBSONDocuments, and the fields of each object are decoded when they are first accessed."""
         _type = MapObject.subtype(_type)
-        collection = self._db[_type.__collection__].with_options(codec_options=CodecOptions(tz_aware=True,
-                                                                                            tzinfo=get_localzone()))
+        codec_options = CodecOptions(document_class=RawBSONDocument if raw else dict,
+                                     tz_aware=True,
+                                     tzinfo=get_localzone())
+        collection = self._db[_type.__collection__].with_options(codec_options=codec_options)
 
-        query, sort = (query.query.document, query.sort.document) if query is not None else ({}, {})
+        query, sort = (dict(query.query.document), query.sort.document) if query is not None else ({}, {})
         query['_type'] = {'$in': [_type.__name__] + _type.all_subclass_names()}
 
         cursor = collection.find(query, modifiers={'$orderby': sort}, no_cursor_timeout=True)
@@ -475,10 +757,10 @@ class MongoDatabase(qtc.QObject):
         return MongoObjectCursor(cursor, database=self, default_type=_type, parent=parent)
 
     @qtc.pyqtSlot(str, MongoQuery, qtc.QObject, result=ObjectModel)
-    def getModel(self, _type, query=None, parent=None, **kwargs):
-        """Return the results of a query in an ObjectModel."""
+    def getModel(self, _type, query=None, parent=None, raw=False, **kwargs):
+        """Return the results of a query in an ObjectModel. raw is passed on to getCursor()."""
         _type = MapObject.subtype(_type)
-        cursor = self.getCursor(_type, query)
+        cursor = self.getCursor(_type, query, raw=raw)
         if cursor is not None:
             return CursorObjectModel(_type=_type, cursor=cursor, parent=parent, **kwargs)
         else:
@@ -500,8 +782,7 @@ class MongoDatabase(qtc.QObject):
 
             collection.update({'_id': obj['_id']}, updates, upsert=True)
         elif _id is None:
-            doc = MongoDatabase.escaped(obj.document)
-            result = collection.insert_one(doc)
+            result = collection.insert_one(RawBSONDocument(MongoDatabase.encoded(obj, _id=ObjectId())))
             obj['_id'] = result.inserted_id
 
         obj.apply()
@@ -539,9 +820,9 @@ class MongoDatabase(qtc.QObject):
                     updates = MongoDatabase._updates(obj)
                     bulk.find({'_id': obj['_id']}).upsert().update(updates)
                 else:
-                    doc = MongoDatabase.escaped(obj.document)
-                    bulk.insert(doc)
-                    obj.id = doc['_id']
+                    _id = ObjectId()
+                    bulk.insert(RawBSONDocument(MongoDatabase.encoded(obj, _id=_id)))
+                    obj.id = _id
 
             # Perform the operation
             self.statusMessage = 'Performing bulk update...'
@@ -604,14 +885,26 @@ class MongoDatabase(qtc.QObject):
         ignored and the referenced object will be loaded anyways."""
         already_loaded = _already_loaded if _already_loaded is not None else {}
 
-        if isinstance(obj, collections.Mapping):
-            items = obj.values()
+        if isinstance(obj, (DocumentObject, DocumentCore)):
+            items = MongoDatabase._reference_candidates(obj.core if isinstance(obj, DocumentObject) else obj)
+        elif isinstance(obj, collections.Mapping):
+            items = obj.items()
         elif isinstance(obj, collections.Sequence):
-            items = obj
+            items = enumerate(obj)
         else:
             raise TypeError('Expected mapping or sequence, got %s' % type(obj))
 
-        for item in items:
+        for key, item in items:
+            # Lazily stored documents are only wrapped if they contain references
+            if isinstance(obj, (DocumentObject, DocumentCore)) and DocumentCore._needs_wrapping(item):
+                if not MongoDatabase._has_references(item):
+                    continue
+                item = obj.core[key] if isinstance(obj, DocumentObject) else obj[key]
+
+            # Nested documents are walked as cores; only references need a facade
+            if isinstance(item, MapCore) and MongoDatabase._is_reference(item):
+                item = item.facade(parent=obj if isinstance(obj, DocumentObject) else obj._facade)
+
             if isinstance(item, MongoObjectReference) and (item.autoLoad or load_all):
                 try:
                     item.ref = already_loaded[item.referencedId]
@@ -624,6 +917,69 @@ class MongoDatabase(qtc.QObject):
                     and not isinstance(item, str):
                 self.getAllReferencedObjects(item, load_all, already_loaded)
 
+    @staticmethod
+    def _is_reference(doc):
+        """Returns True if the mapping doc is a MongoObjectReference document."""
+        _type = MapObjectMetaclass.subclasses.get(doc.get('_type', None), None)
+        return _type is not None and issubclass(_type, MongoObjectReference)
+
+    _reference_patterns = {}
+
+    @staticmethod
+    def _reference_pattern():
+        """Returns a compiled bytes pattern that matches the BSON encoding of the _type field of a
+        MongoObjectReference document, for every registered reference type."""
+        subclasses = MapObjectMetaclass.subclasses.items()
+        names = tuple(sorted(name for name, t in subclasses if issubclass(t, MongoObjectReference)))
+        try:
+            return MongoDatabase._reference_patterns[names]
+        except KeyError:
+            encoded = (name.encode() for name in names)
+            values = b'|'.join(re.escape(_pack_int(len(name) + 1) + name + b'\x00') for name in encoded)
+            pattern = MongoDatabase._reference_patterns[names] = re.compile(b'\x02_type\x00(?:' + values + b')')
+            return pattern
+
+    @staticmethod
+    def _reference_candidates(core):
+        """Yields the key-value pairs of core that may contain references. If the saved state of core is a
+        RawDocument, fields that were never read are only included if their raw BSON contains a reference document,
+        and the other fields are not decoded."""
+        raw = getattr(core, '_map', None)
+        if not isinstance(raw, RawDocument):
+            yield from core._raw_items()
+            return
+
+        keys = dict.fromkeys(raw.matching_keys(MongoDatabase._reference_pattern()))
+        keys.update(dict.fromkeys(key for key, value in raw._values.items() if DocumentCore._needs_wrapping(value)))
+        keys.update(dict.fromkeys(core._mods))
+
+        for key in keys:
+            if key in core:
+                yield key, core._peek(key)
+
+    @staticmethod
+    def _has_references(doc):
+        """Returns True if the plain document doc contains a MongoObjectReference document."""
+        if isinstance(doc, RawDocument):
+            # Only the fields whose raw BSON contains a reference document are decoded
+            for key in doc.matching_keys(MongoDatabase._reference_pattern()):
+                if key == '_type' or MongoDatabase._has_references(doc[key]):
+                    return True
+
+            return False
+        elif isinstance(doc, RawBSONDocument):
+            raw = doc.raw
+            if not MongoDatabase._reference_pattern().search(raw if isinstance(raw, bytes) else bytes(raw)):
+                return False
+
+        if isinstance(doc, collections.Mapping):
+            if MongoDatabase._is_reference(doc):
+                return True
+
+            return any(MongoDatabase._has_references(v) for v in doc.values() if DocumentCore._needs_wrapping(v))
+        else:
+            return any(MongoDatabase._has_references(i) for i in doc if DocumentCore._needs_wrapping(i))
+
     @qtc.pyqtSlot(ObjectModel, bool)
     def saveReferencedObjects(self, refs_model):
         """Save the objects references by an iterable of MongoObjectReferences."""
@@ -4,12 +4,158 @@ from .objects import *
 ########################################################################################################################
 
 
+class _ValueIndex:
+    """
+    _ValueIndex maps the values of one property of the rows in an ObjectModel to the rows' cores (see
+    ObjectModel.addIndex()). Entries are stored by core rather than by row number, so inserting or removing rows
+    doesn't affect the entries of other rows. Values that can't be hashed are not indexed.
+
+    If unique is True, each value is expected to belong to a single row, and is stored with its core alone rather than
+    in a dictionary of cores. Values that belong to several rows are handled either way.
+    """
+    __slots__ = ('name', 'unique', 'values', 'keys')
+
+    def __init__(self, name, unique=False):
+        self.name = name
+        self.unique = unique
+        self.values = {}    # value -> core, or value -> {id(core): core}
+        self.keys = {}      # id(core) -> value
+
+    def add(self, core, value):
+        """Indexes core under value, replacing its previous entry."""
+        self.discard(core)
+        try:
+            hash(value)
+        except TypeError:
+            return
+
+        key = id(core)
+        self.keys[key] = value
+        found = self.values.get(value)
+        if found is None:
+            self.values[value] = core if self.unique else {key: core}
+        elif type(found) is dict:
+            found[key] = core
+        else:
+            self.values[value] = {id(found): found, key: core}
+
+    def discard(self, core):
+        """Removes the entry for core, if there is one."""
+        key = id(core)
+        if key not in self.keys:
+            return
+
+        value = self.keys.pop(key)
+        found = self.values[value]
+        if type(found) is not dict:
+            del self.values[value]
+            return
+
+        del found[key]
+        if not found:
+            del self.values[value]
+        elif self.unique and len(found) == 1:
+            self.values[value] = next(iter(found.values()))
+
+    def lookup(self, value):
+        """Returns a tuple of the cores indexed under value."""
+        found = self.values.get(value)
+        if found is None:
+            return ()
+
+        return tuple(found.values()) if type(found) is dict else (found,)
+
+    def clear(self):
+        """Removes all entries."""
+        self.values.clear()
+        self.keys.clear()
+
+
+########################################################################################################################
+
+
+class _ModelCore(ListCore):
+    """The core of an ObjectModel. Tells the model when the contents of a row change, whether or not a notification
+    signal is emitted, so that the model can keep its indexes up to date (see ObjectModel.addIndex())."""
+    __slots__ = ()
+    _watches_children = True
+
+    def _child_changed(self, child):
+        model = self._facade
+        if model is not None and model._indexes and not sip.isdeleted(model):
+            model._changed_rows[id(child)] = child
+
+
+########################################################################################################################
+
+
+class _RowListener(qtc.QObject):
+    """
+    _RowListener receives the property notification signals of one row object (or referenced object) of an
+    ObjectModel. It calls the model's handler (onChildModified or onChildRefModified) with the name of the property,
+    while the object is the model's current sender (see ObjectModel._signal_sender()). The model and the object are
+    held through weak references. Deleting the listener disconnects it.
+
+    Each object gets a listener of its own, because a slot that is connected to every row has to ask Qt for the
+    sender, and QObject.sender() searches all the connections made to the receiver: with thousands of rows, that
+    takes milliseconds per signal. Connecting each signal to a Python callable avoids the search, but PyQt then
+    creates a proxy QObject for every connection. A listener is a single QObject per row, and its slot is connected
+    without a proxy.
+    """
+    _signal_names = {}
+
+    def __init__(self, model, sender, handler):
+        super().__init__()
+        self._model = weakref.ref(model)
+        self._sender = weakref.ref(sender, self._forget(self._model, id(sender)))
+        self._handler = handler
+
+    @staticmethod
+    def _forget(model, key):
+        """Returns a weakref callback that removes the listener for key from the model, once the object it listens
+        to has been deleted. It doesn't refer to the listener, so the listener is freed as soon as it is dropped."""
+        def forget(ref):
+            connections = getattr(model(), '_connections', {})
+            listener = connections.get(key)
+            if listener is not None and listener._sender is ref:
+                del connections[key]
+
+        return forget
+
+    @staticmethod
+    def _property_name(sender, index):
+        """Returns the name of the property whose notification signal has the given index in sender's class."""
+        key = (type(sender), index)
+        try:
+            return _RowListener._signal_names[key]
+        except KeyError:
+            name = bytes(sender.metaObject().method(index).name()).decode()
+            name = _RowListener._signal_names[key] = name[:-len('Changed')]
+            return name
+
+    @qtc.pyqtSlot()
+    def relay(self):
+        """Receives a notification signal, and passes it on to the model's handler."""
+        model, sender = self._model(), self._sender()
+        if model is None or sender is None:
+            return
+
+        name = self._property_name(sender, self.senderSignalIndex())
+        previous, model._sender = model._sender, sender
+        try:
+            getattr(model, self._handler)(name)
+        finally:
+            model._sender = previous
+
+
+########################################################################################################################
+
+
 class ObjectModel(qtc.QAbstractItemModel, ListObject):
     """ObjectModel provides a QAbstractItemModel interface to a list of qp.MapObject objects. It will automatically
     provide 'role' names based on the object types properties, and can be used as either a list or a table model.
     It also implements the collections.MutableSequence interface, so it can be used as a Python list as well.
     """
-
     # QML doesn't read the inherited properly correctly, because we are inheriting from QAbstractItemModel first...?
     modifiedChanged = qtc.pyqtSignal()
     @qtc.pyqtProperty(bool, notify=modifiedChanged)
@@ -17,20 +163,39 @@ class ObjectModel(qtc.QAbstractItemModel, ListObject):
         #return len(self.deleted) > 0
         return super().modified
 
-    def __init__(self, _type, ref_type=None, objects=None, listen=True, parent=None):
+    def __init__(self, _type, ref_type=None, objects=None, listen=True, coalesce=False, parent=None):
         """Initializes the model. _type is a qp.Object subclass, which will be used to determine the role names
         the model provides. objects is the list of objects to use. If listen is True (the default) the model will
         connect to any property change signals the object type provides, and will translate those to dataChanged
-        signals.
+        signals. If coalesce is True, those signals are collected and emitted once per event loop iteration (see
+        setCoalescing()).
         """
-        super().__init__([] if objects is None else objects, parent=parent)
+        super().__init__(parent=parent, _core=_ModelCore([] if objects is None else objects))
         self._type = None
         self._ref_type = None
         self._listen = listen
         self._role_to_prop = {}
         self._ref_role_to_prop = {}
+        self._prop_to_role = {}
+        self._ref_prop_to_role = {}
         self._column_to_role = {}
         self._column_names = []
+        self._name_to_column = {}
+        self._role_to_column = {}
+        self._batch_rows = set()
+        self._batch_roles = set()
+        self._row_index = None
+        self._ref_row_index = None
+        self._row_signals = {}
+        self._connections = {}
+        self._sender = None
+        self._indexes = {}
+        self._indexes_stale = False
+        self._changed_rows = {}
+        self._pending = {}
+        self._pending_modified = False
+        self._flush_scheduled = False
+        self._flush_timer = None
 
         # Take ownership of content objects
         for obj in self:
@@ -50,16 +215,21 @@ class ObjectModel(qtc.QAbstractItemModel, ListObject):
                 except (AttributeError, ValueError, TypeError):
                     raise TypeError('A valid reference type could not be determined.')
 
-        # Discover role names for content and referenced objects
-        props = [p for p in dir(_type) if isinstance(getattr(_type, p), qtc.pyqtProperty)]
-        self._role_to_prop = {r: p for r, p in enumerate(props, qtc.Qt.UserRole)}
+        # Look up role names for content and referenced objects. The tables are shared with every other model
+        # of the same types, so they are never modified.
+        self._info = MapObjectMetaclass.info(self._type)
+        self._role_to_prop = self._info.role_to_name
+        self._prop_to_role = self._info.name_to_role
 
+        self._ref_info = None
         if self._ref_type is not None:
-            props = [p for p in dir(self._ref_type) if isinstance(getattr(self._ref_type, p), qtc.pyqtProperty)]
-            self._ref_role_to_prop = {r: p for r, p in enumerate(props, max(self._role_to_prop) + 1)}
+            self._ref_info = MapObjectMetaclass.info(self._ref_type, max(self._role_to_prop) + 1)
+            self._ref_role_to_prop = self._ref_info.role_to_name
+            self._ref_prop_to_role = self._ref_info.name_to_role
 
         # Set the default columns
         self.setColumns()
+        self.setCoalescing(coalesce)
 
         # Connect to property change signals
         if listen:
@@ -79,18 +249,40 @@ class ObjectModel(qtc.QAbstractItemModel, ListObject):
             self._connect_to(item)
 
         if current is not item:
+            self._rows_changed()
+            if self._indexes:
+                self._unindex_rows([current.core])
+                self._index_rows([item.core])
             topleft = self.createIndex(index, 0)
             bottomright = self.createIndex(index, len(self._column_to_role))
             self.dataChanged.emit(topleft, bottomright)
 
     def __delitem__(self, row):
-        self.removeRows(row, 1)
+        """Removes a row, or the rows in a slice. A contiguous slice is removed with a single removeRows(). Like
+        with a list, IndexError is raised if the row is out of range."""
+        if not isinstance(row, slice):
+            index = row if row >= 0 else row + len(self)
+            if not 0 <= index < len(self):
+                raise IndexError('row %d is out of range' % row)
+
+            self.removeRows(index, 1)
+            return
+
+        start, stop, step = row.indices(len(self))
+        if step == 1:
+            if stop > start:
+                self.removeRows(start, stop - start)
+        else:
+            for idx in sorted(range(start, stop, step), reverse=True):
+                self.removeRows(idx, 1)
 
     @qtc.pyqtSlot(int, qtc.QObject)
     def insert(self, row, item):
         self.beginInsertRows(qtc.QModelIndex(), row, row)
         super().insert(row, item)
-        self._connect_to(item)
+        self._rows_inserted(row, 1)
+        if self._listen:
+            self._connect_to(item)
         item.setParent(self)
         self.endInsertRows()
 
@@ -98,19 +290,62 @@ class ObjectModel(qtc.QAbstractItemModel, ListObject):
     def append(self, item):
         self.insert(len(self), item)
 
+    @qtc.pyqtSlot(int, qtc.QVariant, result=bool)
+    def insertRows(self, row, objects, parent=qtc.QModelIndex()):
+        """Inserts the objects in the sequence objects at row, with a single beginInsertRows()/endInsertRows() pair
+        and a single change to the list. Also accepts QAbstractItemModel's insertRows(row, count, parent), which
+        ObjectModel does not support (it can't create objects by itself), and returns False."""
+        if isinstance(objects, int):
+            return super().insertRows(row, objects, parent)
+
+        objects = list(objects.toVariant() if isinstance(objects, (qtc.QVariant, qtq.QJSValue)) else objects)
+        if not objects:
+            return True
+
+        length = len(self)
+        row = min(max(row if row >= 0 else row + length, 0), length)
+
+        for obj in objects:
+            obj.setParent(self)
+            if self._listen:
+                self._connect_to(obj)
+
+        self.beginInsertRows(qtc.QModelIndex(), row, row + len(objects) - 1)
+        self._core.insert_many(row, objects)
+        self._rows_inserted(row, len(objects))
+        self.endInsertRows()
+        return True
+
+    @qtc.pyqtSlot(qtc.QVariant)
+    def extend(self, objects):
+        """Appends the objects in the sequence objects to the model. See insertRows()."""
+        self.insertRows(len(self), objects)
+
     @qtc.pyqtSlot(int, result=bool)
     def removeRow(self, row, parent=qtc.QModelIndex()):
         return self.removeRows(row, 1, parent)
 
     @qtc.pyqtSlot(int, int, result=bool)
     def removeRows(self, row, count, parent=qtc.QModelIndex()):
+        """Removes count rows, starting at row, with a single beginRemoveRows()/endRemoveRows() pair and a single
+        change to the list. Returns False, and removes nothing, if count is less than 1 or the rows are out of range
+        (as QAbstractItemModel requires; use del for a removal that raises IndexError)."""
+        if count < 1 or row < 0 or row + count > len(self):
+            return False
+
         self.beginRemoveRows(parent, row, row + count - 1)
 
-        for i in range(count):
-            obj = self[row]
-            self._disconnect_from(obj)
-            super().__delitem__(row)
+        if self._listen:
+            for core in self._core._copy[row:row + count]:
+                obj = getattr(core, '_facade', None)
+                if obj is not None and not sip.isdeleted(obj):
+                    self._disconnect_from(obj)
+
+        if self._indexes:
+            self._unindex_rows(self._core._copy[row:row + count])
 
+        del self._core[row:row + count]
+        self._rows_changed()
         self.endRemoveRows()
         return True
 
@@ -129,6 +364,35 @@ class ObjectModel(qtc.QAbstractItemModel, ListObject):
                 obj.setParent(self)
 
         ListObject.revert(self, revert_children=False)         # QAbstractItemModel also has a revert() method
+        self._rows_changed()
+        self._indexes_stale = True
+
+    def __reduce__(self):
+        raise TypeError('ObjectModel can not be pickled; pickle the objects it contains instead.')
+
+    def _begin_restore(self):
+        self.beginResetModel()
+
+    def _end_restore(self, released, adopted):
+        """Takes ownership of the objects put back by the undo history, and lets go of the ones it removed."""
+        for core in released:
+            obj = core._facade
+            if obj is None or sip.isdeleted(obj):
+                continue
+            if self._listen:
+                self._disconnect_from(obj)
+            if obj.parent() is self:
+                obj.setParent(None)
+
+        for core in adopted:
+            obj = core.facade(parent=self)
+            obj.setParent(self)
+            if self._listen:
+                self._connect_to(obj)
+
+        self._rows_changed()
+        self._indexes_stale = True
+        self.endResetModel()
 
     @qtc.pyqtSlot(int, result=qtc.QObject)
     def getItem(self, index):
@@ -186,11 +450,10 @@ class ObjectModel(qtc.QAbstractItemModel, ListObject):
     @qtc.pyqtSlot(str, result=int)
     def role(self, name):
         """Return the role (int) with a given name."""
-        for r, n in itertools.chain(self._role_to_prop.items(), self._ref_role_to_prop.items()):
-            if n == name:
-                return r
-        else:
-            return -1
+        try:
+            return self._prop_to_role[name]
+        except KeyError:
+            return self._ref_prop_to_role.get(name, -1)
 
     @qtc.pyqtSlot(qtc.QVariant)
     def setColumns(self, *args):
@@ -199,139 +462,296 @@ class ObjectModel(qtc.QAbstractItemModel, ListObject):
         javascript array passed from QML; otherwise, it assumes the arguments are the names of the properties to use
         for the columns."""
         if not args:
-            self._column_to_role = {col: role for col, role in enumerate(itertools.chain(self._role_to_prop.keys(),
-                                                                                         self._ref_role_to_prop.keys()))}
-            self._column_names = [prop for prop in itertools.chain(self._role_to_prop.values(),
-                                                                   self._ref_role_to_prop.values())]
-            return
+            # Roles are taken as they are, since the referenced type can have properties with the same names
+            roles = itertools.chain(self._role_to_prop.keys(), self._ref_role_to_prop.keys())
+            names = list(itertools.chain(self._role_to_prop.values(), self._ref_role_to_prop.values()))
+            self._column_to_role = dict(enumerate(roles))
+        else:
+            names = args[0].toVariant() if isinstance(args[0], qtc.QVariant) else list(map(lambda a: str(a), args))
+            self._column_to_role = {col: self.role(name) for col, name in enumerate(names) if self.role(name) != -1}
 
-        names = args[0].toVariant() if isinstance(args[0], qtc.QVariant) else list(map(lambda a: str(a), args))
         self._column_names = names
-
-        self._column_to_role = {}
+        self._name_to_column = {}
         for col, name in enumerate(names):
-            try:
-                role = next(filter(lambda rn: rn[1] == name, itertools.chain(self._role_to_prop.items(),
-                                                                             self._ref_role_to_prop.items())))[0]
-            except:
-                continue
+            self._name_to_column.setdefault(name, col)
 
-            self._column_to_role[col] = role
+        self._role_to_column = {}
+        for col, role in self._column_to_role.items():
+            self._role_to_column.setdefault(role, col)
 
     @qtc.pyqtSlot(str, result=int)
     def fieldIndex(self, prop):
         """Return the column for a given property name."""
-        try:
-            return self._column_names.index(prop)
-        except ValueError:
-            return -1
+        return self._name_to_column.get(prop, -1)
 
     def _connect_to(self, obj):
-        """Connects to an object's property change signals."""
+        """Connects to an object's property change signals, through a _RowListener. An object that is already
+        connected is skipped."""
         if obj is None:
             return
         elif isinstance(obj, self._type):
-            roles = self._role_to_prop
-            self._connect_to(getattr(obj, 'ref', None))
+            handler = 'onChildModified'
         elif isinstance(obj, self._ref_type):
-            roles = self._ref_role_to_prop
-
-        for num, name in roles.items():
-            signal_name = name + 'Changed'
-
-            try:
-                signal = getattr(obj, signal_name)
-            except AttributeError:
-                continue
-
-            if roles is self._role_to_prop:
-                # if name not in self._slot_partials:
-                #     self._slot_partials[name] = self.onChildModified #lambda p=name: self.onChildModified(p)
+            handler = 'onChildRefModified'
+        else:
+            return
 
-                signal.connect(self.onChildModified) #self._slot_partials[name])
+        listener = self._connections.get(id(obj))
+        if listener is not None and listener._sender() is obj:
+            return
 
-            if roles is self._ref_role_to_prop:
-                # if name not in self._ref_slot_partials:
-                #     self._ref_slot_partials[name] = self.onChildRefModified #lambda p=name: self.onChildRefModified(p)
+        if handler == 'onChildModified':
+            self._connect_to(getattr(obj, 'ref', None))
+            if self._ref_type is not None:
+                obj.refChanged.connect(self._onRefChanged)
 
-                signal.connect(self.onChildRefModified) #self._ref_slot_partials[name])
+        listener = self._connections[id(obj)] = _RowListener(self, obj, handler)
+        for signal in self._signals_of(obj):
+            getattr(obj, signal).connect(listener.relay)
 
     def _disconnect_from(self, obj):
         """Disconnects from an object's property change signals."""
         if obj is None:
             return
         elif isinstance(obj, self._type):
-            roles = self._role_to_prop
+            if self._ref_type is not None:
+                try:
+                    obj.refChanged.disconnect(self._onRefChanged)
+                except TypeError:
+                    pass
         elif isinstance(obj, self._ref_type):
-            roles = self._ref_role_to_prop
             self._disconnect_from(getattr(obj, 'ref', None))
+        else:
+            return
 
-        for num, name in roles.items():
-            signal_name = name + 'Changed'
+        listener = self._connections.get(id(obj))
+        if listener is not None and listener._sender() is obj:
+            del self._connections[id(obj)]
+            for signal in self._signals_of(obj):
+                try:
+                    getattr(obj, signal).disconnect(listener.relay)
+                except TypeError:
+                    continue
+
+    def _signals_of(self, obj):
+        """Returns the names of the notification signals of obj that the model listens to: those of the properties
+        that have a role. The result is cached per class."""
+        key = (type(obj), isinstance(obj, self._type))
+        try:
+            return self._row_signals[key]
+        except KeyError:
+            roles = self._role_to_prop if key[1] else self._ref_role_to_prop
+            signals = MapObjectMetaclass.info(type(obj)).signals
+            names = self._row_signals[key] = tuple(signals[n] for n in roles.values() if n in signals)
+            return names
+
+    def _signal_sender(self):
+        """Returns the object whose notification signal is being handled: the one given by the _RowListener that
+        called the handler, or QObject.sender() if the handler was connected some other way."""
+        return self._sender if self._sender is not None else self.sender()
+
+    def _rows(self):
+        """Returns a dictionary relating the ids of the cores in the model to their rows (the first row, for an object
+        that appears more than once). The index is built the first time it is needed after rows are removed,
+        replaced or reordered, and is extended in place when rows are appended."""
+        if self._row_index is None:
+            index = {}
+            for row, core in enumerate(self._core._copy):
+                index.setdefault(id(core), row)
+            self._row_index = index
+
+        return self._row_index
+
+    def _ref_rows(self):
+        """Returns a dictionary relating the ids of referenced objects to the list of rows that reference them. Built
+        and maintained like _rows()."""
+        if self._ref_row_index is None:
+            index = {}
+            for row, core in enumerate(self._core._copy):
+                self._index_ref(index, core, row)
+            self._ref_row_index = index
+
+        return self._ref_row_index
+
+    @staticmethod
+    def _index_ref(index, core, row):
+        """Adds row to the reverse reference index, if the object in it has a facade with a referenced object."""
+        ref = getattr(getattr(core, '_facade', None), '_ref', None)
+        if ref is not None:
+            index.setdefault(id(ref), []).append(row)
+
+    def _rows_inserted(self, row, count):
+        """Updates the row indexes after count rows were inserted at row. Appended rows are added to the indexes;
+        rows inserted anywhere else shift the rows after them, so the indexes are discarded."""
+        copy = self._core._copy
+        if self._indexes:
+            if 0 <= row <= len(copy) - count:
+                self._index_rows(copy[row:row + count])
+            else:
+                self._indexes_stale = True
 
-            try:
-                signal = getattr(obj, signal_name)
-                signal.disconnect(self.onChildModified if roles is self._role_to_prop else self.onChildRefModified)
-            except (AttributeError, KeyError):
-                continue
+        if row + count != len(copy):
+            self._rows_changed()
+            return
+
+        if self._row_index is not None:
+            for r in range(row, row + count):
+                self._row_index.setdefault(id(copy[r]), r)
+
+        if self._ref_row_index is not None:
+            for r in range(row, row + count):
+                self._index_ref(self._ref_row_index, copy[r], r)
+
+    def _rows_changed(self):
+        """Discards the row indexes after rows were removed, replaced or reordered. They are rebuilt when next
+        needed."""
+        self._row_index = None
+        self._ref_row_index = None
+
+    @qtc.pyqtSlot()
+    def _onRefChanged(self):
+        """Called when the referenced object of one of the rows changes."""
+        self._ref_row_index = None
 
     def onChildModified(self, role_name=None):
-        """Translates a child object's property change signal into a dataChanged signal, allowing views to react
-        automatically to property changes."""
-        sender = self.sender()
+        """Translates a child object's property change signal into a dataChanged signal for the cell and role of that
+        property, allowing views to react automatically to property changes. Without a role_name, the whole row is
+        marked as changed."""
+        sender = self._signal_sender()
 
-        try:
-            row = self._copy.index(sender)      # Have to access parent data member directly (index() is overridden
-                                                # by QAbstractItemModel)
-        except ValueError:
+        row = self._rows().get(id(sender.core))
+        if row is None:
             return
 
-        # try:
-        #     col = self._column_names.index(role_name)
-        # except ValueError:
-        #     col = 0
-        #
-        # roles = [r for r, p in self._role_to_prop.items() if p == role_name]
-        #
-        # index = self.createIndex(row, col)
-        # self.dataChanged.emit(index, index, roles)
-        index1 = self.createIndex(row, 0)
-        index2 = self.createIndex(row, self.columnCount() - 1)
-        self.dataChanged.emit(index1, index2)
+        index = self._indexes.get(role_name)
+        if index is not None and not self._indexes_stale:
+            index.add(sender.core, getattr(sender, role_name))
 
-        before = self.modified
-        self._modified = None
-        if self.modified != before:
-            self.modifiedChanged.emit()
+        self._cell_changed(row, self._prop_to_role.get(role_name))
 
     def onChildRefModified(self, role_name=None):
         """Translates a referenced object's property change signals into dataChanged signals, allowing connected views
-        to update automatically."""
-        sender = self.sender()
+        to update automatically. Every row that references the sender is updated."""
+        rows = self._ref_rows().get(id(self._signal_sender()))
+        if not rows:
+            return
 
-        for row, obj in enumerate(self):
-            if obj.ref is sender:
-                break
+        role = self._ref_prop_to_role.get(role_name)
+        for row in rows:
+            self._cell_changed(row, role)
+
+    def _cell_changed(self, row, role):
+        """Emits dataChanged for role, on the cell in row that shows role (or the first cell, if the role doesn't
+        have a column). Cells are found by role rather than by property name, since the row type and the referenced
+        type can have properties with the same names. If role is None, the whole row is marked as changed. During a batch,
+        the row and role are collected instead, and emitted by _flush_rows(); when coalescing, they are collected
+        until _flush_pending() runs."""
+        if self._flush_timer is not None:
+            core = self._core._copy[row]
+            entry = self._pending.get(id(core))
+            if entry is None:
+                self._pending[id(core)] = (core, {role})
+                self._schedule_flush()
+            else:
+                entry[1].add(role)
+        elif DocumentObject._batch_depth:
+            self._batch_rows.add(row)
+            self._batch_roles.add(role)
+            DocumentObject._batch_model(self)
+        elif role is None:
+            index1 = self.createIndex(row, 0)
+            index2 = self.createIndex(row, self.columnCount() - 1)
+            self.dataChanged.emit(index1, index2)
         else:
+            index = self.createIndex(row, self._role_to_column.get(role, 0))
+            self.dataChanged.emit(index, index, [role])
+
+    def _flush_rows(self):
+        """Emits a single dataChanged signal covering the rows and roles collected during a batch."""
+        rows, self._batch_rows = self._batch_rows, set()
+        roles, self._batch_roles = self._batch_roles, set()
+        rows = [r for r in rows if r < self.rowCount()]
+        if not rows:
             return
 
-        # try:
-        #     col = self._column_names.index(role_name)
-        # except ValueError:
-        #     col = 0
-        #
-        # roles = [r for r, p in self._ref_role_to_prop.items() if p == role_name]
-        #
-        # index = self.createIndex(row, col)
-        # self.dataChanged.emit(index, index, roles)
-        index1 = self.createIndex(row, 0)
-        index2 = self.createIndex(row, self.columnCount() - 1)
-        self.dataChanged.emit(index1, index2)
-
-        before = self.modified
-        self._modified = None
-        if self.modified != before:
-            self.modifiedChanged.emit()
+        index1 = self.createIndex(min(rows), 0)
+        index2 = self.createIndex(max(rows), self.columnCount() - 1)
+        if None in roles:
+            self.dataChanged.emit(index1, index2)
+        else:
+            self.dataChanged.emit(index1, index2, sorted(roles))
+
+    @qtc.pyqtSlot(bool)
+    def setCoalescing(self, enabled):
+        """Turns coalescing on or off. While it is on, property changes in the rows are not announced one signal at
+        a time. The changed rows and roles are collected, and a zero-timeout timer emits them once the event loop
+        gets control back: one dataChanged signal per run of contiguous rows, and at most one modifiedChanged for
+        the model. Views then update once per event loop iteration, however many changes were made."""
+        if enabled and self._flush_timer is None:
+            self._flush_timer = qtc.QTimer(self)
+            self._flush_timer.setSingleShot(True)
+            self._flush_timer.setInterval(0)
+            self._flush_timer.timeout.connect(self._flush_pending)
+        elif not enabled and self._flush_timer is not None:
+            self._flush_pending()
+            self._flush_timer.deleteLater()
+            self._flush_timer = None
+
+    @qtc.pyqtSlot(result=bool)
+    def isCoalescing(self):
+        """Returns True if change notifications are being coalesced. See setCoalescing()."""
+        return self._flush_timer is not None
+
+    def _modified_changed(self):
+        """Emits modifiedChanged, or defers it to the next _flush_pending() when coalescing."""
+        if self._flush_timer is None:
+            super()._modified_changed()
+        else:
+            self._pending_modified = True
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        """Starts the flush timer, unless it is already running."""
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._flush_timer.start()
+
+    def _flush_pending(self):
+        """Emits the notifications collected while coalescing. Rows are looked up now, so changes to objects that
+        were moved are reported at their new rows, and objects that were removed are skipped. Contiguous rows are
+        reported by a single dataChanged, with the combined roles of the rows."""
+        if self._flush_timer is not None:
+            self._flush_timer.stop()
+        self._flush_scheduled = False
+
+        pending, self._pending = self._pending, {}
+        if pending:
+            index = self._rows()
+            changes = {}
+            for key, (core, roles) in pending.items():
+                row = index.get(key)
+                if row is not None:
+                    changes[row] = roles
+
+            last_column = self.columnCount() - 1
+            rows = sorted(changes)
+            start = 0
+            for end in range(1, len(rows) + 1):
+                if end < len(rows) and rows[end] == rows[end - 1] + 1:
+                    continue
+
+                roles = set().union(*(changes[row] for row in rows[start:end]))
+                index1 = self.createIndex(rows[start], 0)
+                index2 = self.createIndex(rows[end - 1], last_column)
+                if None in roles:
+                    self.dataChanged.emit(index1, index2)
+                else:
+                    self.dataChanged.emit(index1, index2, sorted(roles))
+                start = end
+
+        if self._pending_modified:
+            self._pending_modified = False
+            DocumentObject._emit(self, self.modifiedChanged)
 
     @property
     def deleted(self):
@@ -345,24 +765,128 @@ class ObjectModel(qtc.QAbstractItemModel, ListObject):
         original_ids = {id(o) for o in self._original}
         copy_ids = {id(o) for o in self._copy}
         deleted_ids = original_ids - copy_ids
-        deleted_objs = [o for o in self._original if id(o) in deleted_ids]
+        deleted_objs = [o.facade(parent=self) for o in self._original if id(o) in deleted_ids]
 
         return deleted_objs
 
+    @qtc.pyqtSlot(str)
+    @qtc.pyqtSlot(str, bool)
+    def addIndex(self, role_name, unique=False):
+        """Indexes the rows by the value of role_name, so that matchOne(), matchAll() and contains() can find them
+        without looking at every row. The index is kept up to date as rows are inserted, removed and changed: through
+        the property's notification signal, and through the row's contents, for changes that don't emit it. So
+        role_name must be a property with a notification signal (<name>Changed), and the model must listen to its
+        rows' signals. If unique is True, each value is expected to belong to a single row."""
+        if not self._listen:
+            raise ValueError('%s can not be indexed, because the model does not listen to its rows' % role_name)
+        elif role_name not in self._info.signals:
+            raise ValueError('%s has no notification signal, and can not be indexed' % role_name)
+
+        index = self._indexes[role_name] = _ValueIndex(role_name, unique)
+        if not self._indexes_stale:
+            self._build_index(index)
+
+    @qtc.pyqtSlot(str)
+    def dropIndex(self, role_name):
+        """Removes the index created by addIndex()."""
+        self._indexes.pop(role_name, None)
+
+    def _build_index(self, index):
+        """Fills index with the values of all the rows."""
+        name = index.name
+        for core in self._core._copy:
+            index.add(core, getattr(core.facade(parent=self), name))
+
+    def _index_rows(self, cores):
+        """Adds the rows with the given cores to the indexes."""
+        for index in self._indexes.values():
+            for core in cores:
+                index.add(core, getattr(core.facade(parent=self), index.name))
+
+    def _unindex_rows(self, cores):
+        """Removes the rows with the given cores from the indexes."""
+        for index in self._indexes.values():
+            for core in cores:
+                index.discard(core)
+
+    def _index_for(self, role_name):
+        """Returns the up to date index for role_name, or None if it isn't indexed. Indexes that were invalidated
+        (by revert() or the undo history) are rebuilt first, and rows whose contents changed since the last lookup
+        are indexed again."""
+        if role_name not in self._indexes:
+            return None
+
+        if self._indexes_stale:
+            for index in self._indexes.values():
+                index.clear()
+                self._build_index(index)
+            self._indexes_stale = False
+            self._changed_rows = {}
+        elif self._changed_rows:
+            changed, self._changed_rows = self._changed_rows, {}
+            model_core = self._core
+            rows = [core for core in changed.values() if any(p is model_core for p in core._parents())]
+            self._index_rows(rows)
+
+        return self._indexes[role_name]
+
+    def _match_rows(self, role_name, value):
+        """Returns the rows where role_name equals value, in ascending order, using the index if there is one."""
+        index = self._index_for(role_name)
+        try:
+            hash(value)
+        except TypeError:
+            index = None
+
+        if index is None:
+            rows = []
+            for idx, item in enumerate(self):
+                try:
+                    model_value = getattr(item, role_name)
+                except AttributeError:
+                    continue
+
+                if model_value == value:
+                    rows.append(idx)
+
+            return rows
+
+        row_index, rows = self._rows(), []
+        for core in index.lookup(value):
+            row = row_index.get(id(core))
+            if row is not None and getattr(core.facade(parent=self), role_name) == value:
+                rows.append(row)
+
+        return sorted(rows)
+
     @qtc.pyqtSlot(str, qtc.QVariant, result=int)
     def matchOne(self, role_name, value):
         """Return the index of the first item in the model where role_name equals value, or -1 if there are no
-        matches."""
-        for idx, item in enumerate(self):
-            try:
-                model_value = getattr(item, role_name)
-            except AttributeError:
-                continue
+        matches. Takes constant time if role_name is indexed (see addIndex())."""
+        if role_name not in self._indexes:
+            for idx, item in enumerate(self):
+                try:
+                    model_value = getattr(item, role_name)
+                except AttributeError:
+                    continue
 
-            if model_value == value:
-                return idx
-        else:
-            return -1
+                if model_value == value:
+                    return idx
+            else:
+                return -1
+
+        rows = self._match_rows(role_name, value)
+        return rows[0] if rows else -1
+
+    @qtc.pyqtSlot(str, qtc.QVariant, result=qtc.QVariant)
+    def matchAll(self, role_name, value):
+        """Returns a list of the indices of the items in the model where role_name equals value."""
+        return self._match_rows(role_name, value)
+
+    @qtc.pyqtSlot(str, qtc.QVariant, result=bool)
+    def contains(self, role_name, value):
+        """Returns True if role_name equals value for any item in the model."""
+        return self.matchOne(role_name, value) != -1
 
     @qtc.pyqtSlot(str, result=qtc.QVariant)
     def min(self, role_name):
@@ -1,16 +1,1618 @@
-import abc, collections, datetime, itertools, sip, types
+import abc, collections, contextlib, datetime, itertools, json, math, pickle, sip, sys, types, weakref
 import PyQt5.QtCore as qtc
 import PyQt5.QtQml as qtq
 from bson.json_util import dumps as json_dumps
+from bson.json_util import default as json_default
+
+
+# Immutable value types that are stored in documents as-is
+_SCALAR_TYPES = frozenset((str, int, float, bool, bytes, type(None), datetime.datetime))
+
+# Plain containers that can be changed in place, without the document that holds them knowing
+_MUTABLE_CONTAINERS = (collections.MutableMapping, collections.MutableSequence)
+
+# Shared, read-only stand-ins for change tracking containers that are still empty. The real dict or set is only
+# allocated when the first entry is added.
+_EMPTY_MAP = types.MappingProxyType({})
+_EMPTY_SET = frozenset()
+
+# Marks a key that is not in a map
+_MISSING = object()
+
+
+########################################################################################################################
+
+
+class DocumentObjectMetaclass(sip.wrappertype, abc.ABCMeta):
+    """DocumentObjectMetaclass provides a QObject-compatible metaclass for DocumentObject."""
+    def __init__(cls, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+
+########################################################################################################################
+
+
+class DocumentCore:
+    """
+    DocumentCore is the base class for the plain-Python half of qp documents (MapCore and ListCore). A core holds the
+    contents of a document and tracks its changes, without the cost of a QObject. The QObject half (a MapObject or
+    ListObject, called the facade) is only created when it is needed: when the object is handed to QML, or when
+    someone wants its signals. Nested documents are always stored as cores.
+
+    Children report changes to their document parents by calling them directly, through weak references: a child
+    does not keep its parents alive, and no signal connections are made between cores. Signals are only emitted by
+    facades. A core that is stored in several documents (or is a row in several models) reports to all of them.
+    """
+    __slots__ = ('_doc_parent', '_dirty', '_modified', '_lazy', '_facade', '_doc_cache', '_hash', '__weakref__')
+
+    # True in subclasses that implement _child_changed()
+    _watches_children = False
+
+    def __init__(self, lazy=False):
+        self._doc_parent = None
+        self._dirty = _EMPTY_MAP
+        self._modified = False
+        self._lazy = lazy
+        self._facade = None
+        self._doc_cache = None
+        self._hash = None
+
+    @staticmethod
+    def _needs_wrapping(item):
+        """Returns True if item is a non-string sequence or a mapping that is not already a document."""
+        if isinstance(item, (str, bytes, bytearray, DocumentCore, DocumentObject)):
+            return False
+
+        return isinstance(item, (collections.Sequence, collections.Mapping))
+
+    @staticmethod
+    def _plain(item):
+        """Returns item expressed using plain Python lists and dicts. Documents are replaced by their (shared,
+        see _document()) documents, and lazily stored mappings and sequences are copied."""
+        if isinstance(item, DocumentCore):
+            return item._document()
+        elif isinstance(item, DocumentObject):
+            return item._core._document()
+        elif not DocumentCore._needs_wrapping(item):
+            return item
+        elif isinstance(item, collections.Mapping):
+            return {k: DocumentCore._plain(v) for k, v in item.items()}
+        else:
+            return [DocumentCore._plain(i) for i in item]
+
+    @staticmethod
+    def _as_core(item):
+        """Returns the core of item if it is a DocumentObject. Other values are returned unchanged."""
+        return item._core if isinstance(item, DocumentObject) else item
+
+    def _process_input(self, item):
+        """Converts non-string sequences and mappings to cores. Leaves other inputs unchanged. New cores inherit
+        this object's lazy setting."""
+        if type(item) in _SCALAR_TYPES:
+            return item
+        elif isinstance(item, DocumentObject):
+            return item._core
+        elif not self._needs_wrapping(item):
+            return item
+        elif isinstance(item, collections.Mapping):
+            return MapCore(item, lazy=self._lazy)
+        else:
+            return ListCore(item, lazy=self._lazy)
+
+    @staticmethod
+    def _handler(core):
+        """Returns the object that apply() and revert() should be called on for a child core: its facade, if there
+        is one (subclasses like ObjectModel extend these methods), otherwise the core itself."""
+        return core._facade if core._facade is not None else core
+
+    def _parents(self):
+        """Returns a list of the document parents of this object that still exist. Most cores have a single parent,
+        but a core can be shared by several documents (for instance, an object that is a row in two models)."""
+        ref = self._doc_parent
+        if ref is None:
+            return []
+        elif type(ref) is tuple:
+            return [parent for parent in (r() for r in ref) if parent is not None]
+
+        parent = ref()
+        return [] if parent is None else [parent]
+
+    def _parent(self):
+        """Returns the first document parent of this object, or None if it has none (or its parents no longer
+        exist)."""
+        parents = self._parents()
+        return parents[0] if parents else None
+
+    def _link(self, parent):
+        """Adds parent to the document parents of this object. Returns False if it already was one. A single parent
+        is stored as a plain weakref; several parents as a tuple of them."""
+        ref = self._doc_parent
+        if ref is None:
+            self._doc_parent = weakref.ref(parent)
+            return True
+        elif type(ref) is not tuple and ref() is parent:
+            return False
+
+        refs = [r for r in (ref if type(ref) is tuple else (ref,)) if r() is not None]
+        if any(r() is parent for r in refs):
+            return False
+
+        refs.append(weakref.ref(parent))
+        self._doc_parent = refs[0] if len(refs) == 1 else tuple(refs)
+        return True
+
+    def _unlink(self, parent):
+        """Removes parent from the document parents of this object. Returns False if it wasn't one."""
+        ref = self._doc_parent
+        if ref is None:
+            return False
+        elif type(ref) is not tuple:
+            if ref() is not parent:
+                return False
+            self._doc_parent = None
+            return True
+
+        refs = [r for r in ref if r() is not None and r() is not parent]
+        found = len(refs) != sum(1 for r in ref if r() is not None)
+        self._doc_parent = None if not refs else refs[0] if len(refs) == 1 else tuple(refs)
+        return found
+
+    @property
+    def _dirty_children(self):
+        """The number of adopted children that are modified."""
+        return len(self._dirty)
+
+    def _adopt(self, item):
+        """Makes this object a document parent of item, if item is a DocumentCore. If item is modified, it is
+        recorded as a dirty child. A core that already has a parent keeps it: a shared core reports its changes to
+        all of its parents."""
+        if isinstance(item, DocumentCore) and item._link(self) and item._modified:
+            if self._dirty is _EMPTY_MAP:
+                self._dirty = {}
+            self._dirty[id(item)] = item
+
+    def _release(self, item):
+        """Undoes _adopt(). item no longer reports its modification state to this object."""
+        if isinstance(item, DocumentCore) and item._unlink(self) and self._dirty:
+            self._dirty.pop(id(item), None)
+
+    def _child_modified_changed(self, child, modified):
+        """Called by an adopted child when its modification state flips."""
+        if modified:
+            if self._dirty is _EMPTY_MAP:
+                self._dirty = {}
+            self._dirty[id(child)] = child
+        elif self._dirty:
+            self._dirty.pop(id(child), None)
+
+        self._update_modified()
+
+    def _has_changes(self):
+        """Returns True if this object has changes of its own, not counting changes in its children."""
+        raise NotImplementedError
+
+    def _child_changed(self, child):
+        """Called by _invalidate() when the contents of child (or of one of its descendants) change, if
+        _watches_children is True."""
+        pass
+
+    def _revert_restored(self, values):
+        """Reverts the documents in values that have unsaved changes. Called by _restore() on the values the undo
+        history puts back: a child that was edited and then removed before apply() still has the edits, which were
+        never saved."""
+        for value in values:
+            if isinstance(value, DocumentCore) and value._modified:
+                self._handler(value).revert()
+
+    def _invalidate(self):
+        """Discards the cached document and content hash of this object and of its document parents. Called
+        whenever the contents change. Parents cache their children's documents and hashes as parts of their own, so
+        unchanged branches are reused when they are rebuilt. A core with several parents invalidates each of them.
+        Parents that set _watches_children are told which of their children changed, through _child_changed()."""
+        node = self
+        while node is not None:
+            node._doc_cache = None
+            node._hash = None
+
+            ref = node._doc_parent
+            if type(ref) is tuple:
+                for parent in node._parents():
+                    if parent._watches_children:
+                        parent._child_changed(node)
+                    parent._invalidate()
+                return
+
+            parent = ref() if ref is not None else None
+            if parent is not None and parent._watches_children:
+                parent._child_changed(node)
+            node = parent
+
+    def _update_modified(self):
+        """Recalculates the modified property. If it changed, the document parent is notified and the facade (if
+        there is one) emits modifiedChanged. Only the state of this object is examined, so the cost of a change is
+        O(depth) rather than O(size of the document)."""
+        modified = bool(self._dirty) or self._has_changes()
+
+        if modified != self._modified:
+            self._modified = modified
+            if self._doc_parent is not None:
+                for parent in self._parents():
+                    parent._child_modified_changed(self, modified)
+
+            if self._facade is not None and not sip.isdeleted(self._facade):
+                self._facade._modified_changed()
+
+    @property
+    def modified(self):
+        """True if the document has been modified since the last save."""
+        return self._modified
+
+    @property
+    def document(self):
+        """Recursively generates JSON document from this object and its children. The result is expressed using
+        plain Python lists and dicts, and belongs to the caller."""
+        return _copy_tree(self._document())
+
+    def _document(self):
+        """Returns the document of this object, from the cache if possible. The result is shared, and must not be
+        modified."""
+        document = self._doc_cache
+        if document is None:
+            document = self._build_document()
+            if self._cacheable('_doc_cache'):
+                self._doc_cache = document
+
+        return document
+
+    def _cacheable(self, slot):
+        """Returns True if the document or content hash of this object, just built, can be cached in slot. It can't
+        if this object holds plain mutable containers (values stored without being converted to cores), because
+        changes to them are not tracked, or if a child's could not be cached for the same reason."""
+        for key, value in self._raw_items():
+            if type(value) in _SCALAR_TYPES:
+                continue
+            elif isinstance(value, DocumentCore):
+                if getattr(value, slot) is None:
+                    return False
+            elif isinstance(value, _MUTABLE_CONTAINERS):
+                return False
+
+        return True
+
+    def _build_document(self):
+        """Generates the document for this object. Children contribute their own (cached) documents."""
+        raise NotImplementedError
+
+    def iter_json(self, indent=4):
+        """Generates the document as JSON text, in small pieces, without building the document first. The output
+        is the same as json_util.dumps(self.document, indent=indent)."""
+        return _iter_json(self, indent, 0)
+
+    def content_hash(self):
+        """Returns a hash of the contents of the document (as seen in document). Documents that are equal have the
+        same hash, so documents with different hashes can't be equal. The hash is cached, and only recalculated for
+        the parts of the document that changed."""
+        content_hash = self._hash
+        if content_hash is None:
+            content_hash = self._build_hash()
+            if self._cacheable('_hash'):
+                self._hash = content_hash
+
+        return content_hash
+
+    def _build_hash(self):
+        """Calculates the content hash for this object. Children contribute their own (cached) hashes."""
+        raise NotImplementedError
+
+    @staticmethod
+    def _hash_of(item):
+        """Returns the content hash of item. Plain mappings and sequences hash the same as cores with the same
+        contents; values that can't be hashed all share one hash."""
+        if type(item) in _SCALAR_TYPES:
+            return hash(item)
+        elif isinstance(item, DocumentCore):
+            return item.content_hash()
+        elif isinstance(item, DocumentObject):
+            return item._core.content_hash()
+        elif isinstance(item, collections.Mapping):
+            return hash(frozenset((key, DocumentCore._hash_of(value)) for key, value in item.items()))
+        elif DocumentCore._needs_wrapping(item):
+            return hash(tuple(DocumentCore._hash_of(i) for i in item))
+
+        try:
+            return hash(item)
+        except TypeError:
+            return 0
+
+    @staticmethod
+    def _differs(a, b):
+        """Returns True if a != b. If either one is a document, the content hashes are compared first, so that
+        nested documents are only compared item by item when their hashes match."""
+        if a is b:
+            return False
+        elif (isinstance(a, DocumentCore) or isinstance(b, DocumentCore)) \
+                and DocumentCore._hash_of(a) != DocumentCore._hash_of(b):
+            return True
+
+        return a != b
+
+    @staticmethod
+    def _portable(item):
+        """Returns item in a form that can be pickled: cores and plain values are returned as-is, lazily stored
+        containers (which may be raw BSON) are converted with _plain()."""
+        if isinstance(item, DocumentCore) or not DocumentCore._needs_wrapping(item) or type(item) in (dict, list):
+            return item
+
+        return DocumentCore._plain(item)
+
+    def facade(self, parent=None):
+        """Returns the QObject facade for this core, creating it if necessary. parent is passed to the QObject
+        constructor of a new facade."""
+        raise NotImplementedError
+
+    def apply(self):
+        """Applies any changes to the document. This causes the modified property to be reset."""
+        raise NotImplementedError
+
+    def revert(self):
+        """Deletes any modifications to the document and restores it to its original state. This causes the
+        modified property to be reset."""
+        raise NotImplementedError
+
+
+########################################################################################################################
+
+
+class ListCore(DocumentCore, collections.MutableSequence):
+    """
+    ListCore holds the contents and change tracking of a list-based document. See ListObject for its QObject facade.
+
+    The saved state (_base) and the working state (_copy) share the same list until the first change is made.
+    Assignments, appends and deletions at the end change that list in place, and keep the saved items they overwrite
+    in _overwritten, by position; _base is None while they do. Changes that shift the items around (inserts and
+    deletes before the end, slice assignments) take time proportional to the length of the list anyway, and give
+    _copy a list of its own instead. apply() makes both names point to the same list again, so that the cost of a
+    change and its apply() is proportional to the size of the change, not to the length of the list. The saved
+    list is only rebuilt when it is needed as a whole, as by revert() (see _original).
+
+    Changes to the list itself are recorded in an operation log (_ops), which is used to build compact database
+    updates. See _summarize_ops().
+    """
+    __slots__ = ('_base', '_copy', '_overwritten', '_saved_len', '_mismatches', '_ops')
+
+    def __init__(self, iterable=None, lazy=False):
+        """Initialize the list. If lazy is True, nested sequences and mappings are stored as-is, and are converted
+        to cores the first time they are read."""
+        super().__init__(lazy=lazy)
+
+        iterable = [] if iterable is None else iterable
+        self._base = [self._as_core(i) for i in iterable] if lazy else [self._process_input(i) for i in iterable]
+        self._copy = self._base
+        self._overwritten = None
+        self._saved_len = 0
+
+        # Indices where _copy differs from _original. Only positions present in both lists are tracked; a difference
+        # in length is checked separately. None means the set has to be rebuilt (after an insert or delete shifted
+        # the items around).
+        self._mismatches = set()
+
+        # (operation, index) pairs, or None if the list hasn't changed since the last save
+        self._ops = None
+
+        for item in self._copy:
+            if type(item) not in _SCALAR_TYPES:
+                self._adopt(item)
+
+        self._modified = bool(self._dirty)
+
+    def facade(self, parent=None):
+        """Returns the ListObject for this core, creating it if necessary."""
+        if self._facade is None or sip.isdeleted(self._facade):
+            ListObject(parent=parent, _core=self)
+
+        return self._facade
+
+    def _mark(self, start, stop):
+        """Called before the items of _copy at positions start to stop are changed in place: assigned to, deleted
+        from the end, or appended. Keeps the saved items at those positions in _overwritten."""
+        copy = self._copy
+        if self._base is copy:
+            self._base = None
+            self._overwritten = {}
+            self._saved_len = len(copy)
+
+        if self._base is None:
+            overwritten = self._overwritten
+            for idx in range(start, min(stop, self._saved_len, len(copy))):
+                if idx not in overwritten:
+                    overwritten[idx] = copy[idx]
+
+    def _detach(self):
+        """Gives _copy a list of its own, separate from the saved state. Called before changes that shift the items of
+        _copy around."""
+        if self._base is self._copy:
+            self._copy = list(self._base)
+            self._mismatches = set()
+        elif self._base is None:
+            base = self._copy[:self._saved_len]
+            base.extend([None] * (self._saved_len - len(base)))
+            for idx, item in self._overwritten.items():
+                base[idx] = item
+
+            self._base = base
+            self._overwritten = None
+
+    @property
+    def _original(self):
+        """The saved state of the list. Rebuilt from _copy and _overwritten if the list was changed in place."""
+        if self._base is None:
+            self._detach()
+
+        return self._base
+
+    def _original_len(self):
+        """Returns the length of the saved state of the list."""
+        return self._saved_len if self._base is None else len(self._base)
+
+    def _original_item(self, index):
+        """Returns the item at (non-negative) index in the saved state of the list."""
+        if self._base is None:
+            overwritten = self._overwritten
+            return overwritten[index] if index in overwritten else self._copy[index]
+
+        return self._base[index]
+
+    def _log(self, op, index=None, count=1):
+        """Records an operation in the operation log. op is one of 'set', 'insert', 'delete' or 'slice'. Inserts and
+        deletes of several adjacent items are recorded as a single operation, with a count."""
+        if self._ops is None:
+            self._ops = []
+
+        self._ops.append((op, index, count))
+
+    def _summarize_ops(self):
+        """Describes the changes in the operation log as a single structural change, if possible. Returns one of:
+
+            ('set',)                        Items were assigned to, but nothing was inserted or deleted.
+            ('insert', start, count, other) One contiguous block of count items was inserted at start. other is True
+                                            if items outside of the block were assigned to as well.
+            ('delete', indices)             Only deletions were made; indices are the deleted positions in the
+                                            original list, in ascending order.
+            None                            Anything else.
+        """
+        ops = self._ops or ()
+        kinds = {op for op, index, count in ops}
+
+        if kinds <= {'set'}:
+            return ('set',)
+        elif kinds <= {'insert', 'set'}:
+            start, total, other = None, 0, False
+            for op, index, count in ops:
+                if op == 'set':
+                    other = other or start is None or not start <= index < start + total
+                elif start is None:
+                    start, total = index, count
+                elif start <= index <= start + total:
+                    total += count
+                else:
+                    return None
+
+            return ('insert', start, total, other)
+        elif kinds == {'delete'}:
+            remaining, deleted = list(range(self._original_len())), []
+            for op, index, count in ops:
+                deleted.extend(remaining[index:index + count])
+                del remaining[index:index + count]
+
+            return ('delete', sorted(deleted))
+        else:
+            return None
+
+    def _has_changes(self):
+        """Returns True if the items in the list differ from the original items."""
+        if self._copy is self._base:
+            return False
+        elif len(self._copy) != self._original_len():
+            return True
+
+        if self._mismatches is None:
+            self._mismatches = {idx for idx, (item, orig) in enumerate(zip(self._copy, self._original))
+                                if self._differs(item, orig)}
+
+        return bool(self._mismatches)
+
+    def _check_mismatch(self, index):
+        """Updates the mismatch set for a single (non-negative) index."""
+        if self._mismatches is None or index >= self._original_len() or index >= len(self._copy):
+            return
+
+        item, orig = self._copy[index], self._original_item(index)
+        if not self._differs(item, orig):
+            self._mismatches.discard(index)
+        else:
+            self._mismatches.add(index)
+
+    def _wrap(self, index, item):
+        """Replaces the lazily stored item at index with its core, and returns the new core. The original list is
+        updated as well, so that wrapping an item does not count as a modification."""
+        index = index if index >= 0 else index + len(self._copy)
+        wrapped = self._process_input(item)
+        self._copy[index] = wrapped
+
+        if self._copy is self._base:
+            pass
+        elif self._base is None:
+            for idx, orig in self._overwritten.items():
+                if orig is item:
+                    self._overwritten[idx] = wrapped
+                    break
+        elif index < len(self._base) and self._base[index] is item:
+            self._base[index] = wrapped
+        else:
+            for idx, orig in enumerate(self._base):
+                if orig is item:
+                    self._base[idx] = wrapped
+                    break
+
+        self._adopt(wrapped)
+        return wrapped
+
+    def __getitem__(self, index):
+        """Retrieve the item at the given index. Note that slicing returns a list object, NOT a ListCore."""
+        item = self._copy[index]
+
+        if self._lazy:
+            if isinstance(index, slice):
+                return [self[i] for i in range(*index.indices(len(self._copy)))]
+            elif self._needs_wrapping(item):
+                return self._wrap(index, item)
+
+        return item
+
+    def __setitem__(self, index, item):
+        """Modifies the item at the given index."""
+        if isinstance(index, slice):
+            self._detach()
+            items = [self._as_core(i) for i in item]
+            for old in self._copy[index]:
+                self._release(old)
+
+            self._copy[index] = items
+
+            for new in items:
+                self._adopt(new)
+
+            self._mismatches = None
+            self._log('slice')
+        else:
+            item = self._as_core(item)
+            old = self._copy[index]
+            index = index if index >= 0 else index + len(self._copy)
+            self._mark(index, index + 1)
+            self._copy[index] = item
+
+            if old is not item:
+                self._release(old)
+                self._adopt(item)
+
+            self._check_mismatch(index)
+            self._log('set', index)
+
+        self._invalidate()
+        self._update_modified()
+
+    def __delitem__(self, index):
+        """Delete the item at the specified index."""
+        if isinstance(index, slice):
+            length = len(self._copy)
+            start, stop, step = index.indices(length)
+            if step == 1 and stop == length:
+                self._mark(start, stop)
+            else:
+                self._detach()
+
+            for old in self._copy[index]:
+                self._release(old)
+
+            del self._copy[index]
+            if step != 1:
+                self._mismatches = None
+                self._log('slice')
+            elif stop > start:
+                self._log('delete', start, stop - start)
+
+                # Deleting from the end doesn't shift anything around
+                if stop < length:
+                    self._mismatches = None
+                elif self._mismatches is not None:
+                    self._mismatches.difference_update(range(start, stop))
+        else:
+            old = self._copy[index]
+            index = index if index >= 0 else index + len(self._copy)
+            if index == len(self._copy) - 1:
+                self._mark(index, index + 1)
+            else:
+                self._detach()
+
+            del self._copy[index]
+            self._release(old)
+            self._log('delete', index)
+
+            # Deleting the last item doesn't shift anything around
+            if index == len(self._copy):
+                if self._mismatches is not None:
+                    self._mismatches.discard(index)
+            else:
+                self._mismatches = None
+
+        self._invalidate()
+        self._update_modified()
+
+    def insert(self, index, item):
+        """Insert an item at the given index."""
+        item = self._as_core(item)
+        length = len(self._copy)
+        index = min(max(index if index >= 0 else index + length, 0), length)
+        if index == length:
+            self._mark(index, index + 1)
+        else:
+            self._detach()
+
+        self._copy.insert(index, item)
+        self._adopt(item)
+        self._log('insert', index)
+
+        # Appending doesn't shift anything around
+        if index == length:
+            self._check_mismatch(index)
+        else:
+            self._mismatches = None
+
+        self._invalidate()
+        self._update_modified()
+
+    def insert_many(self, index, items):
+        """Inserts the items in the sequence items at the given index, as a single change."""
+        items = [self._as_core(i) for i in items]
+        if not items:
+            return
+
+        length = len(self._copy)
+        index = min(max(index if index >= 0 else index + length, 0), length)
+        if index == length:
+            self._mark(index, index + len(items))
+        else:
+            self._detach()
+
+        self._copy[index:index] = items
+        for item in items:
+            self._adopt(item)
+        self._log('insert', index, len(items))
+
+        # Appending doesn't shift anything around
+        if index == length:
+            for idx in range(index, index + len(items)):
+                self._check_mismatch(idx)
+        else:
+            self._mismatches = None
+
+        self._invalidate()
+        self._update_modified()
+
+    def extend(self, items):
+        """Appends the items in the sequence items to the list, as a single change."""
+        self.insert_many(len(self._copy), items)
+
+    def _extend_saved(self, items):
+        """Appends items to both the saved and the working state of the list, without marking it as modified."""
+        items = [self._as_core(i) for i in items]
+
+        original = self._original
+        original.extend(items)
+        if self._copy is not original:
+            self._copy.extend(items)
+
+        for item in items:
+            self._adopt(item)
+
+        self._invalidate()
+        self._update_modified()
+
+    def _raw_items(self):
+        """Yields index-item pairs, without wrapping lazily stored items."""
+        return enumerate(self._copy)
+
+    def __len__(self):
+        """Return the number of items in the list."""
+        return len(self._copy)
+
+    def __iter__(self):
+        """Return an iterator for the list."""
+        if self._lazy:
+            return (self[i] for i in range(len(self._copy)))
+
+        return iter(self._copy)
+
+    def apply(self, apply_children=True):
+        """Save the current state of the list. Resets the modified property. Only modified children are visited, and
+        the list itself is not copied."""
+        if apply_children:
+            for obj in list(self._dirty.values()):
+                self._handler(obj).apply()
+
+        if History._recording is not None and self._copy is not self._base:
+            History._recording.append(self._delta())
+
+        self._base = self._copy
+        self._overwritten = None
+        self._mismatches = set()
+        self._ops = None
+
+        self._update_modified()
+
+    def revert(self, revert_children=True):
+        """Discard any modifications made since the last save. Children that are modified, or that were removed
+        and are now restored, are reverted as well."""
+        copy, original = self._copy, self._original
+
+        if copy is original:
+            removed, restored = [], []
+        elif len(copy) == len(original) and self._mismatches is not None:
+            # Only some positions were assigned to
+            removed = [copy[idx] for idx in self._mismatches]
+            restored = [original[idx] for idx in self._mismatches]
+        else:
+            copy_ids = {id(obj) for obj in copy}
+            original_ids = {id(obj) for obj in original}
+            removed = [obj for obj in copy if id(obj) not in original_ids]
+            restored = [obj for obj in original if id(obj) not in copy_ids]
+
+        for obj in removed:
+            self._release(obj)
+
+        if revert_children:
+            for obj in itertools.chain(list(self._dirty.values()), restored):
+                if isinstance(obj, DocumentCore):
+                    self._handler(obj).revert()
+
+        self._copy = original
+        self._mismatches = set()
+        self._ops = None
+
+        for obj in restored:
+            self._adopt(obj)
+
+        self._invalidate()
+        self._update_modified()
+
+    def _delta(self):
+        """Describes the unsaved changes to the list as (core, undo state, redo state), for History. Assignments,
+        a single inserted block and deletions are described by the affected items only; anything else by the
+        whole list."""
+        copy, original = self._copy, self._original_item
+        summary = self._summarize_ops()
+
+        if summary == ('set',) and len(copy) == self._original_len():
+            self._has_changes()
+            return self, ('assign', {i: original(i) for i in self._mismatches}), \
+                         ('assign', {i: copy[i] for i in self._mismatches})
+        elif summary is not None and summary[0] == 'insert' and not summary[3]:
+            start, count = summary[1:3]
+            items = [(i, copy[i]) for i in range(start, start + count)]
+            return self, ('delete', items), ('insert', items)
+        elif summary is not None and summary[0] == 'delete':
+            items = [(i, original(i)) for i in summary[1]]
+            return self, ('insert', items), ('delete', items)
+        else:
+            return self, ('replace', self._original), ('replace', list(copy))
+
+    def _restore(self, state):
+        """Changes the saved state of the list as described by a state recorded by _delta(). Unsaved changes to
+        the list are discarded first."""
+        if self._copy is not self._base:
+            ListCore.revert(self, revert_children=False)
+
+        facade = self._facade if self._facade is not None and not sip.isdeleted(self._facade) else None
+        if facade is not None:
+            facade._begin_restore()
+
+        kind, changes = state
+        items, released, adopted = self._copy, [], []
+
+        if kind == 'assign':
+            for idx, item in changes.items():
+                released.append(items[idx])
+                items[idx] = item
+                adopted.append(item)
+        elif kind == 'insert':
+            for idx, item in changes:
+                items.insert(idx, item)
+                adopted.append(item)
+        elif kind == 'delete':
+            for idx, item in reversed(changes):
+                released.append(items.pop(idx))
+        else:
+            released, adopted = items, list(changes)
+            self._copy = self._base = adopted
+
+        for item in released:
+            self._release(item)
+        self._revert_restored(adopted)
+        for item in adopted:
+            self._adopt(item)
+
+        self._mismatches = set()
+        self._ops = None
+        self._invalidate()
+        self._update_modified()
+
+        if facade is not None:
+            facade._end_restore(released, adopted)
+
+    def _build_document(self):
+        return [self._plain(item) for item in self._copy]
+
+    def _build_hash(self):
+        return hash(tuple(self._hash_of(item) for item in self._copy))
+
+    def __eq__(self, other):
+        """Compares the contents of the list with another sequence. The content hashes are compared first."""
+        if other is self:
+            return True
+
+        other = self._as_core(other)
+        if isinstance(other, ListCore):
+            items = other._copy
+        elif self._needs_wrapping(other) and not isinstance(other, collections.Mapping):
+            items = other
+        else:
+            return NotImplemented
+
+        if len(self._copy) != len(items) or self.content_hash() != self._hash_of(other):
+            return False
+
+        return not any(self._differs(a, b) for a, b in zip(self._copy, items))
+
+    __hash__ = None
+
+    def __reduce__(self):
+        """Pickles the saved and the working state of the list, and its operation log. The facade and the
+        document parent are not included."""
+        original = [self._portable(item) for item in self._original] if self._lazy else self._original
+        if self._copy is self._base:
+            copy = None
+        else:
+            copy = [self._portable(item) for item in self._copy] if self._lazy else self._copy
+
+        return _rebuild_list_core, _trimmed(original, copy, self._ops, self._lazy)
+
+    @property
+    def original(self):
+        return tuple(self._original)
+
+
+########################################################################################################################
+
+
+class SharedKeyMap(collections.MutableMapping):
+    """
+    SharedKeyMap is a compact mapping for large numbers of documents with the same keys. The keys are kept in a
+    layout (a dict relating each key to its position) that is shared by every SharedKeyMap with the same keys in the
+    same order, so each map only stores a list of values. Adding or removing a key moves the map to another layout.
+    MapCore uses a SharedKeyMap as its saved state when it is created with compact=True.
+
+    Shared layouts are kept in a cache of at most max_layouts entries; when it is full, the oldest entry is dropped
+    (maps that use it keep it, but new maps no longer share it). Only the layouts of new maps and of maps that were
+    changed by apply_changes() are added to the cache. Adding or removing a single key reuses a cached layout if there
+    is one, but otherwise gives the map a layout of its own, so the intermediate key sets of a map that is built up
+    one key at a time are not kept.
+    """
+    __slots__ = ('_layout', '_values')
+    _layouts = {}
+    max_layouts = 1024
+
+    def __init__(self, mapping=None):
+        mapping = {} if mapping is None else mapping
+        self._layout = SharedKeyMap._layout_for(tuple(mapping))
+        self._values = list(mapping.values())
+
+    @staticmethod
+    def _layout_for(keys, share=True):
+        """Returns the shared layout for a tuple of keys. If there is none, a new layout is created, and added to the
+        cache if share is True."""
+        layouts = SharedKeyMap._layouts
+        try:
+            return layouts[keys]
+        except KeyError:
+            layout = {key: index for index, key in enumerate(keys)}
+
+        if share:
+            while len(layouts) >= SharedKeyMap.max_layouts:
+                del layouts[next(iter(layouts))]
+            layouts[keys] = layout
+
+        return layout
+
+    @classmethod
+    def _from_layout(cls, keys, values):
+        """Creates a SharedKeyMap from a sequence of keys and a list of values, in the same order."""
+        shared = cls.__new__(cls)
+        shared._layout = SharedKeyMap._layout_for(tuple(keys))
+        shared._values = values
+        return shared
+
+    def apply_changes(self, mods, dels):
+        """Assigns the values in the mapping mods and removes the keys in dels (which must not be in mods), moving
+        the map to the shared layout of its new keys in a single step."""
+        layout, values = self._layout, self._values
+        added = [key for key in mods if key not in layout]
+        removed = [key for key in dels if key in layout]
+
+        for key, value in mods.items():
+            if key in layout:
+                values[layout[key]] = value
+
+        if not (added or removed):
+            return
+
+        removed = set(removed)
+        kept = [(key, values[index]) for key, index in layout.items() if key not in removed]
+        self._layout = SharedKeyMap._layout_for(tuple(key for key, value in kept) + tuple(added))
+        self._values = [value for key, value in kept] + [mods[key] for key in added]
+
+    def __getitem__(self, key):
+        return self._values[self._layout[key]]
+
+    def __setitem__(self, key, value):
+        try:
+            self._values[self._layout[key]] = value
+        except KeyError:
+            self._layout = SharedKeyMap._layout_for(tuple(self._layout) + (key,), share=False)
+            self._values.append(value)
+
+    def __delitem__(self, key):
+        index = self._layout[key]
+        keys = list(self._layout)
+        del keys[index]
+        del self._values[index]
+        self._layout = SharedKeyMap._layout_for(tuple(keys), share=False)
+
+    def __contains__(self, key):
+        return key in self._layout
+
+    def __iter__(self):
+        return iter(self._layout)
+
+    def __len__(self):
+        return len(self._values)
+
+    def items(self):
+        return zip(self._layout, self._values)
+
+    def values(self):
+        return iter(self._values)
+
+
+########################################################################################################################
+
+
+class MapCore(DocumentCore, collections.MutableMapping):
+    """
+    MapCore holds the contents and change tracking of a dictionary-based document. The last saved state is kept in
+    _map; unsaved changes are kept in _mods (new and changed values) and _dels (deleted keys). The number of keys
+    in the merged view is kept in _len. See MapObject for its QObject facade.
+
+    _mods and _dels share a read-only empty placeholder until the first change, and go back to it when the changes
+    are applied or reverted.
+
+    _defaults caches default values for missing keys that have been read but not set (see default()). They are not
+    part of the document and don't count as changes.
+    """
+    __slots__ = ('_map', '_mods', '_dels', '_len', '_defaults')
+
+    def __init__(self, mapping=None, lazy=False, compact=False):
+        """Initialize the map. If lazy is True, nested mappings and sequences are stored as-is, and are converted to
+        cores the first time they are read. If compact is True, the saved state is kept in a SharedKeyMap."""
+        super().__init__(lazy=lazy)
+
+        mapping = {} if mapping is None else mapping
+        if lazy:
+            self._map = {k: self._as_core(v) for k, v in mapping.items()}
+        else:
+            self._map = {k: self._process_input(v) for k, v in mapping.items()}
+
+        if compact:
+            self._map = SharedKeyMap(self._map)
+
+        self._mods = _EMPTY_MAP
+        self._dels = _EMPTY_SET
+        self._len = len(self._map)
+        self._defaults = _EMPTY_MAP
+
+        for value in self._map.values():
+            if type(value) not in _SCALAR_TYPES:
+                self._adopt(value)
+
+        self._modified = bool(self._dirty)
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        """Creates a lazy MapCore that uses mapping as its saved state directly, instead of copying it. Values are
+        only read from mapping when they are accessed. mapping must allow existing keys to be reassigned (this is
+        used to store converted values); it is replaced by a dict of its own the first time keys are added or
+        removed."""
+        core = cls(lazy=True)
+        core._map = mapping
+        core._len = len(mapping)
+        return core
+
+    def _own_map(self):
+        """Replaces a shared mapping (see from_mapping()) with a dict before keys are added to or removed from _map.
+        Returns _map."""
+        if type(self._map) not in (dict, SharedKeyMap):
+            self._map = dict(self._map.items())
+
+        return self._map
+
+    def facade(self, parent=None):
+        """Returns the MapObject for this core, creating it if necessary. The class of the new facade is looked up
+        using the document's _type key."""
+        if self._facade is None or sip.isdeleted(self._facade):
+            object_type = MapObjectMetaclass.subclasses.get(self.get('_type', None), None) or MapObject
+            object_type(parent=parent, _core=self)
+
+        return self._facade
+
+    def __getitem__(self, key):
+        """Retrieve value from the map. KeyError is raised if the provided key does not exist in the map."""
+        if key in self._mods:
+            source = self._mods
+        elif key in self._dels:
+            raise KeyError(key)
+        else:
+            source = self._map
+
+        value = source[key]
+        if self._lazy and self._needs_wrapping(value):
+            value = source[key] = self._process_input(value)
+            self._adopt(value)
+
+        return value
+
+    def _peek(self, key, default=None):
+        """Like get(), but lazily stored values are returned as-is instead of being wrapped."""
+        if key in self._mods:
+            return self._mods[key]
+        elif key in self._map and key not in self._dels:
+            return self._map[key]
+        else:
+            return default
+
+    def _raw_items(self):
+        """Like items(), but lazily stored values are returned as-is instead of being wrapped."""
+        if not (self._mods or self._dels):
+            return iter(self._map.items())
+
+        return self._merged_items()
+
+    def _merged_items(self):
+        """Yields the key-value pairs of _map, overlaid with _mods and _dels."""
+        _map, mods, dels = self._map, self._mods, self._dels
+
+        for key, value in _map.items():
+            if key in mods:
+                yield key, mods[key]
+            elif key not in dels:
+                yield key, value
+
+        for key, value in mods.items():
+            if key not in _map:
+                yield key, value
+
+    def _recount(self):
+        """Recalculates _len. Only needed after _map, _mods or _dels have been replaced directly."""
+        self._len = sum(1 for item in self._raw_items())
+
+    def __contains__(self, key):
+        """Return True if the map contains key."""
+        return key in self._mods or (key in self._map and key not in self._dels)
+
+    def default(self, key, factory):
+        """Returns the default value for key, which is missing from the map. The first time, the value is created by
+        calling factory() (DocumentObjects are stored as their cores, and plain lists and dicts are converted to
+        cores), and cached until key is assigned. The default is not added to the map, so reading it does not modify
+        the document. If the default is a document, and it is modified in place, it is assigned to key at that
+        point."""
+        if key in self._defaults:
+            return self._defaults[key]
+
+        value = self._process_input(factory())
+        if self._defaults is _EMPTY_MAP:
+            self._defaults = {}
+        self._defaults[key] = value
+
+        if isinstance(value, DocumentCore):
+            # Not adopted; the parent pointer only lets in-place changes reach _child_modified_changed()
+            value._link(self)
+
+        return value
+
+    def _drop_default(self, key):
+        """Discards the cached default value for key, if there is one."""
+        value = self._defaults.pop(key, None)
+        if isinstance(value, DocumentCore):
+            value._unlink(self)
+
+    def _child_modified_changed(self, child, modified):
+        """Called by an adopted child when its modification state flips. A cached default (see default()) that is
+        modified is assigned to its key, so that the change becomes part of the document."""
+        if modified and self._defaults:
+            for key, value in self._defaults.items():
+                if value is child:
+                    self._drop_default(key)
+                    self[key] = child
+                    return
+
+        super()._child_modified_changed(child, modified)
+
+    def __setitem__(self, key, value):
+        """Assign a value to a key."""
+        value = self._as_core(value)
+        if self._defaults:
+            self._drop_default(key)
+        if key not in self:
+            self._len += 1
+
+        current = self._peek(key)
+
+        if key not in self._map \
+                or self._differs(self._map[key], value):
+            # It's a new key, or a modification of the original key's value
+            if self._mods is _EMPTY_MAP:
+                self._mods = {}
+            self._mods[key] = value
+        elif self._mods:
+            # We are setting a key back to its original value
+            self._mods.pop(key, None)
+
+        # If this key was marked as deleted, clear it
+        if self._dels:
+            self._dels.discard(key)
+
+        # Only the value that is now visible counts towards the modified state
+        new = self._peek(key)
+        if new is not current:
+            self._release(current)
+            self._adopt(new)
+
+        # If modification status changed, emit the signal
+        self._invalidate()
+        self._update_modified()
+
+    def __delitem__(self, key):
+        """Delete a key-value pair."""
+        if not (key in self._map or key in self._mods) \
+                or key in self._dels:
+            # key is not in the map and it's not in the mods
+            raise KeyError(key)
+        else:
+            self._release(self._peek(key))
+
+            if self._mods:
+                self._mods.pop(key, None)
+            if key in self._map:
+                if self._dels is _EMPTY_SET:
+                    self._dels = set()
+                self._dels.add(key)
+
+            self._len -= 1
+            self._invalidate()
+            self._update_modified()
+
+    def __iter__(self):
+        """Return an iterator for the map's keys."""
+        _map, mods, dels = self._map, self._mods, self._dels
+        if not (mods or dels):
+            return iter(_map)
+
+        added = (key for key in mods if key not in _map)
+        if not dels:
+            return itertools.chain(_map, added)
+
+        return itertools.chain((key for key in _map if key not in dels), added)
+
+    def __len__(self):
+        """Return the number of keys in the map."""
+        return self._len
+
+    def keys(self):
+        """Return an iterator of the map's keys."""
+        return iter(self)
+
+    def items(self):
+        """Yields the key-value pairs in the document."""
+        if not self._lazy:
+            yield from self._raw_items()
+            return
+
+        for key, value in self._raw_items():
+            yield key, (self[key] if self._needs_wrapping(value) else value)
+
+    def values(self):
+        """Yields the values in the document."""
+        for key, value in self.items():
+            yield value
+
+    @property
+    def map(self):
+        """Returns a read-only view (a MappingProxyType) of the last 'saved' version of the map."""
+        return types.MappingProxyType(self._map)
+
+    @property
+    def mods(self):
+        """Returns a read-only view (a MappingProxyType) of document's unsaved modifications."""
+        return types.MappingProxyType(self._mods)
+
+    @property
+    def dels(self):
+        """Returns a tuple of keys that have been deleted from the document since the last save."""
+        return tuple(self._dels)
+
+    def _has_changes(self):
+        """Returns True if keys have been added, changed or deleted."""
+        return bool(self._mods or self._dels)
+
+    def apply(self):
+        """Saves changes in this document and all sub-documents. Only the changed keys and the modified
+        sub-documents are visited; unchanged values stay where they are."""
+        for item in list(self._dirty.values()):
+            self._handler(item).apply()
+
+        if History._recording is not None and (self._mods or self._dels):
+            History._recording.append(self._delta())
+
+        if self._mods or self._dels:
+            _map = self._own_map()
+            if type(_map) is SharedKeyMap:
+                _map.apply_changes(self._mods, self._dels)
+            else:
+                _map.update(self._mods)
+                for key in self._dels:
+                    _map.pop(key, None)
+
+        self._mods = _EMPTY_MAP
+        self._dels = _EMPTY_SET
+
+        self._update_modified()
+
+    def revert(self):
+        """Discards any changes in this document and all sub-documents since they were last saved. Only the
+        changed keys and the modified sub-documents are visited."""
+        _map = self._map
+        restored = [_map[key] for key in itertools.chain(self._mods, self._dels) if key in _map]
+
+        for value in self._mods.values():
+            self._release(value)
+
+        for value in itertools.chain(list(self._dirty.values()), restored):
+            if isinstance(value, DocumentCore):
+                self._handler(value).revert()
+
+        self._mods = _EMPTY_MAP
+        self._dels = _EMPTY_SET
+        self._len = len(_map)
+
+        for value in restored:
+            self._adopt(value)
+
+        self._invalidate()
+        self._update_modified()
+
+    def _delta(self):
+        """Describes the unsaved changes to the map as (core, undo state, redo state), for History. Only the
+        changed keys are included."""
+        _map = self._map
+        before = {key: _map[key] if key in _map else _MISSING for key in itertools.chain(self._mods, self._dels)}
+        after = dict(self._mods)
+        after.update(dict.fromkeys(self._dels, _MISSING))
+
+        return self, ('assign', before), ('assign', after)
+
+    def _restore(self, state):
+        """Changes the saved state of the map as described by a state recorded by _delta(). Unsaved changes to
+        the map are discarded first."""
+        if self._mods or self._dels:
+            MapCore.revert(self)
+
+        facade = self._facade if self._facade is not None and not sip.isdeleted(self._facade) else None
+        if facade is not None:
+            facade._begin_restore()
+
+        _map, released, adopted = self._own_map(), [], []
+        for key, value in state[1].items():
+            current = _map.get(key, _MISSING)
+            if value is _MISSING:
+                _map.pop(key, None)
+            else:
+                _map[key] = value
+
+            if current is not value:
+                released.append(current)
+                adopted.append(value)
+
+        for value in released:
+            self._release(value)
+        self._revert_restored(adopted)
+        for value in adopted:
+            self._adopt(value)
+
+        self._len = len(_map)
+        self._invalidate()
+        self._update_modified()
+
+        if facade is not None:
+            facade._end_restore(released, adopted)
+
+    def _build_document(self):
+        return {key: self._plain(value) for key, value in self._raw_items()}
+
+    def _build_hash(self):
+        return hash(frozenset((key, self._hash_of(value)) for key, value in self._raw_items()))
+
+    def __eq__(self, other):
+        """Compares the contents of two mappings. The content hashes are compared first."""
+        if other is self:
+            return True
+        elif not isinstance(other, collections.Mapping):
+            return NotImplemented
+        elif self.content_hash() != self._hash_of(other):
+            return False
+
+        return collections.Mapping.__eq__(self, other)
+
+    def __reduce__(self):
+        """Pickles the saved state of the map and its unsaved changes. The layout of a SharedKeyMap is pickled as a
+        reference to an object that is shared by all maps with the same keys, so it is only written once. The facade
+        and the document parent are not included."""
+        _map, portable = self._map, self._portable
+
+        if type(_map) is SharedKeyMap:
+            saved = (_map._layout, [portable(v) for v in _map._values] if self._lazy else _map._values)
+        elif self._lazy or type(_map) is not dict:
+            saved = {k: portable(v) for k, v in _map.items()}
+        else:
+            saved = _map
+
+        return _rebuild_map_core, _trimmed(saved, self._mods or None, tuple(self._dels) or None, self._lazy)
+
+
+def _trimmed(*args):
+    """Returns args as a tuple, without trailing arguments that are None or False (the defaults of the rebuild
+    functions below). Most documents have no changes, so this keeps pickles small."""
+    end = len(args)
+    while end and (args[end - 1] is None or args[end - 1] is False):
+        end -= 1
+
+    return args[:end]
+
+
+def _rebuild_list_core(original, copy=None, ops=None, lazy=False):
+    """Unpickles a ListCore. See ListCore.__reduce__()."""
+    core = ListCore.__new__(ListCore)
+    DocumentCore.__init__(core, lazy=lazy)
+
+    core._base = original
+    core._copy = original if copy is None else copy
+    core._overwritten = None
+    core._saved_len = 0
+    core._mismatches = set() if copy is None else None
+    core._ops = ops
+
+    for item in core._copy:
+        core._adopt(item)
+
+    core._modified = bool(core._dirty) or core._has_changes()
+    return core
+
+
+def _rebuild_map_core(saved, mods=None, dels=None, lazy=False):
+    """Unpickles a MapCore. See MapCore.__reduce__()."""
+    core = MapCore.__new__(MapCore)
+    DocumentCore.__init__(core, lazy=lazy)
+
+    core._map = SharedKeyMap._from_layout(*saved) if type(saved) is tuple else saved
+    core._mods = _EMPTY_MAP if mods is None else mods
+    core._dels = _EMPTY_SET if dels is None else set(dels)
+    core._len = len(core._map)
+    core._defaults = _EMPTY_MAP
+    if mods or dels:
+        core._recount()
+
+    for key, value in core._raw_items():
+        core._adopt(value)
+
+    core._modified = bool(core._dirty) or core._has_changes()
+    return core
+
+
+def _rebuild_facade(core):
+    """Unpickles a DocumentObject, as the facade of its (unpickled) core. The class of a MapObject is looked up
+    using its _type key."""
+    return core.facade()
+
+
+def _json_key(key):
+    """Returns a mapping key as JSON text, converting it to a string the way json.dumps() does."""
+    if type(key) is not str:
+        key = json.dumps(key) if key is None or isinstance(key, (bool, float)) else str(key)
+
+    return _json_string(key)
+
+
+_json_string = json.encoder.encode_basestring_ascii
+
+
+def _copy_tree(item):
+    """Returns a copy of a document tree built from plain dicts and lists. Other values are shared."""
+    _type = type(item)
+    if _type is dict:
+        return {key: _copy_tree(value) for key, value in item.items()}
+    elif _type is list:
+        return [_copy_tree(value) for value in item]
+
+    return item
+
+
+def _iter_json(item, indent, level):
+    """Generates item as JSON text. Documents, mappings and sequences are walked recursively; BSON types are
+    converted with json_util.default()."""
+    _type = type(item)
+    if _type is str:
+        yield _json_string(item)
+        return
+    elif item is None:
+        yield 'null'
+        return
+    elif _type is bool:
+        yield 'true' if item else 'false'
+        return
+    elif _type is int:
+        yield int.__repr__(item)
+        return
+    elif _type is float and math.isfinite(item):
+        yield float.__repr__(item)
+        return
+
+    if isinstance(item, DocumentObject):
+        item = item._core
+
+    if isinstance(item, MapCore):
+        items, brackets = item._raw_items(), '{}'
+    elif isinstance(item, ListCore):
+        items, brackets = item._copy, '[]'
+    elif isinstance(item, collections.Mapping):
+        items, brackets = item.items(), '{}'
+    elif DocumentCore._needs_wrapping(item):
+        items, brackets = item, '[]'
+    else:
+        try:
+            converted = json_default(item)
+        except TypeError:
+            raise TypeError('Object of type %s is not JSON serializable' % _type.__name__)
+
+        yield from _iter_json(converted, indent, level)
+        return
+
+    if indent is None:
+        separator, prefix, closing = ', ', brackets[0], brackets[1]
+    else:
+        separator = ',\n' + ' ' * (indent * (level + 1))
+        prefix = brackets[0] + separator[1:]
+        closing = '\n' + ' ' * (indent * level) + brackets[1]
+    if brackets == '{}':
+        for key, value in items:
+            yield prefix + _json_key(key) + ': '
+            yield from _iter_json(value, indent, level + 1)
+            prefix = separator
+    else:
+        for value in items:
+            yield prefix
+            yield from _iter_json(value, indent, level + 1)
+            prefix = separator
+
+    yield brackets if prefix is not separator else closing
+
+
+def _text_writer(sink):
+    """Returns a function that writes text to sink: a QTextStream, a QIODevice, an object with a write() method,
+    or a callable."""
+    if isinstance(sink, qtc.QTextStream):
+        return lambda text: sink << text
+    elif isinstance(sink, qtc.QIODevice):
+        return lambda text: sink.write(text.encode())
+    elif hasattr(sink, 'write'):
+        return sink.write
+    elif callable(sink):
+        return sink
+
+    raise TypeError('Can not write to %s.' % type(sink).__name__)
 
 
 ########################################################################################################################
 
 
-class DocumentObjectMetaclass(sip.wrappertype, abc.ABCMeta):
-    """DocumentObjectMetaclass provides a QObject-compatible metaclass for DocumentObject."""
-    def __init__(cls, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+class History:
+    """
+    History keeps the undo and redo steps of a document. Each call to the document's apply() becomes a step, which
+    holds only what that call saved: the changed keys of each map, and the changed items (or, for complex changes,
+    the contents) of each list, before and after. Values are shared with the documents, not copied, so recording,
+    undoing and redoing a step cost time and memory in proportion to the size of the change.
+
+    max_size limits the approximate memory (in bytes) used by the recorded changes. When it is exceeded, the oldest
+    steps are dropped.
+    """
+    # The changes collected by the apply() being recorded, if any
+    _recording = None
+
+    def __init__(self, max_size=1 << 20):
+        self.max_size = max_size
+        self._undo = collections.deque()
+        self._redo = []
+        self._size = 0
+
+    @staticmethod
+    def _size_of(deltas):
+        """Returns the approximate memory used by a step."""
+        return sys.getsizeof(deltas) + sum(sys.getsizeof(undo[1]) + sys.getsizeof(redo[1])
+                                           for core, undo, redo in deltas)
+
+    def record(self, apply):
+        """Calls apply(), recording the changes it saves as a new undo step. The redo steps are discarded."""
+        if History._recording is not None:
+            # Part of another document's step
+            apply()
+            return
+
+        History._recording = deltas = []
+        try:
+            apply()
+        finally:
+            History._recording = None
+
+        if not deltas:
+            return
+
+        size = self._size_of(deltas)
+        self._undo.append((deltas, size))
+        self._size += size - sum(size for deltas, size in self._redo)
+        self._redo = []
+
+        while self._size > self.max_size and self._undo:
+            self._size -= self._undo.popleft()[1]
+
+    def can_undo(self):
+        return bool(self._undo)
+
+    def can_redo(self):
+        return bool(self._redo)
+
+    def undo(self):
+        """Restores the documents to the way they were before the last step. The document must not have unsaved
+        changes."""
+        step = self._undo.pop()
+        for core, undo, redo in reversed(step[0]):
+            core._restore(undo)
+
+        self._redo.append(step)
+
+    def redo(self):
+        """Restores the documents to the way they were after the last undone step. The document must not have
+        unsaved changes."""
+        step = self._redo.pop()
+        for core, undo, redo in step[0]:
+            core._restore(redo)
+
+        self._undo.append(step)
 
 
 ########################################################################################################################
@@ -20,19 +1622,111 @@ class DocumentObject(qtc.QObject):
     """
     DocumentObject is the base class for qp documents (MapObject and ListObject). It defines the basic interface
     shared by all document types: a "modified" property and signal, apply(), revert(), and a document property.
+
+    A DocumentObject is a facade for a DocumentCore, which holds the actual contents and tracks changes. Nested
+    documents are stored as cores, and their facades are created the first time they are read through a facade.
+
+    Change notifications can be held back with batch() (or beginBatch()/endBatch() from QML). While a batch is open,
+    modifiedChanged and property notification signals are collected instead of emitted; when the outermost batch
+    ends, each of them is emitted once. Batches are shared by all documents, so a batch opened on one object also
+    covers its parents and children.
     """
-    def _process_input(self, item):
-        """Converts non-string sequences and mappings to DocumentObjects. Leaves other inputs unchanged."""
-        if isinstance(item, collections.Sequence) and not isinstance(item, (str, ListObject)):
-            lo = ListObject(item, parent=self)
-            lo.modifiedChanged.connect(self.modifiedChanged)
-            return lo
-        elif isinstance(item, collections.Mapping) and not isinstance(item, MapObject):
-            mo = MapObject.from_document(item, parent=self)
-            mo.modifiedChanged.connect(self.modifiedChanged)
-            return mo
+    _batch_depth = 0
+    _batch_signals = {}
+    _batch_models = {}
+    _history = None
 
-        return item
+    @staticmethod
+    def _emit(sender, signal):
+        """Emits the bound signal, which belongs to sender. If a batch is open, the signal is recorded instead, and
+        emitted once when the batch ends."""
+        if DocumentObject._batch_depth:
+            DocumentObject._batch_signals[(id(sender), getattr(signal, 'signal', id(signal)))] = (sender, signal)
+        else:
+            signal.emit()
+
+    @staticmethod
+    def _batch_model(model):
+        """Registers an ObjectModel that has collected dataChanged rows during the current batch."""
+        DocumentObject._batch_models[id(model)] = model
+
+    @staticmethod
+    def _flush_batch():
+        """Emits the signals collected during a batch. Models are flushed last, so that they can gather the rows
+        touched by the property signals. The batch is closed even if emitting a signal raises an exception; the
+        signals that were still pending are dropped."""
+        try:
+            while DocumentObject._batch_signals:
+                signals, DocumentObject._batch_signals = DocumentObject._batch_signals, {}
+                for sender, signal in signals.values():
+                    if not sip.isdeleted(sender):
+                        signal.emit()
+        finally:
+            DocumentObject._batch_depth -= 1
+            DocumentObject._batch_signals = {}
+            models, DocumentObject._batch_models = DocumentObject._batch_models, {}
+
+        for model in models.values():
+            if not sip.isdeleted(model):
+                model._flush_rows()
+
+    @qtc.pyqtSlot()
+    def beginBatch(self):
+        """Starts holding back change notifications. Every call must be matched by a call to endBatch()."""
+        DocumentObject._batch_depth += 1
+
+    @qtc.pyqtSlot()
+    def endBatch(self):
+        """Ends a batch started with beginBatch(). When the outermost batch ends, the collected notifications are
+        emitted."""
+        if DocumentObject._batch_depth == 1:
+            self._flush_batch()
+        elif DocumentObject._batch_depth > 1:
+            DocumentObject._batch_depth -= 1
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Context manager that holds back change notifications until the block exits.
+
+        Usage:  with obj.batch():
+                    obj['a'] = 1
+                    obj['b'] = 2
+        """
+        self.beginBatch()
+        try:
+            yield self
+        finally:
+            self.endBatch()
+
+    def _facade_of(self, item):
+        """Returns the facade for item if it is a DocumentCore, creating it as a child of this object if necessary.
+        Other values are returned unchanged."""
+        return item.facade(parent=self) if isinstance(item, DocumentCore) else item
+
+    @property
+    def core(self):
+        """The DocumentCore holding this object's contents."""
+        return self._core
+
+    def __reduce__(self):
+        """DocumentObjects are pickled as their cores, so the saved state, the unsaved changes and (through _type)
+        the class of the object are preserved. Parents and signal connections are not."""
+        return _rebuild_facade, (self._core,)
+
+    @staticmethod
+    def pack(documents):
+        """Pickles a sequence of DocumentObjects or DocumentCores into a single bytes object, for sending to
+        another process (for instance, as an argument to a ProcessPoolExecutor task). Keys and SharedKeyMap layouts
+        that are shared by several documents are only written once."""
+        return pickle.dumps([DocumentCore._as_core(d) for d in documents], pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def unpack(data, facades=False):
+        """Rebuilds the documents packed by pack(). By default, a list of DocumentCores is returned; they hold
+        the same data and change tracking as the originals, but don't need Qt, and are cheaper to create. If facades
+        is True, a list of DocumentObjects (of the original classes) is returned instead."""
+        cores = pickle.loads(data)
+        return [core.facade() for core in cores] if facades else cores
 
     modified = NotImplemented
     modifiedChanged = NotImplemented
@@ -40,8 +1734,39 @@ class DocumentObject(qtc.QObject):
     @property
     def document(self):
         """Recursively generates JSON document from this object and its children. The result is expressed using
-        plain Python lists and dicts."""
-        raise NotImplementedError
+        plain Python lists and dicts, and belongs to the caller."""
+        return self._core.document
+
+    def content_hash(self):
+        """Returns a hash of the document's contents. See DocumentCore.content_hash()."""
+        return self._core.content_hash()
+
+    def writeDocument(self, sink, limit=None, indent=4, chunk_size=1 << 16):
+        """Writes the document as JSON text to sink (a file-like object, a QTextStream, a QIODevice or a callable),
+        in chunks of about chunk_size characters, without building the document or the whole text first. If limit
+        is given, writing stops after that many characters (the output is ASCII, so characters are bytes). Returns
+        True if the whole document was written, False if it was cut short."""
+        write = _text_writer(sink)
+        chunk, size, remaining = [], 0, limit
+
+        for piece in self._core.iter_json(indent):
+            if remaining is not None:
+                if len(piece) > remaining:
+                    chunk.append(piece[:remaining])
+                    write(''.join(chunk))
+                    return False
+                remaining -= len(piece)
+
+            chunk.append(piece)
+            size += len(piece)
+            if size >= chunk_size:
+                write(''.join(chunk))
+                chunk, size = [], 0
+
+        if chunk:
+            write(''.join(chunk))
+
+        return True
 
     @qtc.pyqtSlot()
     def apply(self):
@@ -54,6 +1779,66 @@ class DocumentObject(qtc.QObject):
         modified property to be reset."""
         raise NotImplementedError
 
+    def _record(self, apply):
+        """Calls apply(), recording the changes it saves if the undo history is enabled."""
+        if self._history is None:
+            apply()
+        else:
+            self._history.record(apply)
+
+    @qtc.pyqtSlot(int)
+    def setUndoLimit(self, max_size):
+        """Enables the undo history, keeping the changes saved by apply() until they use about max_size bytes. A
+        max_size of 0 disables the history and discards it."""
+        if max_size <= 0:
+            self._history = None
+        elif self._history is None:
+            self._history = History(max_size)
+        else:
+            self._history.max_size = max_size
+
+    @qtc.pyqtSlot(result=bool)
+    def canUndo(self):
+        """Returns True if there is a saved state to go back to."""
+        return self._history is not None and self._history.can_undo()
+
+    @qtc.pyqtSlot(result=bool)
+    def canRedo(self):
+        """Returns True if there is an undone state to go forward to."""
+        return self._history is not None and self._history.can_redo()
+
+    @qtc.pyqtSlot()
+    def undo(self):
+        """Discards unsaved changes, then restores the document to the way it was before the last apply()."""
+        if self.canUndo():
+            with self.batch():
+                self.revert()
+                self._history.undo()
+
+    @qtc.pyqtSlot()
+    def redo(self):
+        """Discards unsaved changes, then restores the document to the way it was after the last undone
+        apply()."""
+        if self.canRedo():
+            with self.batch():
+                self.revert()
+                self._history.redo()
+
+    def _modified_changed(self):
+        """Called by the core when the modified property changes. Emits modifiedChanged."""
+        DocumentObject._emit(self, self.modifiedChanged)
+
+    def _begin_restore(self):
+        """Called before the undo history changes the contents of this object."""
+        pass
+
+    def _end_restore(self, released, adopted):
+        """Called after the undo history has changed the contents of this object. released and adopted are the
+        values that were removed and added. Emits every property notification signal, since any of them may have
+        changed."""
+        for signal in MapObjectMetaclass.info(type(self)).signals.values():
+            DocumentObject._emit(self, getattr(self, signal))
+
 
 ########################################################################################################################
 
@@ -65,55 +1850,40 @@ class ListObject(DocumentObject, collections.MutableSequence, metaclass=Document
     ListObject inherits from collections.Sequence, and can be used anywhere a Python list can be used.
     """
 
-    def __init__(self, iterable=None, parent=None):
+    def __init__(self, iterable=None, parent=None, lazy=False, _core=None):
         """Initialize the ListObject. If the parent argument is provided, it is passed to the QObject constructor.
-        All other arguments are used to set the initial state of the list."""
+        All other arguments are used to set the initial state of the list.
 
-        super().__init__(parent=parent)
+        If lazy is True, nested sequences and mappings are stored as-is, and are converted to ListObjects and
+        MapObjects the first time they are read. _core is used internally to create the facade of an existing
+        ListCore."""
 
-        iterable = [] if iterable is None else iterable
-        self._original = [self._process_input(i) for i in iterable]
-        self._copy = list(self._original)
+        super().__init__(parent=parent)
 
-        # Storing the modification state isn't strictly necessary, but self.modified gets called so
-        # often that caching it's result helps performance
-        self._modified = None
-        self.modified
+        self._core = ListCore(iterable, lazy=lazy) if _core is None else _core
+        self._core._facade = self
 
     def __getitem__(self, index):
         """Retrieve the item at the given index. Note that slicing returns a list object, NOT a ListObject."""
-        return self._copy[index]
+        item = self._core[index]
 
-    def __setitem__(self, index, item):
-        """Modifies the item at the given index."""
-        was_modified = self._modified
-        self._modified = None
+        if isinstance(index, slice):
+            return [self._facade_of(i) for i in item]
 
-        self._copy[index] = item.toVariant() if isinstance(item, qtq.QJSValue) else item
+        return self._facade_of(item)
 
-        if self.modified != was_modified:
-            self.modifiedChanged.emit()
+    def __setitem__(self, index, item):
+        """Modifies the item at the given index."""
+        self._core[index] = item.toVariant() if isinstance(item, qtq.QJSValue) else item
 
     def __delitem__(self, index):
         """Delete the item at the specified index."""
-        was_modified = self._modified
-        self._modified = None
-
-        del self._copy[index]
-
-        if self.modified != was_modified:
-            self.modifiedChanged.emit()
+        del self._core[index]
 
     @qtc.pyqtSlot(int, qtc.QVariant)
     def insert(self, index, item):
         """Insert an item at the given index."""
-        was_modified = self._modified
-        self._modified = None
-
-        self._copy.insert(index, item)
-
-        if self.modified != was_modified:
-            self.modifiedChanged.emit()
+        self._core.insert(index, item)
 
     @qtc.pyqtSlot(qtc.QVariant)
     def append(self, item):
@@ -122,7 +1892,7 @@ class ListObject(DocumentObject, collections.MutableSequence, metaclass=Document
 
     def __len__(self):
         """Return the number of items in the list."""
-        return len(self._copy)
+        return len(self._core._copy)
 
     @qtc.pyqtSlot(result=int)
     def length(self):
@@ -131,26 +1901,13 @@ class ListObject(DocumentObject, collections.MutableSequence, metaclass=Document
 
     def __iter__(self):
         """Return an iterator for the list."""
-        return iter(self._copy)
+        return (self._facade_of(i) for i in self._core)
 
     modifiedChanged = qtc.pyqtSignal()
     @qtc.pyqtProperty(bool, notify=modifiedChanged)
     def modified(self):
         """True if the list has been modified since the last save."""
-        # If we still have a valid cached value, use that
-        if self._modified is None:
-            self._modified = False
-
-            # Compare the lists, then check the items if necessary
-            if self._original != self._copy:
-                self._modified = True
-            else:
-                for item in self._copy:
-                    if isinstance(item, DocumentObject) and item.modified:
-                        self._modified = True
-                        break
-
-        return self._modified
+        return self._core._modified
 
     @qtc.pyqtSlot(int, result=qtc.QVariant)
     def getItem(self, index):
@@ -165,75 +1922,120 @@ class ListObject(DocumentObject, collections.MutableSequence, metaclass=Document
     @qtc.pyqtSlot()
     def apply(self, apply_children=True):
         """Save the current state of the list. Resets the modified property."""
-        was_modified = self._modified
-        self._modified = None
-
-        if apply_children:
-            for obj in self._copy:
-                if isinstance(obj, DocumentObject):
-                    obj.apply()
-
-        self._original = list(self._copy)
-
-        if self.modified != was_modified:
-            self.modifiedChanged.emit()
+        self._record(lambda: self._core.apply(apply_children))
 
     @qtc.pyqtSlot()
     def revert(self, revert_children=True):
         """Discard any modifications made since the last save."""
-        was_modified = self._modified
-        self._modified = None
+        self._core.revert(revert_children)
 
-        if revert_children:
-            for obj in self._original:
-                if isinstance(obj, DocumentObject):
-                    obj.revert()
-
-        self._copy = list(self._original)
+    @property
+    def original(self):
+        return tuple(self._facade_of(i) for i in self._core._original)
 
-        if self.modified != was_modified:
-            self.modifiedChanged.emit()
+    @property
+    def _original(self):
+        return self._core._original
 
     @property
-    def document(self):
-        response = []
+    def _copy(self):
+        return self._core._copy
 
-        for item in self:
-            if isinstance(item, DocumentObject):
-                response.append(item.document)
-            else:
-                response.append(item)
 
-        return response
+########################################################################################################################
 
-    @property
-    def original(self):
-        return tuple(self._original)
 
+class PropertyInfo:
+    """
+    PropertyInfo describes the pyqtProperty attributes of a class: their names (sorted, which is the order used for
+    role numbers and default columns), the role number an ObjectModel gives each of them, and the name of the
+    notify signal of the properties that have one. Use MapObjectMetaclass.info() to get the (cached) PropertyInfo of
+    a class.
+
+    names:          A tuple of property names.
+    role_to_name:   A dictionary relating role numbers to property names. Roles are numbered from first_role.
+    name_to_role:   The reverse of role_to_name.
+    signals:        A dictionary relating property names to the names of their notify signals (<name>Changed).
+    """
+    __slots__ = ('names', 'role_to_name', 'name_to_role', 'signals')
+
+    def __init__(self, cls, first_role=qtc.Qt.UserRole):
+        # Same result as checking every name in dir(cls), without the sorting and repeated lookups dir() does
+        seen, names = set(), []
+        for klass in cls.__mro__:
+            for name, attr in vars(klass).items():
+                if name not in seen:
+                    seen.add(name)
+                    if isinstance(attr, qtc.pyqtProperty):
+                        names.append(name)
+
+        self.names = tuple(sorted(names))
+        self.signals = {n: n + 'Changed' for n in self.names if isinstance(getattr(cls, n + 'Changed', None),
+                                                                           qtc.pyqtSignal)}
+        self._number(first_role)
+
+    def _number(self, first_role):
+        """Assigns role numbers to the properties, starting from first_role."""
+        self.role_to_name = {r: n for r, n in enumerate(self.names, first_role)}
+        self.name_to_role = {n: r for r, n in self.role_to_name.items()}
+
+    def renumbered(self, first_role):
+        """Returns a copy of this PropertyInfo with roles numbered from first_role."""
+        info = PropertyInfo.__new__(PropertyInfo)
+        info.names, info.signals = self.names, self.signals
+        info._number(first_role)
+        return info
 
 
 ########################################################################################################################
 
 
+class _PropertyNames(dict):
+    """Fills in MapObjectMetaclass.map_properties the first time a class name is looked up."""
+    def __missing__(self, name):
+        names = self[name] = list(MapObjectMetaclass.info(MapObjectMetaclass.subclasses[name]).names)
+        return names
+
+
 class MapObjectMetaclass(DocumentObjectMetaclass):
     """
     When loading MapObject-derived classes from JSON documents, it is necessary to look up a subclass by name. Also,
     when an ObjectModel is created for a certain type, it must look at that types attributes and determine which ones
     are pyqtProperty's. Because these are lengthy operations that must be done frequently, MapObjectMetaclass keeps
-    track of the information and makes it available.
+    track of the information and makes it available. Property information is only gathered the first time it is
+    requested, using info().
 
     subclasses:         A dictionary relating class names to their types.
     map_properties:     A dictionary relating class names to a list of property names (the pyqtProperty attributes of
                         the class)
     """
     subclasses = {}
-    map_properties = {}
+    map_properties = _PropertyNames()
+    _info = {}
 
     def __init__(cls, *args, **kwargs):
         super().__init__(*args, **kwargs)
         name = args[0]
         MapObjectMetaclass.subclasses[name] = cls
-        MapObjectMetaclass.map_properties[name] = [p for p in dir(cls) if isinstance(getattr(cls, p), qtc.pyqtProperty)]
+        MapObjectMetaclass.map_properties.pop(name, None)
+
+    @staticmethod
+    def info(cls, first_role=qtc.Qt.UserRole):
+        """Returns the PropertyInfo for cls, with roles numbered from first_role. The result is cached and shared,
+        and must not be modified."""
+        key = (cls, first_role)
+        try:
+            return MapObjectMetaclass._info[key]
+        except KeyError:
+            pass
+
+        if first_role == qtc.Qt.UserRole:
+            info = PropertyInfo(cls)
+        else:
+            info = MapObjectMetaclass.info(cls).renumbered(first_role)
+
+        MapObjectMetaclass._info[key] = info
+        return info
 
 
 ########################################################################################################################
@@ -251,18 +2053,63 @@ class MapObject(DocumentObject, collections.MutableMapping, metaclass=MapObjectM
     qml_major_version = 1
     qml_minor_version = 0
 
+    # Set to True in subclasses with many instances that share the same keys, to store them in SharedKeyMaps
+    __compact__ = False
+
     @staticmethod
     def from_document(document, default_type=None, **kwargs):
         """Creates a MapObject subclass from a document. If the appropriate subclass can't be determined from the
         document contents, default_type is used. If no default_type is provided, the object will be a MapObject.
-        Any remaining arguments (such as parent) are passed on to the new object's constructor."""
+        Any remaining arguments (such as parent) are passed on to the new object's constructor. If document is a
+        MapCore, the new object becomes its facade."""
         _type = document.get('_type', None)
         object_type = MapObjectMetaclass.subclasses.get(_type, None) \
                         or default_type \
                         or MapObject
 
+        if isinstance(document, MapCore):
+            return object_type(_core=document, **kwargs)
+
         return object_type(document, **kwargs)
 
+    @staticmethod
+    def from_documents(documents, default_type=None, lazy=False, parent=None):
+        """Creates a list of MapObjects from an iterable of documents (dicts or MapCores), the same way
+        from_document() would. The subclass for each distinct _type is only looked up once, and objects of
+        subclasses that don't override __init__() are created directly from their cores, without going through
+        the keyword argument handling of the constructor."""
+        subclasses = MapObjectMetaclass.subclasses
+        default_type = default_type or MapObject
+        types_by_name = {}
+        objects = []
+
+        for document in documents:
+            _type = document.get('_type', None)
+            try:
+                object_type, direct = types_by_name[_type]
+            except KeyError:
+                object_type = subclasses.get(_type, None) or default_type
+                direct = object_type.__init__ is MapObject.__init__
+                types_by_name[_type] = object_type, direct
+
+            if isinstance(document, MapCore):
+                core = document
+            else:
+                if _type is None and object_type is not MapObject:
+                    document = dict(document, _type=object_type.__name__)
+                core = MapCore(document, lazy=lazy, compact=object_type.__compact__)
+
+            if direct:
+                obj = object_type.__new__(object_type)
+                super(MapObject, obj).__init__(parent=parent)
+                obj._attach(core)
+            else:
+                obj = object_type(_core=core, parent=parent)
+
+            objects.append(obj)
+
+        return objects
+
     @staticmethod
     def subtype(_type):
         """Return the subclass represented by _type, if _type is a string. If _type is a class, it is checked to be
@@ -296,7 +2143,9 @@ class MapObject(DocumentObject, collections.MutableMapping, metaclass=MapObjectM
 
     def __init__(self, *args, **kwargs):
         """Initialize the MapObject. If the parent argument is provided, it is passed to the QObject constructor.
-        All other arguments are used to set the initial state of the map."""
+        If the lazy argument is True, nested mappings and sequences are stored as-is, and are converted to
+        MapObjects and ListObjects the first time they are read. All other arguments are used to set the initial
+        state of the map. _core is used internally to create the facade of an existing MapCore."""
 
         # Creating an object from QML passes (None,) as constructor arguments. Get rid of this so it doesn't
         # mess up the dict constructor down the line.
@@ -304,26 +2153,43 @@ class MapObject(DocumentObject, collections.MutableMapping, metaclass=MapObjectM
             args = ()
 
         # Filter out keyword arguments that match declared property names
-        prop_kwargs = {kw: value for kw, value in kwargs.items() if kw in MapObjectMetaclass.map_properties[type(self).__name__]}
-        kwargs = {kw: value for kw, value in kwargs.items() if kw not in prop_kwargs}
+        prop_kwargs = {}
+        if kwargs:
+            props = MapObjectMetaclass.info(type(self)).name_to_role
+            prop_kwargs = {kw: value for kw, value in kwargs.items() if kw in props}
+            kwargs = {kw: value for kw, value in kwargs.items() if kw not in prop_kwargs}
 
         # Call the parent constructors
         super().__init__(parent=kwargs.pop('parent', None))
 
         # Initialize members
-        self._map = {k: self._process_input(v) for k, v in dict(*args, **kwargs).items()}
-        self._mods = dict()
-        self._dels = set()
-        self._modified = False
-
+        core = kwargs.pop('_core', None)
+        lazy = kwargs.pop('lazy', False)
         _type = type(self)
-        if '_type' not in self and _type is not MapObject:
-            self._map['_type'] = _type.__name__
+
+        if core is None:
+            mapping = dict(*args, **kwargs)
+            if _type is not MapObject:
+                mapping.setdefault('_type', _type.__name__)
+
+            core = MapCore(mapping, lazy=lazy, compact=_type.__compact__)
+
+        self._attach(core)
 
         # Initialize properties
         for prop, value in prop_kwargs.items():
             setattr(self, prop, value)
 
+    def _attach(self, core):
+        """Makes this object the facade of core. The _type key is added to the core if it is missing."""
+        self._core = core
+        core._facade = self
+
+        if '_type' not in core and type(self) is not MapObject:
+            core._own_map()['_type'] = type(self).__name__
+            core._len += 1
+            core._invalidate()
+
     @qtc.pyqtSlot(str, result=qtc.QVariant)
     def getValue(self, key, **kwargs):
         """Returns the value for a given key. Besides the key, there are two optional keyword arguments: default
@@ -331,7 +2197,8 @@ class MapObject(DocumentObject, collections.MutableMapping, metaclass=MapObjectM
         default is callable, it is called with the instance of MapObject as its argument, and its return value is
         used instead.
         default_set is similar to default, except that its value (or the value it returns, if it is callable) is
-        assigned to key in the map before it is returned.
+        assigned to key in the map before it is returned. If materialize=False is also given, the value is cached
+        instead (see MapCore.default()), and the map is not modified until the value is assigned or changed.
         If neither default nor default_set are provided, and the key is not found in the map, KeyError is raised.
         """
         try:
@@ -346,6 +2213,10 @@ class MapObject(DocumentObject, collections.MutableMapping, metaclass=MapObjectM
         except KeyError as e:
             if 'default_set' in kwargs:
                 default = kwargs['default_set']
+                if not kwargs.get('materialize', True):
+                    factory = (lambda: default(self)) if callable(default) else (lambda: default)
+                    return self._facade_of(self._core.default(key, factory))
+
                 default = default(self) if callable(default) else default
                 self[key] = default
                 return default
@@ -362,167 +2233,137 @@ class MapObject(DocumentObject, collections.MutableMapping, metaclass=MapObjectM
         their emit() attribute is called."""
         self[key] = value.toVariant() if isinstance(value, qtq.QJSValue) else value
         for arg in args:
-            arg.emit()
+            DocumentObject._emit(self, arg)
 
     def __getitem__(self, key):
         """Retrieve value from the map. KeyError is raised if the provided key does not exist in the map."""
-        if key in self._mods:
-            return self._mods[key]
-        elif key in self._dels:
-            raise KeyError(key)
-        elif key in self._map:
-            return self._map[key]
-        else:
-            raise KeyError(key)
+        return self._facade_of(self._core[key])
 
     def __setitem__(self, key, value):
         """Assign a value to a key."""
-        was_modified = self._modified
-
-        if key not in self._map \
-                or self._map[key] != value:
-            # It's a new key, or a modification of the original key's value
-            self._mods[key] = value
-        else:
-            # We are setting a key back to its original value
-            self._mods.pop(key, None)
-
-        # If this key was marked as deleted, clear it
-        self._dels.discard(key)
-
-        # If modification status changed, emit the signal
-        if self.modified != was_modified:
-            self.modifiedChanged.emit()
+        self._core[key] = value
 
     def __delitem__(self, key):
         """Delete a key-value pair."""
-        if not (key in self._map or key in self._mods) \
-                or key in self._dels:
-            # key is not in the map and it's not in the mods
-            raise KeyError(key)
-        else:
-            was_modified = self._modified
+        del self._core[key]
 
-            self._mods.pop(key, None)
-            if key in self._map:
-                self._dels.add(key)
+    def __contains__(self, key):
+        """Return True if the map contains key."""
+        return key in self._core
 
-            if self.modified != was_modified:
-                self.modifiedChanged.emit()
+    def __eq__(self, other):
+        """Compares the contents of the map with another mapping, without creating facades for nested
+        documents."""
+        return self._core == DocumentCore._as_core(other)
 
     def __iter__(self):
         """Return an iterator for the map's keys."""
-        return itertools.chain(filter(lambda k: k not in self._dels, self._map.keys()),
-                               filter(lambda k: k not in self._map, self._mods.keys()))
+        return iter(self._core)
 
     def __len__(self):
         """Return the number of keys in the map."""
-        return sum(1 for k in iter(self))
+        return len(self._core)
 
     def keys(self):
         """Return an iterator of the map's keys."""
-        return iter(self)
+        return iter(self._core)
 
     def items(self):
         """Yields the key-value pairs in the document."""
-        for key in self:
-            yield key, self[key]
+        facade_of = self._facade_of
+        for key, value in self._core.items():
+            yield key, facade_of(value)
 
     def values(self):
         """Yields the values in the document."""
-        for key in self:
-            yield self[key]
+        facade_of = self._facade_of
+        for key, value in self._core.items():
+            yield facade_of(value)
 
     def update(self, *args, **kwargs):
-        """Checks if the first argument is a QJSValue before passing on to super()."""
+        """Checks if the first argument is a QJSValue before passing on to super(). Change notifications are
+        batched, so each signal is emitted at most once."""
         if len(args) == 1 and isinstance(args[0], qtq.QJSValue):
-            args[0] = args[0].toVariant()
+            args = (args[0].toVariant(),)
 
-        super().update(*args, **kwargs)
+        with self.batch():
+            super().update(*args, **kwargs)
 
     @property
     def map(self):
         """Returns a read-only view (a MappingProxyType) of the last 'saved' version of the map."""
-        return types.MappingProxyType(self._map)
+        return self._core.map
 
     @property
     def mods(self):
         """Returns a read-only view (a MappingProxyType) of document's unsaved modifications."""
-        return types.MappingProxyType(self._mods)
+        return self._core.mods
 
     @property
     def dels(self):
         """Returns a tuple of keys that have been deleted from the document since the last save."""
-        return tuple(self._dels)
+        return self._core.dels
+
+    @property
+    def _map(self):
+        return self._core._map
+
+    @_map.setter
+    def _map(self, value):
+        self._core._map = value
+        self._core._recount()
+        self._core._invalidate()
+
+    @property
+    def _mods(self):
+        return self._core._mods
+
+    @_mods.setter
+    def _mods(self, value):
+        self._core._mods = value
+        self._core._recount()
+        self._core._invalidate()
+
+    @property
+    def _dels(self):
+        return self._core._dels
+
+    @_dels.setter
+    def _dels(self, value):
+        self._core._dels = value
+        self._core._recount()
+        self._core._invalidate()
 
     modifiedChanged = qtc.pyqtSignal()
     @qtc.pyqtProperty(bool, notify=modifiedChanged)
     def modified(self):
         """True if the document has been modified since the last save."""
-        if self._mods or self._dels:
-            self._modified = True
-            return True
-
-        for item in self.values():
-            if isinstance(item, DocumentObject) and item.modified:
-                self._modified = True
-                return True
-
-        self._modified = False
-        return False
+        return self._core._modified
 
     @qtc.pyqtSlot()
     def apply(self):
         """Saves changes in this document and all sub-documents."""
-        was_modified = self._modified
-        self._modified = None
-
-        new = {}
-        for key, item in self.items():
-            if isinstance(item, DocumentObject):
-                item.apply()
-
-            new[key] = item
-
-        self._map = new
-        self._mods.clear()
-        self._dels.clear()
-
-        if self.modified != was_modified:
-            self.modifiedChanged.emit()
+        self._record(self._core.apply)
 
     @qtc.pyqtSlot()
     def revert(self):
         """Discards any changes in this document and all sub-documents since they were last saved."""
-        was_modified = self._modified
-        self._modified = None
-
-        for key, value in self._map.items():
-            if isinstance(value, DocumentObject):
-                value.revert()
-
-        self._mods.clear()
-        self._dels.clear()
-
-        if self.modified != was_modified:
-            self.modifiedChanged.emit()
-
-    @property
-    def document(self):
-        response = {}
-
-        for key, value in self.items():
-            if isinstance(value, DocumentObject):
-                response[key] = value.document
-            else:
-                response[key] = value
-
-        return response
+        self._core.revert()
 
     @qtc.pyqtSlot(result=str)
     def getDocumentText(self):
         """Returns the object's document property as a formatted block of text."""
-        return json_dumps(self.document, indent=4)
+        return ''.join(self._core.iter_json())
+
+    @qtc.pyqtSlot(int, result=str)
+    def getDocumentPreview(self, length):
+        """Like getDocumentText(), but stops after length characters. If the text was cut short, it ends with
+        '...'."""
+        chunks = []
+        if not self.writeDocument(chunks.append, limit=length):
+            chunks.append('...')
+
+        return ''.join(chunks)
 
     idChanged = qtc.pyqtSignal()
     @qtc.pyqtProperty(qtc.QVariant, notify=idChanged)
@@ -554,6 +2395,76 @@ class MapObject(DocumentObject, collections.MutableMapping, metaclass=MapObjectM
 ########################################################################################################################
 
 
+def _property_getter(key, enforce_type=None, convert_type=None, materialize=True, **defaults):
+    """Returns a getter for Property() that behaves like MapObject.getValue() with the given keyword arguments. The
+    arguments are resolved once, here, instead of on every read: when the map has no unsaved changes, reading a
+    scalar value takes a single lookup in the core's _map."""
+    if 'default_set' in defaults and not materialize:
+        default = defaults['default_set']
+
+        def missing(self):
+            factory = (lambda: default(self)) if callable(default) else (lambda: default)
+            return self._facade_of(self._core.default(key, factory))
+    elif 'default_set' in defaults:
+        default = defaults['default_set']
+
+        def missing(self):
+            value = default(self) if callable(default) else default
+            self[key] = value
+            return value
+    elif 'default' in defaults:
+        default = defaults['default']
+
+        if callable(default):
+            missing = default
+        else:
+            def missing(self):
+                return default
+    else:
+        def missing(self):
+            raise KeyError(key)
+
+    # Values of these types can be returned straight from _map
+    fast_types = _SCALAR_TYPES if enforce_type is None else _SCALAR_TYPES.intersection((enforce_type,))
+
+    def fget(self):
+        core = self._core
+        if not (core._mods or core._dels):
+            try:
+                value = core._map[key]
+            except KeyError:
+                return missing(self)
+
+            if type(value) in fast_types:
+                return value
+
+        try:
+            value = self._facade_of(core[key])
+        except KeyError:
+            return missing(self)
+
+        if enforce_type is not None and type(value) is not enforce_type:
+            value = convert_type(self, value) if convert_type else enforce_type(value)
+            self[key] = value
+
+        return value
+
+    return fget
+
+
+def _property_setter(key, notify=None):
+    """Returns a setter for Property() that behaves like MapObject.setValue(), emitting notify if it is given."""
+    if notify is None:
+        def fset(self, value):
+            self._core[key] = value.toVariant() if isinstance(value, qtq.QJSValue) else value
+    else:
+        def fset(self, value):
+            self._core[key] = value.toVariant() if isinstance(value, qtq.QJSValue) else value
+            DocumentObject._emit(self, notify.__get__(self))
+
+    return fset
+
+
 def Property(type, key, fget=None, fset=None, read_only=False, **kwargs):
     """Creates a property that uses MapObject's getValue() and setValue() functions as getter and setter. Supports
     defaults and notification signals. MapProperty() is a convenience wrapper for pyqtProperty().
@@ -563,6 +2474,8 @@ def Property(type, key, fget=None, fset=None, read_only=False, **kwargs):
         key                     The key assigned to this property.
         notify                  (optional) The notification signal assigned to this property.
         default, default_set    (optional) Passed on to MapObject.getValue()
+        materialize             (optional) If False, a default_set value is cached instead of being assigned when
+                                it is read, so reading the property does not modify the document.
         read_only               Sets a property to read-only
 
     Usage:  class PropertyMap(MapObject):
@@ -570,16 +2483,13 @@ def Property(type, key, fget=None, fset=None, read_only=False, **kwargs):
                 x = MapProperty(str, 'x', notify=onXChanged, default='n/a')
 
     """
-    fget_kwargs = {k:v for k, v in kwargs.items() if k in ['default', 'default_set', 'enforce_type', 'convert_type']}
+    fget_kwargs = {k:v for k, v in kwargs.items() if k in ['default', 'default_set', 'materialize', 'enforce_type',
+                                                          'convert_type']}
     fset_kwargs = {k:v for k, v in kwargs.items() if k in ['enforce_type']}
     kwargs = {k: v for k, v in kwargs.items() if (k not in fget_kwargs and k not in fset_kwargs)}
 
-    fget = fget or (lambda self: MapObject.getValue(self, key, **fget_kwargs))
-
-    if 'notify' in kwargs:
-        fset = fset or (lambda self, value: MapObject.setValue(self, key, value, kwargs['notify'].__get__(self)))
-    else:
-        fset = fset or (lambda self, value: MapObject.setValue(self, key, value))
+    fget = fget or _property_getter(key, **fget_kwargs)
+    fset = fset or _property_setter(key, kwargs.get('notify', None))
 
     if read_only:
         fset = None
@@ -604,7 +2514,9 @@ def MapObjectProperty(_type, key, **kwargs):
 
 
 def ListProperty(key, **kwargs):
-    """Convenience function for creating ListObject properties."""
+    """Convenience function for creating ListObject properties. Values are returned as plain lists, except with
+    materialize=False: then the default is a ListObject, which is only added to the map once it is changed, and stored
+    lists are returned as ListObjects too, so that changes made in place are tracked."""
     kwargs.pop('default', None)
     kwargs.pop('fget', None)
 
@@ -612,6 +2524,10 @@ def ListProperty(key, **kwargs):
     default_set = default_set if default_set is not None else lambda self: list()
     convert_type = lambda self, value: list(value)
 
+    if not kwargs.get('materialize', True):
+        kwargs.pop('default_set', None)
+        return Property(qtc.QVariant, key, default_set=default_set, **kwargs)
+
     return Property(qtc.QVariant, key, enforce_type=list, convert_type=convert_type, default_set=default_set, **kwargs)
 
 
@@ -672,3 +2588,5 @@ class MapObjectReference(MapObject):
             self._ref = None
             self.referencedId = ''
             self.referencedType = ''
+
+        DocumentObject._emit(self, self.refChanged)
@@ -25,3 +25,32 @@ if __name__ == '__main__':
                             default=None)
 
 
+
+    print('Mixed operations: %.2f ms' % t.msecs)
+
+    # Access patterns that go through the merged view. A plain dict with the same contents is timed alongside each
+    # one, as a lower bound.
+    plain = dict(mo.items())
+    modified = MapObject(base)
+    for key in random.sample(random_keys, TEST_SIZE // 10):
+        modified[key] = random_element()
+    for key in random.sample(random_keys, TEST_SIZE // 10):
+        modified.pop(key, None)
+
+    for label, op in [('len()', len),
+                      ('keys', lambda m: list(m.keys())),
+                      ('items', lambda m: list(m.items())),
+                      ('values', lambda m: list(m.values()))]:
+        timings = []
+        for obj in (plain, mo, modified):
+            with Timer() as t:
+                for i in range(TEST_SIZE):
+                    op(obj)
+            timings.append(t.msecs)
+
+        print('%-8s dict: %8.2f ms   MapObject: %8.2f ms   modified MapObject: %8.2f ms' % (label, *timings))
+
+    with Timer() as t:
+        for i in range(TEST_SIZE // 10):
+            modified.document
+    print('document (modified): %.2f ms' % t.msecs)
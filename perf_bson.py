@@ -0,0 +1,33 @@
+import bson
+
+from cupi import MongoDatabase
+from tools import *
+
+
+DOCUMENTS = 200
+
+
+def large_document():
+    """Returns a document with a few thousand nested values, some of them with keys that need escaping."""
+    return {'name': random_string(),
+            'values': [random.randrange(0, 100000) for i in range(500)],
+            'records': [{'key.%s' % i: random_string(), '$n': i, 'ratio': random.random(), 'tags': ['a', 'b']}
+                        for i in range(250)],
+            'meta': {random_string(6): random_string() for i in range(100)}}
+
+
+if __name__ == '__main__':
+    docs = [large_document() for i in range(DOCUMENTS)]
+
+    # Fresh objects for each run, so neither path benefits from a cached document
+    objects = [MapObject(doc) for doc in docs]
+    with Timer() as t:
+        old = [bson.BSON.encode(MongoDatabase.escaped(obj.document)) for obj in objects]
+    print('document -> escaped() -> BSON.encode(): %.2f ms' % t.msecs)
+
+    objects = [MapObject(doc) for doc in docs]
+    with Timer() as t:
+        new = [MongoDatabase.encoded(obj) for obj in objects]
+    print('MongoDatabase.encoded():                %.2f ms' % t.msecs)
+
+    assert old == new
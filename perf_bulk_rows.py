@@ -0,0 +1,45 @@
+import gc
+
+from cupi.objectmodel import ObjectModel
+from tools import *
+
+
+ROWS = 10000
+REPEATS = 3
+
+
+def make_objects():
+    return [GenericObject({'p1': random_string(), 'index': i}) for i in range(ROWS)]
+
+
+if __name__ == '__main__':
+    timings = {'append() loop:    ': [], 'extend():         ': [],
+               'removeRow() loop: ': [], 'del model[a:b]:   ': []}
+
+    for i in range(REPEATS):
+        objects = make_objects()
+        model = ObjectModel(_type=GenericObject)
+        gc.collect()
+        with Timer() as t:
+            for obj in objects:
+                model.append(obj)
+        timings['append() loop:    '].append(t.msecs)
+
+        with Timer() as t:
+            for row in range(len(model) - 1, -1, -1):
+                model.removeRow(row)
+        timings['removeRow() loop: '].append(t.msecs)
+
+        objects = make_objects()
+        model = ObjectModel(_type=GenericObject)
+        gc.collect()
+        with Timer() as t:
+            model.extend(objects)
+        timings['extend():         '].append(t.msecs)
+
+        with Timer() as t:
+            del model[:]
+        timings['del model[a:b]:   '].append(t.msecs)
+
+    for label, values in timings.items():
+        print('%d rows, %s %.2f ms (best of %d)' % (ROWS, label, min(values), REPEATS))
@@ -0,0 +1,34 @@
+import gc
+
+from cupi import MapObject
+from tools import *
+
+
+DOCUMENTS = 100000
+REPEATS = 3
+
+
+if __name__ == '__main__':
+    docs = [{'_type': 'GenericObject' if i % 2 else 'MapObject', 'p1': random_string(), 'index': i}
+            for i in range(DOCUMENTS)]
+
+    timings = {'from_document() loop': [], 'from_documents():    ': []}
+    for i in range(REPEATS):
+        gc.collect()
+        with Timer() as t:
+            single = [MapObject.from_document(doc) for doc in docs]
+        timings['from_document() loop'].append(t.msecs)
+
+        del single
+        gc.collect()
+        with Timer() as t:
+            bulk = MapObject.from_documents(docs)
+        timings['from_documents():    '].append(t.msecs)
+        del bulk
+
+    for label, values in timings.items():
+        print('%s %.2f ms (best of %d)' % (label, min(values), REPEATS))
+
+    single, bulk = [MapObject.from_document(doc) for doc in docs], MapObject.from_documents(docs)
+    assert [type(o) for o in single] == [type(o) for o in bulk]
+    assert [o.document for o in single] == [o.document for o in bulk]
@@ -0,0 +1,34 @@
+import random
+
+from cupi.objectmodel import ObjectModel
+from tools import *
+
+
+SIZES = (5000, 50000)
+LOOKUPS = 200
+REPEATS = 3
+
+
+if __name__ == '__main__':
+    for size in SIZES:
+        model = ObjectModel(_type=GenericObject, objects=[GenericObject({'p1': random_string()}) for i in range(size)])
+        values = [model[random.randrange(size)].p1 for i in range(LOOKUPS)]
+
+        timings = {'matchOne(), scan: ': [], 'matchOne(), index:': []}
+        for i in range(REPEATS):
+            with Timer() as t:
+                scanned = [model.matchOne('p1', v) for v in values]
+            timings['matchOne(), scan: '].append(t.msecs)
+
+        with Timer() as t:
+            model.addIndex('p1', True)
+        print('%6d rows, addIndex(): %.2f ms' % (size, t.msecs))
+
+        for i in range(REPEATS):
+            with Timer() as t:
+                indexed = [model.matchOne('p1', v) for v in values]
+            timings['matchOne(), index:'].append(t.msecs)
+
+        assert scanned == indexed
+        for label, values in timings.items():
+            print('%6d rows, %s %.4f ms per lookup (best of %d)' % (size, label, min(values) / LOOKUPS, REPEATS))
@@ -0,0 +1,54 @@
+from tools import *
+
+
+ROWS = 100000
+
+
+def nested_document(i):
+    """Returns a document with a few nested mappings and sequences."""
+    return {'name': random_string(),
+            'index': i,
+            'tags': [random_string(5) for j in range(3)],
+            'address': {'street': random_string(), 'city': random_string(8), 'zip': random.randrange(10000, 99999)},
+            'history': [{'when': j, 'what': random_string(6)} for j in range(2)]}
+
+
+def flat_document(i):
+    """Returns a document with a handful of scalar values, all with the same keys."""
+    return {'name': random_string(), 'index': i, 'price': random.random(), 'active': bool(i % 2), 'sku': str(i)}
+
+
+class FlatObject(MapObject):
+    pass
+
+
+class CompactObject(MapObject):
+    __compact__ = True
+
+
+def touch_all(obj):
+    """Reads every nested document through its facade, forcing a QObject to be created for each of them."""
+    for value in obj.values() if isinstance(obj, MapObject) else obj:
+        if isinstance(value, (MapObject, ListObject)):
+            touch_all(value)
+
+
+if __name__ == '__main__':
+    docs = [nested_document(i) for i in range(ROWS)]
+
+    with Timer(verbose=True) as t:
+        objects = [MapObject(doc) for doc in docs]
+
+    print('Cores only: %.0f bytes per row' % (get_size(objects) / ROWS))
+
+    with Timer(verbose=True) as t:
+        for obj in objects:
+            touch_all(obj)
+
+    print('All facades: %.0f bytes per row' % (get_size(objects) / ROWS))
+
+    # Many objects of the same type and keys, stored normally and in SharedKeyMaps
+    docs = [flat_document(i) for i in range(ROWS)]
+    for object_type in (FlatObject, CompactObject):
+        objects = [object_type(doc).core for doc in docs]
+        print('%s: %.0f bytes per object' % (object_type.__name__, get_size(objects) / ROWS))
@@ -0,0 +1,48 @@
+import concurrent.futures
+import pickle
+
+from cupi import DocumentObject
+from tools import *
+
+
+ROWS = 20000
+CHUNK = 2000
+
+
+def row_document(i):
+    return {'name': random_string(), 'index': i, 'tags': [random_string(5) for j in range(3)],
+            'address': {'street': random_string(), 'zip': random.randrange(10000, 99999)}}
+
+
+def work(data):
+    """Runs in a worker process: unpacks a chunk of rows, modifies them and sends them back."""
+    rows = DocumentObject.unpack(data)
+    for row in rows:
+        row['name'] = row['name'].upper()
+
+    return DocumentObject.pack(rows)
+
+
+if __name__ == '__main__':
+    objects = [GenericObject(row_document(i)) for i in range(ROWS)]
+
+    with Timer() as t:
+        data = pickle.dumps([obj.document for obj in objects], pickle.HIGHEST_PROTOCOL)
+        copies = [MapObject.from_document(doc) for doc in pickle.loads(data)]
+    print('document + from_document():  %.2f ms, %d bytes' % (t.msecs, len(data)))
+
+    with Timer() as t:
+        data = DocumentObject.pack(objects)
+        copies = DocumentObject.unpack(data)
+    print('pack() + unpack():           %.2f ms, %d bytes' % (t.msecs, len(data)))
+
+    with Timer() as t:
+        data = DocumentObject.pack(objects)
+        copies = DocumentObject.unpack(data, facades=True)
+    print('pack() + unpack(facades):    %.2f ms' % t.msecs)
+
+    with Timer() as t:
+        chunks = [DocumentObject.pack(objects[i:i + CHUNK]) for i in range(0, ROWS, CHUNK)]
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            results = [row for data in executor.map(work, chunks) for row in DocumentObject.unpack(data)]
+    print('ProcessPoolExecutor round trip: %.2f ms, %d modified rows' % (t.msecs, sum(r.modified for r in results)))
@@ -0,0 +1,41 @@
+import PyQt5.QtCore as qtc
+
+from cupi import MapObject, MapObjectProperty, Property
+from tools import *
+
+
+READS = 100000
+
+
+class GetValueObject(MapObject):
+    """Properties declared the way Property() used to build them: a lambda calling getValue() with keyword
+    arguments."""
+    plain = qtc.pyqtProperty(str, fget=lambda self: MapObject.getValue(self, 'plain'))
+    default = qtc.pyqtProperty(str, fget=lambda self: MapObject.getValue(self, 'default', default='n/a'))
+    enforced = qtc.pyqtProperty(int, fget=lambda self: MapObject.getValue(self, 'enforced', enforce_type=int))
+    child = qtc.pyqtProperty(MapObject, fget=lambda self: MapObject.getValue(self, 'child', enforce_type=MapObject,
+                                                                            convert_type=lambda s, v: MapObject(v, parent=s),
+                                                                            default_set=lambda s: MapObject(parent=s)))
+
+
+class CompiledObject(MapObject):
+    plain = Property(str, 'plain')
+    default = Property(str, 'default', default='n/a')
+    enforced = Property(int, 'enforced', enforce_type=int)
+    child = MapObjectProperty(MapObject, 'child')
+
+
+if __name__ == '__main__':
+    doc = {'plain': random_string(), 'enforced': 10, 'child': {'a': 1}}
+
+    for label in ('plain', 'default', 'enforced', 'child'):
+        timings = []
+        for object_type in (GetValueObject, CompiledObject):
+            obj = object_type(doc)
+            getattr(obj, label)
+            with Timer() as t:
+                for i in range(READS):
+                    getattr(obj, label)
+            timings.append(t.msecs)
+
+        print('%-10s getValue(): %8.2f ms    compiled: %8.2f ms' % (label, *timings))
@@ -0,0 +1,49 @@
+import gc
+import random
+
+from cupi.objectmodel import ObjectModel
+from tools import *
+
+
+SIZES = (5000, 50000)
+EDITS = 2000
+SCANS = 100
+REPEATS = 3
+
+
+def edit(model, rows):
+    for row in rows:
+        model[row].p1 = random_string()
+
+
+if __name__ == '__main__':
+    for size in SIZES:
+        model = ObjectModel(_type=GenericObject,
+                            objects=[GenericObject({'p1': random_string(), 'index': i}) for i in range(size)])
+        objects = list(model)
+        rows = [random.randrange(size) for i in range(EDITS)]
+        edit(model, rows[:1])
+
+        timings = {'indexed row lookup': [], 'list.index() scan  ': []}
+        for i in range(REPEATS):
+            gc.collect()
+            with Timer() as t:
+                edit(model, rows)
+            timings['indexed row lookup'].append(t.msecs)
+
+            copy = model._core._copy
+            with Timer() as t:
+                for row in rows[:SCANS]:
+                    copy.index(objects[row].core)
+            timings['list.index() scan  '].append(t.msecs * EDITS / SCANS)
+
+        for label, values in timings.items():
+            print('%6d rows, %s %.3f ms per edit (best of %d)' % (size, label, min(values) / EDITS, REPEATS))
+
+        # An edit must not cost anything close to a scan of the rows
+        assert min(timings['indexed row lookup']) * 10 < min(timings['list.index() scan  '])
+
+        model.insert(0, GenericObject())
+        with Timer() as t:
+            edit(model, rows[:1])
+        print('%6d rows, first edit after an insert (index rebuilt): %.3f ms' % (size, t.msecs))
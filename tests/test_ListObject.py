@@ -183,4 +183,139 @@ class TestListObject(ProfilingTestCase):
 
         doc = lo.document
 
-        self.assertEqual(doc, ['one', 'two', ['three', 'four']])
\ No newline at end of file
+        self.assertEqual(doc, ['one', 'two', ['three', 'four']])
+
+    def test_nested_modified(self):
+        lo = ListObject([1, [2, 3], {'four': 4}])
+        lo.modifiedChanged = Mock()
+
+        lo[2]['four'] = 44
+        self.assertTrue(lo.modified)
+        lo[1].append(5)
+        self.assertEqual(2, lo.core._dirty_children)
+
+        lo[2]['four'] = 4
+        lo[1].pop()
+        self.assertFalse(lo.modified)
+        self.assertEqual(2, lo.modifiedChanged.emit.call_count)
+
+    def test_insert_delete_reset(self):
+        lo = ListObject([1, 2, 3])
+
+        lo.insert(0, 0)
+        self.assertTrue(lo.modified)
+        del lo[0]
+        self.assertFalse(lo.modified)
+
+        lo.append(4)
+        self.assertTrue(lo.modified)
+        del lo[-1]
+        self.assertFalse(lo.modified)
+
+    def test_lazy(self):
+        lo = ListObject([1, {'two': 2}, [3]], lazy=True)
+        self.assertIs(dict, type(lo._copy[1]))
+
+        two = lo[1]
+        self.assertIsInstance(two, MapObject)
+        self.assertIs(two.core, lo._original[1])
+        self.assertFalse(lo.modified)
+
+        two['two'] = 22
+        self.assertTrue(lo.modified)
+        self.assertEqual([1, {'two': 22}, [3]], lo.document)
+
+    def test_apply_shares_lists(self):
+        lo = ListObject([1, {'two': 2}, [3]])
+        self.assertIs(lo._original, lo._copy)
+
+        lo[0] = 10
+        self.assertIsNot(lo._original, lo._copy)
+        lo.apply()
+        self.assertIs(lo._original, lo._copy)
+        self.assertEqual([10, {'two': 2}, [3]], lo.document)
+
+        clean, dirty = lo[2], lo[1]
+        clean.apply = Mock()
+        dirty['two'] = 22
+        lo.apply()
+        clean.apply.assert_not_called()
+        self.assertFalse(lo.modified)
+
+        lo.insert(0, 0)
+        lo[2]['two'] = 2
+        lo.revert()
+        self.assertIs(lo._original, lo._copy)
+        self.assertFalse(lo.modified)
+        self.assertEqual([10, {'two': 22}, [3]], lo.document)
+
+    def test_changes_in_place(self):
+        lo = ListObject(list(range(10)))
+        core = lo._core
+        items = core._copy
+
+        lo[2] = 'two'
+        lo.append(10)
+        del lo[-2:]
+        lo.append('nine')
+        self.assertIs(items, core._copy)
+        self.assertEqual({2: 2, 9: 9}, core._overwritten)
+        self.assertTrue(lo.modified)
+        self.assertEqual(10, core._original_len())
+        self.assertEqual(9, core._original_item(9))
+
+        lo[2] = 2
+        lo[9] = 9
+        self.assertFalse(lo.modified)
+        lo[9] = 'nine'
+        lo.apply()
+        self.assertIs(items, core._copy)
+        self.assertIs(core._base, core._copy)
+        self.assertEqual([0, 1, 2, 3, 4, 5, 6, 7, 8, 'nine'], lo.document)
+
+        lo[0] = 'zero'
+        lo.pop()
+        self.assertIs(items, core._copy)
+        lo.revert()
+        self.assertFalse(lo.modified)
+        self.assertEqual([0, 1, 2, 3, 4, 5, 6, 7, 8, 'nine'], lo.document)
+
+        lo[0] = 'zero'
+        lo.insert(1, 'one')
+        self.assertIsNot(items, core._copy)
+        lo.revert()
+        self.assertEqual([0, 1, 2, 3, 4, 5, 6, 7, 8, 'nine'], lo.document)
+
+    def test_undo_redo(self):
+        lo = ListObject([1, {'two': 2}, [3]])
+        lo.setUndoLimit(1 << 16)
+        self.assertFalse(lo.canUndo())
+
+        steps = [lambda: lo.__setitem__(0, 10),
+                 lambda: lo[1].__setitem__('two', 22),
+                 lambda: lo.insert(1, 'new'),
+                 lambda: lo.__delitem__(0),
+                 lambda: lo.__setitem__(slice(0, 2), ['a', 'b', 'c'])]
+        states = [lo.document]
+        for step in steps:
+            step()
+            lo.apply()
+            states.append(lo.document)
+
+        for state in reversed(states[:-1]):
+            lo.undo()
+            self.assertEqual(state, lo.document)
+            self.assertFalse(lo.modified)
+
+        self.assertFalse(lo.canUndo())
+        lo[0] = 'unsaved'
+        for state in states[1:]:
+            lo.redo()
+            self.assertEqual(state, lo.document)
+
+        self.assertFalse(lo.canRedo())
+        lo.undo()
+        lo.append(4)
+        lo.apply()
+        self.assertFalse(lo.canRedo())
+
@@ -1,7 +1,17 @@
+import datetime
+import gc
+import io
+import pickle
+import weakref
 from unittest import TestCase
 from unittest.mock import Mock
 
-from cupi import MapObject
+import bson
+import PyQt5.QtCore as qtcore
+from bson.json_util import dumps as json_dumps
+
+from cupi import MapObject, MapCore
+from cupi.objects import SharedKeyMap
 from tools import GenericObject
 
 
@@ -144,6 +154,21 @@ class TestMapObject(TestCase):
     def test_len(self):
         self.assertEqual(3, len(self.doc))
 
+    def test_len_modified(self):
+        self.doc['d'] = 4
+        self.doc['a'] = 10
+        del self.doc['b']
+        self.assertEqual(3, len(self.doc))
+        self.assertEqual(['a', 'c', 'd'], list(self.doc))
+
+        self.doc.apply()
+        self.assertEqual(3, len(self.doc))
+
+        del self.doc['d']
+        self.doc.revert()
+        self.assertEqual(3, len(self.doc))
+        self.assertEqual(['a', 'c', 'd'], list(self.doc))
+
     def test_keys_unmodified(self):
         self.assertEqual(list(self.doc.keys()), ['a', 'b', 'c'])
 
@@ -298,3 +323,420 @@ class TestMapObject(TestCase):
 
 
 
+
+    def test_nested_modified(self):
+        mo = MapObject({'one': {'two': {'three': [1, 2, 3]}}})
+        mo.modifiedChanged = Mock()
+
+        mo['one']['two']['three'][0] = 10
+        self.assertTrue(mo.modified)
+        self.assertTrue(mo['one'].modified)
+        self.assertEqual(1, mo.core._dirty_children)
+
+        mo['one']['two']['three'][0] = 1
+        self.assertFalse(mo.modified)
+        self.assertFalse(mo['one'].modified)
+        self.assertEqual(0, mo.core._dirty_children)
+        self.assertEqual(2, mo.modifiedChanged.emit.call_count)
+
+    def test_replaced_child_not_counted(self):
+        mo = MapObject({'one': {'two': 2}})
+        child = mo['one']
+
+        mo['one'] = 1
+        child['two'] = 22
+        self.assertEqual(0, mo.core._dirty_children)
+
+        mo.revert()
+        self.assertFalse(mo.modified)
+        self.assertEqual(2, mo['one']['two'])
+
+    def test_lazy(self):
+        mo = MapObject({'one': {'two': [1, 2]}, 'three': 3}, lazy=True)
+        self.assertIs(dict, type(mo._map['one']))
+        self.assertEqual({'one': {'two': [1, 2]}, 'three': 3}, mo.document)
+
+        one = mo['one']
+        self.assertIsInstance(one, MapObject)
+        self.assertIs(one, mo['one'])
+        self.assertIs(list, type(one._map['two']))
+        self.assertFalse(mo.modified)
+
+        one['two'].append(3)
+        self.assertTrue(mo.modified)
+        self.assertEqual({'one': {'two': [1, 2, 3]}, 'three': 3}, mo.document)
+
+    def test_from_documents(self):
+        docs = [{'_type': 'GenericObject', 'p1': 'first'},
+                {'_type': 'Unknown', 'data': 'second'},
+                {'data': 'third'},
+                MapCore({'_type': 'GenericObject', 'p1': 'fourth'})]
+        parent = MapObject()
+
+        objects = MapObject.from_documents(docs, parent=parent)
+        self.assertEqual([GenericObject, MapObject, MapObject, GenericObject], [type(o) for o in objects])
+        self.assertEqual(['first', 'fourth'], [objects[0].p1, objects[3].p1])
+        self.assertIs(docs[3], objects[3].core)
+        self.assertTrue(all(o.parent() is parent for o in objects))
+        self.assertFalse(any(o.modified for o in objects))
+
+        objects = MapObject.from_documents([{'data': 1}], default_type=GenericObject)
+        self.assertEqual({'_type': 'GenericObject', 'data': 1}, objects[0].document)
+
+    def test_content_hash(self):
+        one = MapObject({'a': 1, 'b': {'c': [1, {'d': 2}]}})
+        two = MapObject({'b': {'c': [1, {'d': 2}]}, 'a': 1})
+        self.assertEqual(one.content_hash(), two.content_hash())
+        self.assertEqual(one.content_hash(), MapCore._hash_of(one.document))
+        self.assertEqual(one, two)
+        self.assertEqual(one, one.document)
+
+        before = one.content_hash()
+        one['b']['c'][1]['d'] = 3
+        self.assertIsNone(one.core._hash)
+        self.assertNotEqual(before, one.content_hash())
+        self.assertNotEqual(one, two)
+
+        one['b']['c'][1]['d'] = 2
+        self.assertEqual(before, one.content_hash())
+        self.assertEqual(one, two)
+
+    def test_set_back_to_original(self):
+        mo = MapObject({'a': {'b': [1, 2]}})
+        mo['a'] = {'b': [1, 2]}
+        self.assertFalse(mo.modified)
+        mo['a'] = {'b': [1, 3]}
+        self.assertTrue(mo.modified)
+
+    def test_parent_reference(self):
+        core = MapCore({'sub': {'a': 1}})
+        sub = core['sub']
+        self.assertIs(core, sub._parent())
+
+        core['sub'] = MapCore({'a': 2})
+        self.assertIsNone(sub._parent())
+        sub['a'] = 3
+        self.assertNotIn(id(sub), core._dirty)
+
+        child = core['sub']
+        ref = weakref.ref(core)
+        del core
+        gc.collect()
+        self.assertIsNone(ref())
+        self.assertIsNone(child._parent())
+        child['a'] = 4
+        self.assertTrue(child.modified)
+
+    def test_getDocumentText(self):
+        mo = MapObject({'a': [1, {'b': None, 'c': 1.5, 'd': float('nan')}], 'e': {}, 'f': [], 'g': 'caf\u00e9',
+                        'id': bson.ObjectId(), 'when': datetime.datetime(2020, 1, 1)})
+        mo['a'][1]['b'] = True
+
+        self.assertEqual(json_dumps(mo.document, indent=4), mo.getDocumentText())
+        self.assertEqual(json_dumps(mo.document), ''.join(mo.core.iter_json(indent=None)))
+
+    def test_writeDocument(self):
+        mo = MapObject({'rows': [{'index': i, 'name': 'row %d' % i} for i in range(100)]})
+        text = mo.getDocumentText()
+
+        stream = io.StringIO()
+        chunks = []
+        self.assertTrue(mo.writeDocument(stream, chunk_size=100))
+        self.assertTrue(mo.writeDocument(chunks.append, chunk_size=100))
+        self.assertEqual(text, stream.getvalue())
+        self.assertGreater(len(chunks), 1)
+
+        buffer = qtcore.QBuffer()
+        buffer.open(qtcore.QIODevice.WriteOnly)
+        self.assertFalse(mo.writeDocument(buffer, limit=50))
+        self.assertEqual(text[:50].encode(), bytes(buffer.data()))
+
+        self.assertEqual(text[:50] + '...', mo.getDocumentPreview(50))
+        self.assertEqual(text, mo.getDocumentPreview(len(text)))
+
+    def test_facade(self):
+        mo = MapObject({'one': {'two': 2}, 'obj': {'_type': 'GenericObject', 'p1': 'first'}})
+        core = mo.core
+        self.assertIsNone(core._map['one']._facade)
+
+        one = mo['one']
+        self.assertIs(one, core._map['one']._facade)
+        self.assertIs(one, mo['one'])
+        self.assertIs(mo, one.parent())
+        self.assertIsInstance(mo['obj'], GenericObject)
+
+        other = MapObject()
+        other['one'] = one
+        self.assertIs(core._map['one'], other.core['one'])
+        self.assertIs(one, other['one'])
+
+    def test_compact(self):
+        one = MapCore({'a': 1, 'b': {'c': 2}}, compact=True)
+        two = MapCore({'a': 3, 'b': {'c': 4}}, compact=True)
+        self.assertIsInstance(one._map, SharedKeyMap)
+        self.assertIs(one._map._layout, two._map._layout)
+        self.assertEqual({'a': 1, 'b': {'c': 2}}, one.document)
+
+        one['a'] = 10
+        one['d'] = 5
+        del one['b']
+        self.assertEqual({'a': 10, 'd': 5}, one.document)
+        one.revert()
+        self.assertEqual({'a': 1, 'b': {'c': 2}}, one.document)
+
+        one['d'] = 5
+        del one['b']
+        one.apply()
+        self.assertIsInstance(one._map, SharedKeyMap)
+        self.assertEqual(['a', 'd'], list(one._map))
+        self.assertEqual({'a': 1, 'd': 5}, one.document)
+        self.assertIsNot(one._map._layout, two._map._layout)
+
+    def test_compact_layout_cache(self):
+        shared = SharedKeyMap()
+        count = len(SharedKeyMap._layouts)
+        for i in range(50):
+            shared['key %d' % i] = i
+        del shared['key 0']
+        self.assertEqual(count, len(SharedKeyMap._layouts))
+        self.assertEqual(list(range(1, 50)), list(shared.values()))
+
+        core = MapCore({'a': 1}, compact=True)
+        core['b'] = 2
+        core['c'] = 3
+        core.apply()
+        self.assertIs(core._map._layout, SharedKeyMap._layouts[('a', 'b', 'c')])
+
+        max_layouts, SharedKeyMap.max_layouts = SharedKeyMap.max_layouts, count + 10
+        try:
+            maps = [SharedKeyMap({'unique %d' % i: i}) for i in range(20)]
+            self.assertEqual(count + 10, len(SharedKeyMap._layouts))
+            self.assertEqual({'unique 0': 0}, dict(maps[0]))
+        finally:
+            SharedKeyMap.max_layouts = max_layouts
+
+    def test_changes_allocated_lazily(self):
+        one, two = MapCore({'a': 1}), MapCore({'b': 2})
+        self.assertIs(one._mods, two._mods)
+        self.assertIs(one._dels, two._dels)
+
+        one['a'] = 2
+        del two['b']
+        self.assertEqual({'a': 2}, dict(one.mods))
+        self.assertEqual(('b',), two.dels)
+        self.assertIsNot(one._mods, two._mods)
+
+        one.apply()
+        two.revert()
+        self.assertIs(one._mods, two._mods)
+        self.assertFalse(one.modified or two.modified)
+
+    def test_undo_redo(self):
+        obj = GenericObject({'p1': 'one', 'sub': {'a': 1}})
+        obj.setUndoLimit(1 << 16)
+        signal = Mock()
+        obj.p1Changed.connect(signal)
+
+        obj.p1 = 'two'
+        obj['sub']['a'] = 2
+        obj.apply()
+        del obj['sub']
+        obj['new'] = [1, 2]
+        obj.apply()
+        third = obj.document
+
+        obj['p1'] = 'unsaved'
+        obj.undo()
+        self.assertEqual({'_type': 'GenericObject', 'p1': 'two', 'sub': {'a': 2}}, obj.document)
+        self.assertFalse(obj.modified)
+        self.assertIs(obj.core, obj.core['sub']._parent())
+        obj.undo()
+        self.assertEqual({'_type': 'GenericObject', 'p1': 'one', 'sub': {'a': 1}}, obj.document)
+        self.assertEqual('one', obj.p1)
+        self.assertFalse(obj.canUndo())
+        self.assertTrue(signal.called)
+
+        obj.redo()
+        obj.redo()
+        self.assertEqual(third, obj.document)
+        self.assertFalse(obj.canRedo())
+
+    def test_undo_removed_child(self):
+        mo = MapObject({'c': {'k0': []}, 'l': [{'a': 1}]})
+        mo.setUndoLimit(1 << 20)
+        mo['c']['k0'].append(1)
+        del mo['c']['k0']
+        mo['l'][0]['a'] = 2
+        del mo['l'][0]
+        mo.apply()
+
+        mo.undo()
+        self.assertEqual({'c': {'k0': []}, 'l': [{'a': 1}]}, mo.document)
+        self.assertFalse(mo.modified)
+        mo.redo()
+        self.assertEqual({'c': {}, 'l': []}, mo.document)
+
+    def test_undo_limit(self):
+        obj = MapObject()
+        obj.setUndoLimit(2000)
+        for i in range(100):
+            obj[str(i)] = i
+            obj.apply()
+
+        self.assertLessEqual(obj._history._size, 2000)
+        self.assertTrue(obj.canUndo())
+        while obj.canUndo():
+            obj.undo()
+
+        self.assertNotEqual({}, obj.document)
+        obj.setUndoLimit(0)
+        self.assertFalse(obj.canRedo())
+
+    def test_pickle(self):
+        obj = GenericObject({'p1': 'one', 'sub': {'a': 1}, 'gone': 0, 'list': [1, {'b': 2}]})
+        obj.apply()
+        obj.p1 = 'two'
+        obj['sub']['a'] = 2
+        obj['list'].append(3)
+        del obj['gone']
+
+        copy = pickle.loads(pickle.dumps(obj))
+        self.assertIs(GenericObject, type(copy))
+        self.assertEqual(obj.document, copy.document)
+        self.assertTrue(copy.modified)
+        self.assertEqual({'p1': 'two'}, dict(copy.core.mods))
+        self.assertEqual(('gone',), copy.core.dels)
+        self.assertEqual(2, copy.core._dirty_children)
+
+        copy.revert()
+        self.assertEqual({'_type': 'GenericObject', 'p1': 'one', 'sub': {'a': 1}, 'gone': 0, 'list': [1, {'b': 2}]},
+                         copy.document)
+        self.assertFalse(copy.modified)
+
+    def test_pack(self):
+        class PackedObject(MapObject):
+            __compact__ = True
+
+        objects = [PackedObject({'a': i, 'b': str(i)}) for i in range(10)]
+        objects[3]['a'] = 'changed'
+
+        cores = MapObject.unpack(MapObject.pack(objects))
+        self.assertEqual([o.document for o in objects], [c.document for c in cores])
+        self.assertIs(cores[0]._map._layout, objects[0].core._map._layout)
+        self.assertEqual([False, False, False, True], [c.modified for c in cores[:4]])
+
+        copies = MapObject.unpack(MapObject.pack(objects), facades=True)
+        self.assertTrue(all(type(c) is PackedObject for c in copies))
+
+    def test_apply_revert_changes_only(self):
+        mo = MapObject({'a': 1, 'b': {'c': 2}, 'd': {'e': 3}})
+        saved = mo._map
+        clean = mo['d']
+        clean.apply, clean.revert = Mock(), Mock()
+
+        mo['a'] = 10
+        mo['b']['c'] = 20
+        del mo['d']
+        mo.apply()
+        self.assertIs(saved, mo._map)
+        self.assertEqual({'a': 10, 'b': {'c': 20}}, mo.document)
+        clean.apply.assert_not_called()
+
+        mo['b']['c'] = 200
+        mo['f'] = 4
+        mo.revert()
+        self.assertFalse(mo.modified)
+        self.assertEqual({'a': 10, 'b': {'c': 20}}, mo.document)
+        self.assertEqual(2, len(mo))
+
+    def test_batch(self):
+        mo = MapObject({'one': {'two': 2}})
+        child = mo['one']
+        mo.modifiedChanged, child.modifiedChanged = Mock(), Mock()
+
+        with mo.batch():
+            child['two'] = 22
+            child['two'] = 2
+            child['two'] = 222
+            mo['three'] = 3
+            self.assertTrue(mo.modified)
+            mo.modifiedChanged.emit.assert_not_called()
+
+        self.assertEqual(1, mo.modifiedChanged.emit.call_count)
+        self.assertEqual(1, child.modifiedChanged.emit.call_count)
+
+        mo.modifiedChanged.reset_mock()
+        mo.update({'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(0, mo.modifiedChanged.emit.call_count)
+
+        obj, slot = GenericObject(), Mock()
+        obj.p1Changed.connect(slot)
+        obj.beginBatch()
+        obj.p1 = 'one'
+        obj.p1 = 'two'
+        obj.endBatch()
+        self.assertEqual(1, slot.call_count)
+
+    def test_batch_error(self):
+        mo = MapObject({'one': 1})
+        mo.modifiedChanged = Mock()
+        mo.modifiedChanged.emit.side_effect = RuntimeError
+
+        with self.assertRaises(RuntimeError):
+            with mo.batch():
+                mo['one'] = 2
+
+        self.assertEqual(0, MapObject._batch_depth)
+        mo.modifiedChanged = Mock()
+        mo['one'] = 1
+        mo.modifiedChanged.emit.assert_called_once_with()
+
+    def test_document_cache(self):
+        mo = MapObject({'one': {'two': [1, 2]}, 'three': {'four': 4}})
+        doc = mo._core._document()
+        self.assertIs(doc, mo._core._document())
+        self.assertIsNot(doc, mo.document)
+
+        mo['one']['two'].append(3)
+        new = mo._core._document()
+        self.assertIsNot(doc, new)
+        self.assertIs(doc['three'], new['three'])
+        self.assertEqual({'one': {'two': [1, 2, 3]}, 'three': {'four': 4}}, new)
+
+        mo.document['three']['four'] = 44
+        self.assertEqual({'one': {'two': [1, 2, 3]}, 'three': {'four': 4}}, mo.document)
+
+        mo.revert()
+        self.assertEqual({'one': {'two': [1, 2]}, 'three': {'four': 4}}, mo.document)
+
+    def test_document_cache_plain_containers(self):
+        mo = MapObject()
+        mo['y'] = {}
+        before = mo.content_hash()
+        self.assertEqual({'y': {}}, mo.document)
+
+        mo['y']['x'] = 1
+        self.assertEqual({'y': {'x': 1}}, mo.document)
+        self.assertNotEqual(before, mo.content_hash())
+
+        nested = MapObject({'a': {'b': 1}})
+        nested['a']['c'] = []
+        before = nested.content_hash()
+        self.assertEqual({'a': {'b': 1, 'c': []}}, nested.document)
+
+        nested['a']['c'].append(1)
+        self.assertEqual({'a': {'b': 1, 'c': [1]}}, nested.document)
+        self.assertNotEqual(before, nested.content_hash())
+
+    def test_shared_document_cache(self):
+        a, b = MapObject({'x': {'k': 1}}), MapObject()
+        before = a.content_hash()
+        self.assertEqual({'x': {'k': 1}}, a.document)
+
+        b['y'] = a['x']
+        self.assertEqual({'y': {'k': 1}}, b.document)
+        b['y']['k'] = 2
+        self.assertEqual({'x': {'k': 2}}, a.document)
+        self.assertEqual({'y': {'k': 2}}, b.document)
+        self.assertNotEqual(before, a.content_hash())
+        self.assertTrue(a.modified)
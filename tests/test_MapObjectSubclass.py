@@ -2,7 +2,7 @@ from unittest import TestCase
 
 from PyQt5.QtCore import pyqtSignal
 
-from cupi.objects import MapObject, Property
+from cupi.objects import MapObject, Property, MapObjectProperty, ListProperty
 
 
 class MapObjectSubclass(MapObject):
@@ -14,6 +14,11 @@ class MapObjectSubclass(MapObject):
     p3 = Property(int, 'p3', notify=p3Notify, default=5)
     p4 = Property(int, 'p4', default_set=10)
     property_name = Property(str, 'prop_name')
+    p5 = Property(int, 'p5', enforce_type=int)
+    child = MapObjectProperty(MapObject, 'child')
+    p6 = Property(int, 'p6', default_set=10, materialize=False)
+    lazy_child = MapObjectProperty(MapObject, 'lazy_child', materialize=False)
+    tags = ListProperty('tags', materialize=False)
 
 
 class TestMapObjectSubclass(TestCase):
@@ -54,3 +59,69 @@ class TestMapObjectSubclass(TestCase):
         self.assertNotIn('p4', self.obj._map)
         self.assertIn('p4', self.obj._mods)
         self.assertNotIn('p4', self.obj._dels)
+
+    def test_property_default_cached(self):
+        self.obj.apply()
+        self.assertEqual(10, self.obj.p6)
+        self.assertEqual([], list(self.obj.tags))
+        self.assertNotIn('p6', self.obj)
+        self.assertNotIn('tags', self.obj)
+        self.assertFalse(self.obj.modified)
+
+        self.obj.p6 = 10
+        self.assertEqual(10, self.obj['p6'])
+        self.assertTrue(self.obj.modified)
+
+        tags = self.obj.tags
+        tags.append('x')
+        self.assertEqual(['x'], self.obj.document['tags'])
+        self.assertIs(tags, self.obj.tags)
+        tags.append('y')
+        self.assertEqual(['x', 'y'], self.obj.document['tags'])
+
+        self.obj.apply()
+        self.assertFalse(self.obj.modified)
+        self.obj.tags.append('z')
+        self.assertTrue(self.obj.modified)
+        self.assertEqual(['x', 'y', 'z'], list(self.obj.tags))
+
+    def test_property_default_cached_document(self):
+        self.obj.apply()
+        child = self.obj.lazy_child
+        self.assertIs(child, self.obj.lazy_child)
+        self.assertNotIn('lazy_child', self.obj)
+        self.assertFalse(self.obj.modified)
+
+        child['a'] = 1
+        self.assertTrue(self.obj.modified)
+        self.assertEqual({'a': 1}, self.obj['lazy_child'].document)
+        self.assertIs(child, self.obj.lazy_child)
+
+        self.obj.revert()
+        self.assertNotIn('lazy_child', self.obj)
+        self.assertFalse(self.obj.modified)
+
+    def test_property_get_modified(self):
+        self.obj.apply()
+        del self.obj['p1']
+
+        with self.assertRaises(KeyError):
+            self.obj.p1
+
+        self.obj['p1'] = 3
+        self.assertEqual(3, self.obj.p1)
+        self.obj.revert()
+        self.assertEqual(1, self.obj.p1)
+
+    def test_property_enforce_type(self):
+        self.obj['p5'] = '7'
+        self.obj.apply()
+
+        self.assertEqual(7, self.obj.p5)
+        self.assertEqual(7, self.obj['p5'])
+
+    def test_map_object_property(self):
+        child = self.obj.child
+        self.assertIs(MapObject, type(child))
+        self.assertIs(child, self.obj.child)
+        self.assertIs(child.core, self.obj['child'].core)
@@ -1,3 +1,7 @@
+import bson
+import bson.raw_bson
+import bson.int64
+import datetime
 import PyQt5.QtCore as qtcore
 from unittest.mock import Mock, MagicMock
 from cupi import mongodatabase
@@ -49,8 +53,9 @@ class TestMongoDatabase(TestCase):
         mo['two'].append(3)
         del mo['three']['four']
         mo['three']['five'][4] = 'five'
-        expected = {'$set': {'one': 11, 'two.2': 3, 'three.five.4': 'five'},
-                    '$unset': {'three.four': None}}
+        expected = {'$set': {'one': 11, 'three.five.4': 'five'},
+                    '$unset': {'three.four': None},
+                    '$push': {'two': {'$each': [3]}}}
 
         self.assertEqual(expected, MongoDatabase._updates(mo))
 
@@ -59,7 +64,7 @@ class TestMongoDatabase(TestCase):
         lo = ListObject([1, 2, ['three', 'four'], 5, 6])
         del lo[1]
         del lo[2]
-        expected = {'$set': {'': [1, ['three', 'four'], 6]}}
+        expected = {'$pull': {'': {'$in': [2, 5]}}}
 
         self.assertEqual(expected, MongoDatabase._listobject_updates(lo))
 
@@ -73,10 +78,46 @@ class TestMongoDatabase(TestCase):
         lo = ListObject([1, 2, ['three', 'four'], 5, 6])
         lo.append(7)
         lo[2].append(8)
-        expected = {'$set': {'5': 7, '2.2': 8}}
+        expected = {'$set': {'5': 7}, '$push': {'2': {'$each': [8]}}}
 
         self.assertEqual(expected, MongoDatabase._listobject_updates(lo))
 
+        lo = ListObject([1, 2, 3, 4, 5])
+        lo.append(6)
+        lo.append({'seven': 7})
+        expected = {'$push': {'': {'$each': [6, {'seven': 7}]}}}
+
+        self.assertEqual(expected, MongoDatabase._listobject_updates(lo))
+
+        lo = ListObject([1, 2, 3, 4, 5])
+        lo.insert(0, 0)
+        lo.insert(1, 0.5)
+        expected = {'$push': {'': {'$each': [0, 0.5], '$position': 0}}}
+
+        self.assertEqual(expected, MongoDatabase._listobject_updates(lo))
+
+        lo = ListObject([1, 2, 3, 4, 5])
+        lo.pop()
+        self.assertEqual({'$pop': {'': 1}}, MongoDatabase._listobject_updates(lo))
+        lo.pop()
+        self.assertEqual({'$push': {'': {'$each': [], '$slice': 3}}}, MongoDatabase._listobject_updates(lo))
+
+        lo = ListObject([1, 2, 1, 3])
+        del lo[0]
+        self.assertEqual({'$pop': {'': -1}}, MongoDatabase._listobject_updates(lo))
+        lo.revert()
+        del lo[2]
+        self.assertEqual({'$set': {'': [1, 2, 3]}}, MongoDatabase._listobject_updates(lo))
+
+        mo = MapObject({'arr': [1, {'a': 1}, 3]})
+        mo['arr'][1]['a'] = 2
+        del mo['arr'][1]
+        self.assertEqual({'$set': {'arr': [1, 3]}}, MongoDatabase._mapobject_updates(mo))
+
+        mo = MapObject({'list': [1, 2, 3]})
+        mo['list'].insert(1, 'x')
+        self.assertEqual({'$push': {'list': {'$each': ['x'], '$position': 1}}}, MongoDatabase._mapobject_updates(mo))
+
     def test_mapobject_updates(self):
         """Test making an update document from a MapObject."""
         mo = MapObject({'a': 1, 'b': 2, 'c': {'d': 4, 'e': 5}})
@@ -88,6 +129,46 @@ class TestMongoDatabase(TestCase):
 
         self.assertEqual(expected, MongoDatabase._mapobject_updates(mo))
 
+    def test_encoded(self):
+        """Test that direct BSON encoding matches encoding the escaped document."""
+        mo = MapObject({'a.b': 1, 'big': 2 ** 40, 'f': 1.5, 's': 'text', 'none': None, 't': True,
+                        'id': bson.ObjectId(), 'when': datetime.datetime(2017, 1, 1),
+                        'nested': {'$c': [1, 'two', {'three.3': 3}]}})
+        mo['nested']['$c'].append([4])
+
+        expected = bson.BSON.encode(MongoDatabase.escaped(mo.document))
+        self.assertEqual(expected, MongoDatabase.encoded(mo))
+
+        mo = MapObject({'small': bson.int64.Int64(5), 'large': bson.int64.Int64(2 ** 40), 'yes': True, 'no': False,
+                        'when': datetime.datetime(2017, 1, 1, 12, 30), 'list': [bson.int64.Int64(-1), False]})
+        expected = bson.BSON.encode(MongoDatabase.escaped(mo.document))
+        self.assertEqual(expected, MongoDatabase.encoded(mo))
+        self.assertIs(bson.int64.Int64, type(bson.BSON(MongoDatabase.encoded(mo)).decode()['small']))
+
+        _id = bson.ObjectId()
+        decoded = bson.BSON(MongoDatabase.encoded(mo, _id=_id)).decode()
+        self.assertEqual(_id, decoded['_id'])
+        self.assertEqual('_id', next(iter(decoded)))
+
+    def test_getAllReferencedObjects_raw(self):
+        ids = [bson.ObjectId() for i in range(3)]
+        reference = lambda i: {'_type': 'MongoObjectReference', 'referenced_id': ids[i], 'auto_load': True}
+        doc = {'_type': 'GenericObject',
+               'p1': 'loaded p1',
+               'ref': reference(0),
+               'deep': {'padding': 'x' * 8192, 'items': [1, {'inner': reference(1)}]},
+               'untouched': {'a': [{'b': reference(2)}]},
+               'plain': {'padding': 'y' * 8192}}
+        raw = bson.raw_bson.RawBSONDocument(bson.BSON.encode(doc))
+        obj = MapObject.from_document(MapCore.from_mapping(mongodatabase.RawDocument(raw)))
+        self.assertEqual('loaded p1', obj.p1)
+
+        self.db.getReferencedObject = Mock()
+        self.db.getAllReferencedObjects(obj)
+        loaded = {call[0][0].referencedId for call in self.db.getReferencedObject.call_args_list}
+        self.assertEqual(set(ids), loaded)
+        self.assertNotIn('plain', obj.core._map._values)
+
     def test_statusMessage(self):
         """Test that changing the status message sends out the appropriate signals."""
         self.db.statusMessageChanged = Mock()
@@ -203,7 +284,9 @@ class TestMongoDatabase(TestCase):
         self.assertTrue(result)
         self.mock_db.__getitem__.assert_called_with(GenericObject.__collection__)
         self.assertEqual('test id', obj['_id'])
-        self.mock_collection.insert_one.assert_called_with(doc)
+        inserted = self.mock_collection.insert_one.call_args[0][0]
+        self.assertIsInstance(inserted, bson.raw_bson.RawBSONDocument)
+        self.assertEqual(doc, {k: v for k, v in bson.BSON(inserted.raw).decode().items() if k != '_id'})
 
         obj.p1 = 'modified'
         obj['q'] = MongoQuery(query={'field': 'filter'})
@@ -1,7 +1,10 @@
+import bson
 import unittest
 import unittest.mock as mock
+from bson.raw_bson import RawBSONDocument
 
 from cupi import *
+from cupi import mongodatabase
 from tools import *
 
 ENABLE_PROFILING = True
@@ -13,7 +16,8 @@ class TestMongoObjectCursor(unittest.TestCase):
         documents = [{'_type': 'GenericObject',
                       'p1': 'loaded p1',
                       'p2': 'loaded p2'},
-                     {'data': 'some data'}]
+                     {'data': 'some data',
+                      'nested': {'key': 'value'}}]
         self.mock_cursor = mock.MagicMock()
         self.mock_cursor.__iter__ = mock.Mock(return_value=iter(documents))
         self.mock_cursor.count = mock.Mock(return_value=2)
@@ -37,10 +41,44 @@ class TestMongoObjectCursor(unittest.TestCase):
         obj = next(self.cursor)
         self.assertTrue(type(obj) is MapObject)
         self.assertEqual('some data', obj.getValue('data'))
+        self.assertIs(dict, type(obj.map['nested']))
+        self.assertIsInstance(obj['nested'], MapObject)
 
         with self.assertRaises(StopIteration):
             next(self.cursor)
 
+    def test_fetch(self):
+        objects = self.cursor.fetch(5)
+
+        self.assertEqual([GenericObject, MapObject], [type(o) for o in objects])
+        self.assertEqual('loaded p1', objects[0].p1)
+        self.assertEqual('some data', objects[1]['data'])
+        self.assertTrue(self.cursor.done)
+        self.assertEqual([], self.cursor.fetch(5))
+
+    def test_raw(self):
+        escaped = MongoDatabase.escaped({'_type': 'GenericObject',
+                                         'p1': 'loaded p1',
+                                         'a.b': 1,
+                                         'nested': {'$key': [{'c.d': 2}]}})
+        self.mock_cursor.__iter__ = mock.Mock(return_value=iter([RawBSONDocument(bson.BSON.encode(escaped))]))
+        cursor = MongoObjectCursor(self.mock_cursor)
+
+        obj = next(cursor)
+        self.assertIsInstance(obj, GenericObject)
+        self.assertEqual('loaded p1', obj.p1)
+        self.assertEqual(1, obj['a.b'])
+        self.assertIsInstance(obj.core.map['nested'], mongodatabase.RawDocument)
+        self.assertEqual({'$key': [{'c.d': 2}]}, obj['nested'].document)
+        self.assertFalse(obj.modified)
+
+        obj['e'] = 3
+        del obj['a.b']
+        obj.apply()
+        self.assertIs(dict, type(obj.core._map))
+        self.assertEqual({'_type': 'GenericObject', 'p1': 'loaded p1', 'nested': {'$key': [{'c.d': 2}]}, 'e': 3},
+                         obj.document)
+
     def test_len(self):
         self.assertEqual(len(self.cursor), self.mock_cursor.count())
 
@@ -154,8 +154,10 @@ class TestObjectModel(TestCase):
         self.model.beginRemoveRows.assert_called_with(parent, TOTAL_ELEMENTS - 2, TOTAL_ELEMENTS - 2)
         self.model.endRemoveRows.assert_called_once()
 
+        self.assertFalse(self.model.removeRow(TOTAL_ELEMENTS))
+        self.assertEqual(len(self.model), TOTAL_ELEMENTS - 2)
         with self.assertRaises(IndexError):
-            self.model.removeRow(TOTAL_ELEMENTS)
+            del self.model[TOTAL_ELEMENTS]
 
     def test_remove_rows(self):
         """Test the removeRows() method."""
@@ -173,8 +175,45 @@ class TestObjectModel(TestCase):
         self.model.beginRemoveRows.assert_called_with(parent, 0, 4)
         self.model.endRemoveRows.assert_called_once()
 
-        with self.assertRaises(IndexError):
-            self.model.removeRows(len(self.model) - 3, 5, parent)
+        self.assertFalse(self.model.removeRows(len(self.model) - 3, 5, parent))
+        self.assertFalse(self.model.removeRows(-1, 2, parent))
+        self.assertEqual(len(self.model), TOTAL_ELEMENTS - 5)
+        self.model.beginRemoveRows.assert_called_once()
+
+    def test_insert_rows(self):
+        self.model.apply()
+        self.model.beginInsertRows = Mock()
+        self.model.endInsertRows = Mock()
+        objs = [GenericObject(p1=str(i)) for i in range(5)]
+
+        self.model.insertRows(2, objs[:3])
+        self.model.extend(objs[3:])
+
+        self.assertEqual(TOTAL_ELEMENTS + 5, len(self.model))
+        self.assertEqual(objs[:3], self.model[2:5])
+        self.assertEqual(objs[3:], self.model[-2:])
+        self.assertIs(self.model, objs[0].parent())
+        self.assertEqual(2, self.model.beginInsertRows.call_count)
+        self.assertEqual((qtcore.QModelIndex(), 2, 4), self.model.beginInsertRows.call_args_list[0][0])
+        self.assertFalse(self.model.insertRows(0, 3))
+
+        self.model.dataChanged.emit.reset_mock()
+        objs[4].p1 = 'changed'
+        self.assertEqual(TOTAL_ELEMENTS + 4, self.model.dataChanged.emit.call_args[0][0].row())
+
+    def test_delete_slice(self):
+        self.model.apply()
+        self.model.removeRows = Mock(wraps=self.model.removeRows)
+        kept = self.model[10]
+
+        del self.model[:10]
+        self.assertEqual(1, self.model.removeRows.call_count)
+        self.assertIs(kept, self.model[0])
+        self.assertEqual(('delete', list(range(10))), self.model.core._summarize_ops())
+
+        del self.model[-4::2]
+        self.assertEqual(TOTAL_ELEMENTS - 12, len(self.model))
+        self.assertIs(kept, self.model[0])
 
     def test_apply(self):
         """Test the model's apply() method."""
@@ -334,6 +373,15 @@ class TestObjectModel(TestCase):
         self.assertEqual(0, self.model.fieldIndex('p3'))
         self.assertEqual(1, self.model.fieldIndex('modified'))
 
+    def test_role(self):
+        self.assertEqual(qtcore.Qt.UserRole + 3, self.model.role('p1'))
+        self.assertEqual(-1, self.model.role('unknown'))
+
+    def test_shared_roles(self):
+        other = ObjectModel(_type=GenericObject)
+        self.assertIs(self.model._role_to_prop, other._role_to_prop)
+        self.assertEqual(self.model.roleNames(), other.roleNames())
+
     def test_connect_to(self):
         self.model.onChildModified = Mock()
 
@@ -351,6 +399,21 @@ class TestObjectModel(TestCase):
         self.model.onChildModified.assert_not_called()
         self.model.dataChanged.emit.assert_not_called()
 
+    def test_listeners(self):
+        self.model.sender = Mock()
+        self.model.senderSignalIndex = Mock()
+        self.model.dataChanged.emit = Mock()
+
+        self.model[5].p1 = 'no sender lookup'
+        self.model.sender.assert_not_called()
+        self.model.senderSignalIndex.assert_not_called()
+        self.assertEqual({5}, {args[0][0].row() for args in self.model.dataChanged.emit.call_args_list})
+
+        removed = self.model[5]
+        self.model.removeRow(5)
+        self.assertNotIn(id(removed), self.model._connections)
+        self.assertEqual(TOTAL_ELEMENTS - 1, len(self.model._connections))
+
     def test_onChildModified(self):
         self.model.dataChanged.emit = Mock()
 
@@ -373,6 +436,101 @@ class TestObjectModel(TestCase):
 
         self.model[0].p1 = 'consult the book of armaments!'
 
+    def test_batch(self):
+        with self.model.batch():
+            self.model[2].p1 = 'one'
+            self.model[2].p1 = 'two'
+            self.model[5].p2 = 'three'
+            self.model.dataChanged.emit.assert_not_called()
+
+        self.assertEqual(1, self.model.dataChanged.emit.call_count)
+        topleft, bottomright, roles = self.model.dataChanged.emit.call_args[0]
+        self.assertEqual(2, topleft.row())
+        self.assertEqual(5, bottomright.row())
+        self.assertEqual(sorted(self.model.role(name) for name in ('modified', 'p1', 'p2')), roles)
+
+    def test_row_index(self):
+        def rows_of(*objects):
+            for obj in objects:
+                obj.p1 = random_string()
+            return {args[0][0].row() for args in self.model.dataChanged.emit.call_args_list}
+
+        last = self.model[-1]
+        self.assertEqual({0, TOTAL_ELEMENTS - 1}, rows_of(self.model[0], last))
+
+        self.model.dataChanged.emit.reset_mock()
+        appended = GenericObject()
+        self.model.append(appended)
+        self.model.insert(0, GenericObject())
+        self.assertEqual({TOTAL_ELEMENTS + 1, TOTAL_ELEMENTS}, rows_of(appended, last))
+
+        self.model.dataChanged.emit.reset_mock()
+        self.model.removeRows(0, 3)
+        removed = self.model[0]
+        self.model[0] = GenericObject()
+        self.model.dataChanged.emit.reset_mock()
+        self.assertEqual({TOTAL_ELEMENTS - 3}, rows_of(last, removed))
+
+    def test_shared_rows(self):
+        other = ObjectModel(_type=GenericObject, objects=list(self.model))
+        self.model[0].p1 = 'shared'
+        self.assertTrue(self.model.modified)
+        self.assertTrue(other.modified)
+
+        self.model[0].revert()
+        self.assertFalse(self.model.modified)
+        self.assertFalse(other.modified)
+
+        other.removeRow(0)
+        self.model[0].p1 = 'still shared'
+        self.assertTrue(self.model.modified)
+        self.assertIn(id(self.model[0].core), self.model.core._dirty)
+        self.assertNotIn(id(self.model[0].core), other.core._dirty)
+
+    def test_coalescing(self):
+        app = qtcore.QCoreApplication.instance() or qtcore.QCoreApplication([])
+        model = ObjectModel(_type=GenericObject, objects=[GenericObject({'p1': 'one'}) for i in range(10)], coalesce=True)
+        model.dataChanged = Mock()
+        model.modifiedChanged = Mock()
+
+        for row in (2, 3, 4, 7):
+            model[row].p1 = 'two'
+        model.removeRow(0)
+        model.dataChanged.emit.assert_not_called()
+        model.modifiedChanged.emit.assert_not_called()
+
+        app.processEvents()
+        roles = sorted([model.role('modified'), model.role('p1')])
+        emitted = [(args[0][0].row(), args[0][1].row(), args[0][2]) for args in model.dataChanged.emit.call_args_list]
+        self.assertEqual([(1, 3, roles), (6, 6, roles)], emitted)
+        self.assertEqual(1, model.modifiedChanged.emit.call_count)
+
+        model.setCoalescing(False)
+        self.assertFalse(model.isCoalescing())
+        model[0].p1 = 'three'
+        self.assertEqual(4, model.dataChanged.emit.call_count)
+
+    def test_undo_redo(self):
+        self.model.setUndoLimit(1 << 20)
+        first, removed = self.model[0], self.model[1]
+        added = GenericObject(p1='added')
+
+        self.model.removeRow(1)
+        self.model.append(added)
+        self.model.apply()
+        self.assertIsNone(removed.parent())
+
+        self.model.undo()
+        self.assertEqual(TOTAL_ELEMENTS, len(self.model))
+        self.assertIs(removed, self.model[1])
+        self.assertIs(self.model, removed.parent())
+        self.assertIsNone(added.parent())
+
+        self.model.redo()
+        self.assertIs(first, self.model[0])
+        self.assertIs(added, self.model[-1])
+        self.assertIsNone(removed.parent())
+
     def test_matchOne(self):
         for prop in ['p1', 'p2', 'p3']:
             oid = bson.ObjectId()
@@ -388,5 +546,61 @@ class TestObjectModel(TestCase):
         i = self.model.matchOne('p1', str(oid))
         self.assertEqual(i, -1)
 
+    def test_indexes(self):
+        self.model.addIndex('p1', True)
+        self.model.addIndex('p2')
+        self.model.apply()
+        with self.assertRaises(ValueError):
+            self.model.addIndex('index')
+
+        first = self.model[3]
+        self.assertEqual(3, self.model.matchOne('p1', first.p1))
+        self.assertEqual(list(range(TOTAL_ELEMENTS)), self.model.matchAll('p2', 'property 2'))
+
+        first.p1 = 'renamed'
+        self.model[7].p2 = 'other'
+        self.model.insertRows(0, [GenericObject(p1='new', p2='other')])
+        self.assertEqual(4, self.model.matchOne('p1', 'renamed'))
+        self.assertTrue(self.model.contains('p1', 'new'))
+        self.assertEqual([0, 8], self.model.matchAll('p2', 'other'))
+
+        self.model.removeRows(0, 2)
+        self.assertFalse(self.model.contains('p1', 'new'))
+        self.assertEqual([6], self.model.matchAll('p2', 'other'))
+
+        self.model.revert()
+        self.assertEqual(3, self.model.matchOne('p1', 'renamed'))
+        self.assertFalse(self.model.contains('p1', 'new'))
+        self.assertEqual([7], self.model.matchAll('p2', 'other'))
+
+    def test_indexes_without_signals(self):
+        quiet = ObjectModel(_type=GenericObject, objects=[GenericObject(p1='a')], listen=False)
+        with self.assertRaises(ValueError):
+            quiet.addIndex('p1')
+
+        self.model.addIndex('p1', True)
+        self.model.apply()
+        row = self.model[5]
+        old = row.p1
+
+        row['p1'] = 'set by key'
+        self.assertEqual(5, self.model.matchOne('p1', 'set by key'))
+        self.assertFalse(self.model.contains('p1', old))
+
+        row.revert()
+        self.assertEqual(5, self.model.matchOne('p1', old))
+        self.assertFalse(self.model.contains('p1', 'set by key'))
+
+    def test_unique_index_duplicates(self):
+        self.model.addIndex('p1', True)
+        self.model[2].p1 = 'duplicate'
+        self.model[6].p1 = 'duplicate'
+        self.assertEqual([2, 6], self.model.matchAll('p1', 'duplicate'))
+
+        self.model.removeRows(2, 1)
+        self.assertEqual(5, self.model.matchOne('p1', 'duplicate'))
+        self.model.removeRows(5, 1)
+        self.assertFalse(self.model.contains('p1', 'duplicate'))
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -28,6 +28,27 @@ class TestObjectModelRefs(TestCase):
             self.assertEqual(self.model[i].ref.p2, self.model.data(index, prop_to_role['p2']))
             self.assertEqual(self.model[i].ref.p3, self.model.data(index, prop_to_role['p3']))
 
+    def test_default_columns(self):
+        shared = set(self.model._role_to_prop.values()) & set(self.model._ref_role_to_prop.values())
+        self.assertIn('modified', shared)
+
+        row, ref = self.model[2], self.model[2].ref
+        row.apply()
+        ref.p1 = random_string()
+        self.assertNotEqual(row.modified, ref.modified)
+
+        ref_columns = 0
+        for col, name in enumerate(self.model._column_names):
+            role = self.model._column_to_role[col]
+            index = self.model.index(2, col)
+            if role in self.model._ref_role_to_prop:
+                ref_columns += 1
+                self.assertEqual(getattr(ref, name), self.model.data(index, qtc.Qt.DisplayRole))
+            else:
+                self.assertEqual(getattr(row, name), self.model.data(index, qtc.Qt.DisplayRole))
+
+        self.assertEqual(len(self.model._ref_role_to_prop), ref_columns)
+
     def test_connect_to(self):
         # Test signals from content objects
         self.model.onChildModified = Mock()
@@ -46,3 +67,27 @@ class TestObjectModelRefs(TestCase):
 
         self.assertEqual(0, self.model.onChildModified.call_count)
         self.assertEqual(2, self.model.onChildRefModified.call_count)
+
+    def test_onChildRefModified(self):
+        self.model.dataChanged = Mock()
+        shared = self.model[3].ref
+        self.model[7].ref = shared
+        self.model.dataChanged.emit.reset_mock()
+
+        shared.p1 = random_string()
+        self.assertEqual({3, 7}, {args[0][0].row() for args in self.model.dataChanged.emit.call_args_list})
+
+    def test_ref_cell_changed(self):
+        self.model.dataChanged = Mock()
+        row, ref = self.model[4], self.model[4].ref
+        ref.apply()
+        self.model.dataChanged.emit.reset_mock()
+
+        ref.p1 = random_string()
+        ref_role = self.model._ref_prop_to_role['modified']
+        emitted = {(args[0][0].row(), args[0][0].column(), tuple(args[0][2]))
+                   for args in self.model.dataChanged.emit.call_args_list}
+
+        ref_column = next(col for col, role in self.model._column_to_role.items() if role == ref_role)
+        self.assertIn((4, ref_column, (ref_role,)), emitted)
+        self.assertNotIn(self.model.fieldIndex('modified'), {column for r, column, roles in emitted})
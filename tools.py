@@ -83,6 +83,9 @@ def get_size(obj, seen=None):
         size += sum([get_size(k, seen) for k in obj.keys()])
     elif hasattr(obj, '__dict__'):
         size += get_size(obj.__dict__, seen)
+    elif hasattr(type(obj), '__slots__'):
+        slots = [s for c in type(obj).__mro__ for s in getattr(c, '__slots__', ())]
+        size += sum([get_size(getattr(obj, s), seen) for s in slots if hasattr(obj, s)])
     elif hasattr(obj, '__iter__') and not isinstance(obj, (str, bytes, bytearray)):
         size += sum([get_size(i, seen) for i in obj])
 